@@ -2,32 +2,52 @@ import os
 import json
 import re
 import io
+import asyncio
+import uuid
+import functools
+import threading
+import hashlib
+import time
+import random
+import base64
+import multiprocessing
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import google.generativeai as genai
 from fastapi import FastAPI, Request # CHANGED: Imported FastAPI and Request
-from fastapi.responses import RedirectResponse, JSONResponse # CHANGED: Imported FastAPI responses
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, Response # CHANGED: Imported FastAPI responses
 from fastapi.middleware.cors import CORSMiddleware # CHANGED: Imported FastAPI CORS
 from starlette.middleware.sessions import SessionMiddleware # CHANGED: Imported SessionMiddleware
 from dotenv import load_dotenv
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
+from google.api_core import exceptions as google_api_exceptions
+from googleapiclient.http import MediaIoBaseDownload, build_http
+import google_auth_httplib2
 # RENAMED: Renamed 'Request' to 'GoogleAuthRequest' to avoid conflict with FastAPI's 'Request'
 from google.auth.transport.requests import Request as GoogleAuthRequest 
 from google_auth_oauthlib.flow import Flow 
 
 import uvicorn # ADDED: For running the FastAPI server
 import datetime # ADDED: This import was used in the grading logic
+from typing import TypedDict
 
 from google.cloud import vision # ADDED: Google Vision API client
 
 # Document processing
 from docx import Document # ADDED: For Word document text extraction
+from pdf_extraction import count_pdf_pages, extract_pdf_page_range
+from tesseract_worker import tesseract_ocr
+from embedding_service import MicroBatchingEncoder, load_window_tokenizer, split_into_windows, chunked_similarity, segment_similarities
+from minilm_worker import init_minilm_worker, encode_texts, loaded_backend
 
 # --- LOCAL CPU MINILM MODEL IMPORTS ---
-import torch
+# torch / sentence_transformers are imported when the model is loaded, so workers
+# running the ONNX backend (MINILM_BACKEND=onnx) never pay for importing torch
 import numpy as np
-from sentence_transformers import SentenceTransformer, util 
 
 # --- 1. INITIAL CONFIGURATION ---
 # Load .env from the same directory as this script
@@ -39,7 +59,27 @@ print(f"📁 Loading environment from: {env_path}")
 # This tells the script to use your JSON key file.
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "service-account-key.json"
 
-app = FastAPI() # CHANGED: Initialized FastAPI
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Startup/shutdown hook. Loads and warms up the MiniLM model in the background so the
+    server starts accepting requests immediately while /api/ready reports 503 until the
+    model is usable (load balancers should only route grading traffic to ready workers).
+    """
+    if MINILM_PRELOAD:
+        task = asyncio.create_task(run_blocking(warm_up_minilm_model))
+        startup_tasks.add(task)
+        task.add_done_callback(startup_tasks.discard)
+    yield
+    for process_pool in (minilm_process_pool, pdf_process_pool, tesseract_process_pool):
+        if process_pool is not None:
+            process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Strong references to background startup tasks
+startup_tasks = set()
+
+app = FastAPI(lifespan=lifespan) # CHANGED: Initialized FastAPI
 
 
 # ADDED: SessionMiddleware for session support, equivalent to Flask's app.secret_key
@@ -79,7 +119,7 @@ SCOPES = [
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 # --- MongoDB Setup ---
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
 from bson import ObjectId
 import certifi
 
@@ -130,10 +170,446 @@ except Exception as e:
 graded_assignments_history = []
 
 
+# --- PERSISTENT CACHE ---
+# Two-level cache used for expensive, reproducible results (extracted document text, etc.):
+# a size-bounded in-memory LRU in front of a persistent backend. The persistent backend is
+# a MongoDB collection when MongoDB is connected, otherwise JSON files on local disk.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "mongo").lower()  # "mongo" or "disk"
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gradepilot_cache"))
+# When the persistent layer overflows, this fraction of max_entries is evicted beyond the
+# overflow, so a full cache recounts its backend only every few percent of new entries
+CACHE_EVICTION_BATCH_FRACTION = float(os.getenv("CACHE_EVICTION_BATCH_FRACTION", "0.05"))
+
+
+class PersistentLRUCache:
+    """
+    Key/value cache for JSON-serialisable dict values.
+
+    - Memory layer: LRU bounded by the approximate JSON size of its values.
+    - Persistent layer: MongoDB collection 'cache_<name>' or directory CACHE_DIR/<name>,
+      bounded by entry count and evicted least-recently-used first, in batches.
+    - Optional ttl_seconds: entries older than this are treated as misses and removed.
+
+    Safe to use from the Google I/O worker threads.
+    """
+
+    def __init__(self, name, memory_max_bytes, max_entries, ttl_seconds=None):
+        self.name = name
+        self.memory_max_bytes = memory_max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # key -> (value, size, expires_at)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        # Upper bound on persistent entries, kept from insert results and corrected at each
+        # eviction recount (None until the first recount)
+        self._persistent_count = None
+        self._count_lock = threading.Lock()
+        self._eviction_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.collection = None
+        self.directory = None
+        if CACHE_BACKEND == "mongo" and db is not None:
+            try:
+                self.collection = db[f"cache_{name}"]
+                self.collection.create_index([("last_accessed", 1)])
+            except Exception as e:
+                print(f"⚠️ Could not use MongoDB for cache '{name}': {e}")
+                self.collection = None
+        if self.collection is None:
+            self.directory = os.path.join(CACHE_DIR, name)
+            os.makedirs(self.directory, exist_ok=True)
+
+        backend = "MongoDB" if self.collection is not None else f"disk ({self.directory})"
+        print(f"🗄️ Cache '{name}' using {backend}")
+
+    # --- memory layer ---
+
+    def _memory_get(self, key):
+        with self._lock:
+            item = self._memory.get(key)
+            if item is None:
+                return None
+            if item[2] is not None and item[2] < time.time():
+                self._memory_bytes -= self._memory.pop(key)[1]
+                return None
+            self._memory.move_to_end(key)
+            return item[0]
+
+    def _memory_set(self, key, value, expires_at):
+        size = len(json.dumps(value, default=str))
+        if size > self.memory_max_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size, expires_at)
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_max_bytes:
+                _, (_, evicted_size, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def _memory_delete(self, key):
+        with self._lock:
+            item = self._memory.pop(key, None)
+            if item is not None:
+                self._memory_bytes -= item[1]
+
+    # --- persistent layer ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + ".json")
+
+    def _persistent_get(self, key):
+        """Returns (value, expires_at) or None."""
+        if self.collection is not None:
+            doc = self.collection.find_one({"_id": key})
+            if doc is None:
+                return None
+            self.collection.update_one({"_id": key}, {"$set": {"last_accessed": datetime.datetime.now()}})
+            return doc["value"], doc.get("expires_at")
+
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            os.utime(path)  # Bump recency for LRU eviction
+            return record["value"], record.get("expires_at")
+        except FileNotFoundError:
+            return None
+
+    def _persistent_set(self, key, value, expires_at):
+        now = datetime.datetime.now()
+        if self.collection is not None:
+            result = self.collection.replace_one(
+                {"_id": key},
+                {"_id": key, "value": value, "created_at": now, "last_accessed": now, "expires_at": expires_at},
+                upsert=True
+            )
+            self._count_new_entries(1 if result.upserted_id is not None else 0)
+            return
+
+        self._count_new_entries(1 if self._disk_write(key, value, expires_at, now) else 0)
+
+    def _persistent_set_many(self, values, expires_at):
+        """Writes several entries with one bulk write (MongoDB) or one file each (disk)."""
+        now = datetime.datetime.now()
+        if self.collection is not None:
+            result = self.collection.bulk_write([
+                ReplaceOne(
+                    {"_id": key},
+                    {"_id": key, "value": value, "created_at": now, "last_accessed": now, "expires_at": expires_at},
+                    upsert=True
+                )
+                for key, value in values.items()
+            ], ordered=False)
+            self._count_new_entries(result.upserted_count)
+            return
+
+        self._count_new_entries(sum(self._disk_write(key, value, expires_at, now) for key, value in values.items()))
+
+    def _persistent_get_many(self, keys):
+        """Returns {key: (value, expires_at)} for the keys found, in one query on MongoDB."""
+        if self.collection is not None:
+            docs = list(self.collection.find({"_id": {"$in": keys}}))
+            if docs:
+                self.collection.update_many(
+                    {"_id": {"$in": [doc["_id"] for doc in docs]}},
+                    {"$set": {"last_accessed": datetime.datetime.now()}}
+                )
+            return {doc["_id"]: (doc["value"], doc.get("expires_at")) for doc in docs}
+
+        records = {}
+        for key in keys:
+            record = self._persistent_get(key)
+            if record is not None:
+                records[key] = record
+        return records
+
+    def _disk_write(self, key, value, expires_at, now):
+        """Writes one entry file; returns True if the entry is new."""
+        path = self._disk_path(key)
+        is_new = not os.path.exists(path)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"key": key, "value": value, "created_at": now.isoformat(), "expires_at": expires_at}, f, default=str)
+        os.replace(tmp_path, path)
+        return is_new
+
+    def _count_new_entries(self, added):
+        """Adds newly created entries to the running count; recounts and evicts once it passes max_entries."""
+        with self._count_lock:
+            if self._persistent_count is not None:
+                self._persistent_count += added
+                if self._persistent_count <= self.max_entries:
+                    return
+        self._evict_overflow()
+
+    def _evict_overflow(self):
+        """
+        Recounts the persistent entries and, if there are more than max_entries, removes the
+        least recently used ones down to max_entries minus one eviction batch.
+        """
+        if not self._eviction_lock.acquire(blocking=False):
+            return  # Another thread is already evicting
+        try:
+            batch_size = max(1, int(self.max_entries * CACHE_EVICTION_BATCH_FRACTION))
+            if self.collection is not None:
+                count = self.collection.estimated_document_count()
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    stale = self.collection.find({}, {"_id": 1}).sort("last_accessed", 1).limit(overflow + batch_size)
+                    count -= self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in stale]}}).deleted_count
+            else:
+                entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+                count = len(entries)
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    entries.sort(key=lambda entry: entry.stat().st_mtime)
+                    for entry in entries[:overflow + batch_size]:
+                        try:
+                            os.remove(entry.path)
+                            count -= 1
+                        except FileNotFoundError:
+                            pass
+            with self._count_lock:
+                self._persistent_count = count
+        finally:
+            self._eviction_lock.release()
+
+    def _persistent_delete(self, key):
+        if self.collection is not None:
+            self.collection.delete_one({"_id": key})
+            return
+        try:
+            os.remove(self._disk_path(key))
+        except FileNotFoundError:
+            pass
+
+    # --- public API ---
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss (or expired entry)."""
+        value = self._memory_get(key)
+        if value is None:
+            try:
+                record = self._persistent_get(key)
+            except Exception as e:
+                print(f"⚠️ Cache '{self.name}' read error: {e}")
+                record = None
+            if record is not None:
+                value, expires_at = record
+                if expires_at is not None and expires_at < time.time():
+                    self.delete(key)
+                    value = None
+                else:
+                    self._memory_set(key, value, expires_at)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_many(self, keys):
+        """
+        Batched get: returns {key: value} for the keys that hit. Memory misses are read from
+        the persistent layer together (a single $in query on MongoDB).
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._memory_get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+
+        if missing:
+            try:
+                records = self._persistent_get_many(missing)
+            except Exception as e:
+                print(f"⚠️ Cache '{self.name}' read error: {e}")
+                records = {}
+            for key, (value, expires_at) in records.items():
+                if expires_at is not None and expires_at < time.time():
+                    self.delete(key)
+                else:
+                    self._memory_set(key, value, expires_at)
+                    found[key] = value
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, values):
+        """Stores {key: value} in both layers with one persistent write. Errors are logged, not raised."""
+        if not values:
+            return
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        for key, value in values.items():
+            self._memory_set(key, value, expires_at)
+        try:
+            self._persistent_set_many(values, expires_at)
+        except Exception as e:
+            print(f"⚠️ Cache '{self.name}' write error: {e}")
+
+    def set(self, key, value):
+        """Stores value under key in both layers. Persistence errors are logged, not raised."""
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        self._memory_set(key, value, expires_at)
+        try:
+            self._persistent_set(key, value, expires_at)
+        except Exception as e:
+            print(f"⚠️ Cache '{self.name}' write error: {e}")
+
+    def delete(self, key):
+        """Removes key from both layers."""
+        self._memory_delete(key)
+        try:
+            self._persistent_delete(key)
+        except Exception as e:
+            print(f"⚠️ Cache '{self.name}' delete error: {e}")
+
+    def delete_matching(self, tags):
+        """
+        Removes every entry whose value has value[field] == match for every field/match in
+        `tags` (explicit invalidation by tag, e.g. all entries of one assignment of one course).
+        Returns the number of entries removed.
+        """
+        def matches(value):
+            return all(value.get(field) == match for field, match in tags.items())
+
+        with self._lock:
+            matching_keys = [key for key, item in self._memory.items() if matches(item[0])]
+            for key in matching_keys:
+                self._memory_bytes -= self._memory.pop(key)[1]
+
+        removed = len(matching_keys)
+        try:
+            if self.collection is not None:
+                removed = self.collection.delete_many(
+                    {f"value.{field}": match for field, match in tags.items()}
+                ).deleted_count
+            else:
+                removed = 0
+                for entry in os.scandir(self.directory):
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        with open(entry.path, 'r', encoding='utf-8') as f:
+                            record = json.load(f)
+                        if matches(record["value"]):
+                            os.remove(entry.path)
+                            removed += 1
+                    except (FileNotFoundError, ValueError):
+                        pass
+        except Exception as e:
+            print(f"⚠️ Cache '{self.name}' invalidation error: {e}")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            memory_entries = len(self._memory)
+            memory_bytes = self._memory_bytes
+        return {
+            "backend": "mongo" if self.collection is not None else "disk",
+            "memory_entries": memory_entries,
+            "memory_bytes": memory_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
 # --- LOCAL CPU MINILM MODEL SETUP ---
 # Initialize MiniLM model for semantic similarity grading (runs on local CPU/GPU)
 MINILM_MODEL = None
 MINILM_DEVICE = None
+# Inference backend: "torch" (sentence-transformers) or "onnx" (int8 ONNX Runtime export,
+# created with `python export_minilm_onnx.py`; falls back to torch if the export is missing)
+MINILM_BACKEND = os.getenv("MINILM_BACKEND", "torch").lower()
+# Backend that actually loaded ("onnx" or "torch"; differs from MINILM_BACKEND after an
+# ONNX fallback). None until the model (or, with a process pool, a worker) has loaded.
+minilm_active_backend = None
+MINILM_ONNX_MODEL_DIR = os.getenv("MINILM_ONNX_MODEL_DIR", "./minilm-finetuned-grading")
+MINILM_ONNX_FILE = os.getenv("MINILM_ONNX_FILE", os.path.join("onnx", "model_int8.onnx"))
+MINILM_ONNX_THREADS = int(os.getenv("MINILM_ONNX_THREADS", "0")) or None
+# Load the model at startup instead of on the first hybrid grade
+MINILM_PRELOAD = os.getenv("MINILM_PRELOAD", "true").lower() == "true"
+# Lifecycle of the model: not_loaded -> loading -> loaded -> ready (warmed up) | unavailable
+MINILM_STATUS = "not_loaded"
+# Serializes loading so concurrent first requests don't load the model twice
+minilm_load_lock = threading.Lock()
+MINILM_FINETUNED_PATH = "./minilm-finetuned-grading"
+MINILM_BASE_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Optional inference process pool, so torch never competes with request handling for the
+# web server's interpreter. 0 = inference thread inside the server process; "auto" = one
+# worker per MINILM_WORKER_THREADS cores, leaving one core for the web server.
+MINILM_WORKER_THREADS = max(1, int(os.getenv("MINILM_WORKER_THREADS", "1")))
+_minilm_processes_setting = os.getenv("MINILM_INFERENCE_PROCESSES", "0").lower()
+MINILM_INFERENCE_PROCESSES = (
+    max(1, ((os.cpu_count() or 2) - 1) // MINILM_WORKER_THREADS)
+    if _minilm_processes_setting == "auto" else int(_minilm_processes_setting)
+)
+minilm_process_pool = None
+minilm_process_pool_lock = threading.Lock()
+
+
+def resolve_minilm_model_name():
+    """Returns the fine-tuned model directory if present, otherwise the base model name."""
+    if os.path.exists(MINILM_FINETUNED_PATH):
+        print("📚 Found fine-tuned model for answer grading")
+        return MINILM_FINETUNED_PATH
+    print("📚 Using base MiniLM model (run 'python finetune_minilm.py' to create fine-tuned version)")
+    return MINILM_BASE_MODEL_NAME
+
+
+def get_minilm_process_pool():
+    """Returns the MiniLM inference process pool, starting it on first use."""
+    global minilm_process_pool
+    if minilm_process_pool is None:
+        with minilm_process_pool_lock:
+            if minilm_process_pool is None:
+                # Spawned (not forked) workers: forking a server process with live threads
+                # and torch/OpenMP state can deadlock the children
+                minilm_process_pool = ProcessPoolExecutor(
+                    max_workers=MINILM_INFERENCE_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_minilm_worker,
+                    initargs=(
+                        MINILM_BACKEND,
+                        resolve_minilm_model_name(),
+                        MINILM_ONNX_MODEL_DIR,
+                        MINILM_ONNX_FILE,
+                        MINILM_WORKER_THREADS
+                    )
+                )
+    return minilm_process_pool
+
+
+def run_in_minilm_pool(func, *args):
+    """
+    Runs func in the MiniLM worker pool and returns its result. A worker that dies (OOM, a
+    crash inside torch/ONNX) leaves the pool broken for good, so a broken pool is replaced
+    and the call retried once instead of failing every later hybrid grade.
+    """
+    global minilm_process_pool
+    pool = get_minilm_process_pool()
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool as e:
+        print(f"⚠️ MiniLM worker pool broke ({e}); restarting it")
+        with minilm_process_pool_lock:
+            # Concurrent callers saw the same broken pool; only the first one replaces it
+            if minilm_process_pool is pool:
+                minilm_process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        return get_minilm_process_pool().submit(func, *args).result()
+
 
 def initialize_minilm_model():
     """
@@ -146,18 +622,37 @@ def initialize_minilm_model():
     
     if MINILM_MODEL is not None:
         return MINILM_MODEL
-    
+
+    with minilm_load_lock:
+        if MINILM_MODEL is None:
+            load_minilm_model()
+    return MINILM_MODEL
+
+
+def load_minilm_model():
+    """Loads MINILM_MODEL from disk/hub (called once, under minilm_load_lock)."""
+    global MINILM_MODEL, MINILM_DEVICE, MINILM_STATUS, minilm_active_backend
+
+    MINILM_STATUS = "loading"
+
+    if MINILM_BACKEND == "onnx":
+        try:
+            from minilm_onnx import OnnxSentenceEncoder
+            MINILM_MODEL = OnnxSentenceEncoder(MINILM_ONNX_MODEL_DIR, MINILM_ONNX_FILE, MINILM_ONNX_THREADS)
+            MINILM_DEVICE = "cpu"
+            MINILM_STATUS = "loaded"
+            minilm_active_backend = "onnx"
+            print(f"✅ ONNX Runtime MiniLM model loaded from {MINILM_MODEL.onnx_path}")
+            return MINILM_MODEL
+        except Exception as e:
+            print(f"⚠️ Failed to load ONNX MiniLM model: {e}")
+            print("🔄 Falling back to the PyTorch backend...")
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
     # Check for fine-tuned model first
-    import os
-    FINETUNED_PATH = "./minilm-finetuned-grading"
-    BASE_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-    
-    if os.path.exists(FINETUNED_PATH):
-        MODEL_NAME = FINETUNED_PATH
-        print("📚 Found fine-tuned model for answer grading")
-    else:
-        MODEL_NAME = BASE_MODEL_NAME
-        print("📚 Using base MiniLM model (run 'python finetune_minilm.py' to create fine-tuned version)")
+    MODEL_NAME = resolve_minilm_model_name()
     
     # Auto-select device (CPU or best available GPU)
     if torch.cuda.is_available():
@@ -174,7 +669,7 @@ def initialize_minilm_model():
     
     try:
         MINILM_MODEL = SentenceTransformer(MODEL_NAME, device=MINILM_DEVICE)
-        model_type = "FINE-TUNED" if MODEL_NAME == FINETUNED_PATH else "BASE"
+        model_type = "FINE-TUNED" if MODEL_NAME == MINILM_FINETUNED_PATH else "BASE"
         print(f"✅ {model_type} MiniLM model loaded successfully on {MINILM_DEVICE}")
     except Exception as e:
         print(f"⚠️ Failed to load on {MINILM_DEVICE}: {e}")
@@ -183,16 +678,199 @@ def initialize_minilm_model():
             MINILM_DEVICE = "cpu"
             try:
                 MINILM_MODEL = SentenceTransformer(MODEL_NAME, device=MINILM_DEVICE)
-                model_type = "FINE-TUNED" if MODEL_NAME == FINETUNED_PATH else "BASE"
+                model_type = "FINE-TUNED" if MODEL_NAME == MINILM_FINETUNED_PATH else "BASE"
                 print(f"✅ {model_type} MiniLM model loaded successfully on CPU")
             except Exception as cpu_error:
                 print(f"❌ Failed to load MiniLM model on CPU: {cpu_error}")
                 print("⚠️ Will use Gemini-only grading")
                 MINILM_MODEL = None
     
+    MINILM_STATUS = "loaded" if MINILM_MODEL is not None else "unavailable"
+    minilm_active_backend = "torch" if MINILM_MODEL is not None else None
     return MINILM_MODEL
 
 
+def warm_up_minilm_model():
+    """
+    Loads the MiniLM model and runs a warm-up encode so torch's first-run overhead
+    (kernel selection, allocator growth) is paid at startup instead of by the first grade.
+    """
+    global MINILM_STATUS, MINILM_DEVICE
+
+    started_at = time.monotonic()
+    warm_up_texts = ["Warm-up answer key sentence.", "Warm-up student answer sentence with a few more words."]
+
+    if MINILM_INFERENCE_PROCESSES > 0:
+        # One warm-up task per worker, submitted together so every worker process starts
+        MINILM_STATUS = "loading"
+        pool = get_minilm_process_pool()
+        try:
+            for future in [pool.submit(encode_texts, warm_up_texts) for _ in range(MINILM_INFERENCE_PROCESSES)]:
+                future.result()
+            MINILM_STATUS = "ready"
+            MINILM_DEVICE = f"cpu ({MINILM_INFERENCE_PROCESSES} worker processes x {MINILM_WORKER_THREADS} threads)"
+            print(f"🔥 MiniLM worker pool ready in {time.monotonic() - started_at:.1f}s ({MINILM_DEVICE})")
+        except Exception as e:
+            MINILM_STATUS = "unavailable"
+            print(f"⚠️ MiniLM worker pool warm-up failed: {e}")
+        return
+
+    model = initialize_minilm_model()
+    if model is None:
+        return
+
+    try:
+        model.encode(warm_up_texts, convert_to_numpy=True)
+        MINILM_STATUS = "ready"
+        print(f"🔥 MiniLM model warmed up in {time.monotonic() - started_at:.1f}s")
+    except Exception as e:
+        MINILM_STATUS = "unavailable"
+        print(f"⚠️ MiniLM warm-up failed: {e}")
+
+
+def encode_minilm_batch(texts):
+    """Runs one batched forward pass of MiniLM, in a worker process when the pool is enabled."""
+    if MINILM_INFERENCE_PROCESSES > 0:
+        return run_in_minilm_pool(encode_texts, texts)
+
+    model = initialize_minilm_model()
+    if model is None:
+        raise RuntimeError("MiniLM model not available")
+    return model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+
+# Concurrent encode calls (e.g. several hybrid grades at once) are merged into one
+# padded batch on a dedicated inference thread instead of one forward pass per text.
+# With the process pool, one dispatch thread per worker keeps every worker busy.
+minilm_encoder = MicroBatchingEncoder(
+    encode_minilm_batch,
+    max_batch_size=int(os.getenv("MINILM_BATCH_MAX_SIZE", "32")),
+    max_wait_ms=float(os.getenv("MINILM_BATCH_MAX_WAIT_MS", "5")),
+    dispatch_threads=max(1, MINILM_INFERENCE_PROCESSES)
+)
+
+
+# Long answer keys and submissions are split into overlapping token windows (MiniLM
+# truncates at 256 tokens) and all windows are encoded together in one batch
+MINILM_CHUNK_TOKENS = int(os.getenv("MINILM_CHUNK_TOKENS", "200"))
+MINILM_CHUNK_OVERLAP = int(os.getenv("MINILM_CHUNK_OVERLAP", "50"))
+# "maxsim" (align each answer key chunk with its best-matching submission chunk) or "mean"
+MINILM_CHUNK_POOLING = os.getenv("MINILM_CHUNK_POOLING", "maxsim").lower()
+minilm_tokenizer = None
+minilm_tokenizer_loaded = False
+
+
+def get_minilm_tokenizer():
+    """
+    Returns the model's fast tokenizer (from tokenizer.json) for token-accurate chunking,
+    or None if unavailable, in which case chunks are sized by whitespace words.
+    """
+    global minilm_tokenizer, minilm_tokenizer_loaded
+    if not minilm_tokenizer_loaded:
+        tokenizer_path = os.path.join(MINILM_FINETUNED_PATH, "tokenizer.json")
+        try:
+            if os.path.exists(tokenizer_path):
+                minilm_tokenizer = load_window_tokenizer(tokenizer_path)
+        except Exception as e:
+            print(f"⚠️ Could not load MiniLM tokenizer ({e}); chunking by words")
+        minilm_tokenizer_loaded = True
+    return minilm_tokenizer
+
+
+def chunk_for_minilm(text):
+    """Splits text into overlapping windows that fit MiniLM's max sequence length."""
+    return split_into_windows(text, MINILM_CHUNK_TOKENS, MINILM_CHUNK_OVERLAP, get_minilm_tokenizer())
+
+
+# --- EMBEDDING STORE ---
+# Chunk embeddings are persisted, keyed by SHA-256 of (model identifier, whitespace-normalized
+# text). The answer key is then embedded once per assignment instead of once per student, and
+# regrades reuse the submission embeddings. The model identifier fingerprints the model files,
+# so re-fine-tuning or switching backend automatically starts a fresh key space.
+minilm_embedding_store = PersistentLRUCache(
+    "embeddings",
+    memory_max_bytes=int(os.getenv("EMBEDDING_STORE_MEMORY_MB", "32")) * 1024 * 1024,
+    max_entries=int(os.getenv("EMBEDDING_STORE_MAX_ENTRIES", "100000"))
+)
+minilm_model_id = None
+
+
+def get_minilm_active_backend():
+    """
+    The backend embeddings are actually computed with ("onnx" or "torch"), loading the model
+    (or asking a worker process) on first use. None while MiniLM is unavailable.
+    """
+    global minilm_active_backend
+    if minilm_active_backend is None:
+        if MINILM_INFERENCE_PROCESSES > 0:
+            try:
+                minilm_active_backend = run_in_minilm_pool(loaded_backend)
+            except Exception as e:
+                print(f"⚠️ Could not read the MiniLM worker backend: {e}")
+        else:
+            initialize_minilm_model()
+    return minilm_active_backend
+
+
+def get_minilm_model_id():
+    """
+    Identifier of the active MiniLM model: the backend that actually loaded (so an ONNX
+    fallback to torch gets its own key space), model name and a fingerprint of its files.
+    """
+    global minilm_model_id
+    if minilm_model_id is None:
+        backend = get_minilm_active_backend()
+        if backend is None:
+            # Nothing can be encoded, so nothing is stored under this id; don't cache it
+            return f"unavailable:{MINILM_BACKEND}"
+        model_name = MINILM_FINETUNED_PATH if os.path.exists(MINILM_FINETUNED_PATH) else MINILM_BASE_MODEL_NAME
+        parts = [backend, model_name]
+        if backend == "onnx":
+            parts.append(MINILM_ONNX_FILE)
+        if os.path.isdir(model_name):
+            for root, _, files in sorted(os.walk(model_name)):
+                for file_name in sorted(files):
+                    stat = os.stat(os.path.join(root, file_name))
+                    parts.append(f"{os.path.relpath(os.path.join(root, file_name), model_name)}:{stat.st_size}:{int(stat.st_mtime)}")
+        fingerprint = hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()[:16]
+        minilm_model_id = f"{backend}:{os.path.basename(model_name)}@{fingerprint}"
+    return minilm_model_id
+
+
+def embedding_store_key(text):
+    """Embedding store key for a text under the active model."""
+    normalized_text = " ".join(text.split())
+    return hashlib.sha256(f"{get_minilm_model_id()}\n{normalized_text}".encode('utf-8')).hexdigest()
+
+
+def encode_minilm_texts(texts):
+    """
+    Embeds texts (one row per text), serving stored embeddings and encoding only the
+    misses, in one batch through the shared micro-batching encoder. The store is read
+    with one batched lookup and the new embeddings are written back with one batched write.
+    """
+    keys = [embedding_store_key(text) for text in texts]
+    stored = minilm_embedding_store.get_many(keys)
+    vectors = {
+        key: np.frombuffer(base64.b64decode(record["embedding"]), dtype=np.float32)
+        for key, record in stored.items()
+    }
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+
+    if missing:
+        embeddings = minilm_encoder.encode(list(missing.values()))
+        new_records = {}
+        for key, embedding in zip(missing, embeddings):
+            vectors[key] = np.asarray(embedding, dtype=np.float32)
+            new_records[key] = {
+                "embedding": base64.b64encode(vectors[key].tobytes()).decode('ascii'),
+                "model": get_minilm_model_id()
+            }
+        minilm_embedding_store.set_many(new_records)
+
+    return np.stack([vectors[key] for key in keys])
+
+
 def get_minilm_semantic_score(teacher_answer, student_answer):
     """
     Calculate semantic similarity between teacher and student answers using MiniLM model.
@@ -205,18 +883,25 @@ def get_minilm_semantic_score(teacher_answer, student_answer):
         float or None: Cosine similarity score (0.0-1.0), or None if model unavailable
     """
     try:
-        model = initialize_minilm_model()
-        
-        if model is None:
+        # Worker processes load their own model; in-process inference needs it loaded here
+        if MINILM_INFERENCE_PROCESSES == 0 and initialize_minilm_model() is None:
             print("⚠️ MiniLM model not available")
             return None
         
-        # Encode both answers
-        teacher_emb = model.encode(teacher_answer, convert_to_numpy=True)
-        student_emb = model.encode(student_answer, convert_to_numpy=True)
+        teacher_chunks = chunk_for_minilm(teacher_answer)
+        student_chunks = chunk_for_minilm(student_answer)
+        if not teacher_chunks or not student_chunks:
+            return 0.0
+
+        # Encode every chunk of both answers in one batch (stored chunks are not re-encoded)
+        embeddings = encode_minilm_texts(teacher_chunks + student_chunks)
         
-        # Calculate cosine similarity
-        similarity = float(np.dot(teacher_emb, student_emb) / (np.linalg.norm(teacher_emb) * np.linalg.norm(student_emb)))
+        # Calculate cosine similarity (identical to whole-text cosine when both fit in one chunk)
+        similarity = chunked_similarity(
+            embeddings[:len(teacher_chunks)],
+            embeddings[len(teacher_chunks):],
+            MINILM_CHUNK_POOLING
+        )
         
         return similarity
     
@@ -225,6 +910,90 @@ def get_minilm_semantic_score(teacher_answer, student_answer):
         return None
 
 
+# Matches "Question 1:", "Question 2.", "Q3)", "**Question 4:**" at the start of a line,
+# the numbering generate_initial_key asks Gemini to use for answer keys
+QUESTION_HEADING_PATTERN = re.compile(r'^[ \t>#*_]*(?:question|q)[ \t]*\.?[ \t]*(\d+)[ \t*_]*[:.)\-][ \t*_]*', re.IGNORECASE | re.MULTILINE)
+
+
+def split_into_questions(text):
+    """
+    Splits a questionnaire, answer key or submission into numbered questions.
+
+    Returns:
+        dict: question number -> text of that question's section (in document order);
+            text before the first "Question N" heading is ignored
+    """
+    questions = {}
+    headings = list(QUESTION_HEADING_PATTERN.finditer(text or ""))
+    for index, heading in enumerate(headings):
+        end = headings[index + 1].start() if index + 1 < len(headings) else len(text)
+        section = text[heading.end():end].strip()
+        number = int(heading.group(1))
+        questions[number] = f"{questions[number]}\n{section}".strip() if number in questions else section
+    return questions
+
+
+def get_minilm_question_scores(teacher_answer, student_answer, questionnaire_text=None):
+    """
+    Per-question MiniLM similarity between an answer key and a submission that both use
+    "Question N:" numbering. Every question's chunks (key and submission) are encoded in a
+    single batched forward pass, and all questions are scored with one vectorized
+    similarity computation.
+
+    Returns:
+        dict or None: {"similarity": mean over the key's questions (unanswered = 0),
+            "questions": [per-question breakdown]}, or None if the texts are not
+            segmented by question (or the model is unavailable)
+    """
+    key_questions = split_into_questions(teacher_answer)
+    student_questions = split_into_questions(student_answer)
+    answered = [number for number in key_questions if student_questions.get(number)]
+    if len(key_questions) < 2 or not answered:
+        return None
+
+    try:
+        if MINILM_INFERENCE_PROCESSES == 0 and initialize_minilm_model() is None:
+            return None
+
+        key_chunks, key_spans, student_chunks, student_spans = [], [], [], []
+        for number in answered:
+            chunks = chunk_for_minilm(key_questions[number]) or [key_questions[number]]
+            key_spans.append((len(key_chunks), len(key_chunks) + len(chunks)))
+            key_chunks.extend(chunks)
+            chunks = chunk_for_minilm(student_questions[number])
+            student_spans.append((len(student_chunks), len(student_chunks) + len(chunks)))
+            student_chunks.extend(chunks)
+
+        embeddings = encode_minilm_texts(key_chunks + student_chunks)
+        similarities = segment_similarities(
+            embeddings[:len(key_chunks)], key_spans,
+            embeddings[len(key_chunks):], student_spans,
+            MINILM_CHUNK_POOLING
+        )
+    except Exception as e:
+        print(f"⚠️ Error calculating per-question MiniLM similarity: {e}")
+        return None
+
+    answered_similarity = dict(zip(answered, (float(similarity) for similarity in similarities)))
+    questionnaire_questions = split_into_questions(questionnaire_text) if questionnaire_text else {}
+    breakdown = []
+    for number in key_questions:
+        similarity = answered_similarity.get(number)
+        question_text = questionnaire_questions.get(number)
+        breakdown.append({
+            "question": number,
+            "question_text": question_text[:200] if question_text else None,
+            "answered": similarity is not None,
+            "similarity": round(similarity, 4) if similarity is not None else 0.0,
+            "minilm_grade": normalize_minilm_score_to_grade(similarity) if similarity is not None else 0
+        })
+
+    return {
+        "similarity": sum(answered_similarity.values()) / len(key_questions),
+        "questions": breakdown
+    }
+
+
 def normalize_minilm_score_to_grade(similarity_score):
     """
     Convert MiniLM similarity score (0.3-0.85) to a grade (0-100) using min-max normalization.
@@ -323,10 +1092,94 @@ def credentials_to_dict(credentials):
         'scopes': credentials.scopes
     }
 
+def credentials_from_dict(creds_data):
+    """Rebuilds a Google Credentials object from the dictionary stored in the session."""
+    return Credentials(
+        token=creds_data['token'],
+        refresh_token=creds_data['refresh_token'],
+        token_uri=creds_data['token_uri'],
+        client_id=creds_data['client_id'],
+        client_secret=creds_data['client_secret'],
+        scopes=creds_data['scopes']
+    )
+
+# --- GOOGLE SERVICE CACHE ---
+# Building a service parses a discovery document and creates a transport, so built services
+# are reused. Discovery documents come from the copies bundled with googleapiclient
+# (static_discovery), and built services are kept per credential identity (OAuth client +
+# refresh token) in a bounded LRU. Requests are always executed on the calling thread's own
+# transport (see execute_google_request), so sharing a service object across threads is safe.
+GOOGLE_SERVICE_CACHE_SIZE = int(os.getenv("GOOGLE_SERVICE_CACHE_SIZE", "256"))
+# credential identity -> {"credentials": Credentials, "services": {(name, version): service},
+#                         "refresh_lock": Lock serializing token refreshes of these credentials}
+google_service_cache = OrderedDict()
+google_service_cache_lock = threading.Lock()
+
+
+def credential_identity(creds_data):
+    """Stable identity of a user's credentials; unchanged when the access token is refreshed."""
+    identity_source = f"{creds_data['client_id']}\n{creds_data.get('refresh_token') or creds_data['token']}"
+    return hashlib.sha256(identity_source.encode('utf-8')).hexdigest()
+
+
+def get_cached_credentials(creds_data):
+    """
+    Returns the shared Credentials object for these credentials, creating it on first use.
+    The cached object is the one services are bound to, so a refresh is seen by all of them.
+    """
+    identity = credential_identity(creds_data)
+    with google_service_cache_lock:
+        entry = google_service_cache.get(identity)
+        if entry is None:
+            entry = {"credentials": credentials_from_dict(creds_data), "services": {}, "refresh_lock": threading.Lock()}
+            google_service_cache[identity] = entry
+            while len(google_service_cache) > GOOGLE_SERVICE_CACHE_SIZE:
+                google_service_cache.popitem(last=False)
+        else:
+            google_service_cache.move_to_end(identity)
+        return entry["credentials"]
+
+
+def get_credentials_refresh_lock(creds_data):
+    """
+    Returns the lock serializing token refreshes of one user's shared credentials, so a slow
+    refresh only holds up requests of that same user.
+    """
+    with google_service_cache_lock:
+        entry = google_service_cache.get(credential_identity(creds_data))
+    # An evicted entry's credentials are no longer shared, so a private lock is enough
+    return entry["refresh_lock"] if entry is not None else threading.Lock()
+
+
+def get_cached_service(creds_data, service_name, version):
+    """Returns a built service for these credentials, building it only on first use."""
+    identity = credential_identity(creds_data)
+    creds = get_cached_credentials(creds_data)
+    with google_service_cache_lock:
+        entry = google_service_cache.get(identity)
+        service = entry["services"].get((service_name, version)) if entry is not None else None
+    if service is not None:
+        return service
+
+    service = build(service_name, version, credentials=creds, static_discovery=True, cache_discovery=False)
+    with google_service_cache_lock:
+        entry = google_service_cache.get(identity)
+        if entry is not None and entry["credentials"] is creds:
+            service = entry["services"].setdefault((service_name, version), service)
+    return service
+
+
+def evict_cached_credentials(creds_data):
+    """Drops the cached credentials and services of a user (e.g. after a failed refresh)."""
+    with google_service_cache_lock:
+        google_service_cache.pop(credential_identity(creds_data), None)
+
+
 # MODIFIED: Function now requires the 'request' object to access the session
 def get_google_service(service_name, version, request: Request): 
     """
-    Builds and returns an authorized Google API service object (e.g., Classroom, Drive).
+    Returns an authorized Google API service object (e.g., Classroom, Drive), reusing the
+    cached service for this user when available.
     Handles refreshing expired access tokens using the refresh token.
     
     MODIFIED: Now takes 'request: Request' as an argument to access session data.
@@ -337,211 +1190,901 @@ def get_google_service(service_name, version, request: Request):
 
     # CHANGED: 'session' is now 'request.session'
     creds_data = request.session['credentials']
-    creds = Credentials(
-        token=creds_data['token'],
-        refresh_token=creds_data['refresh_token'],
-        token_uri=creds_data['token_uri'],
-        client_id=creds_data['client_id'],
-        client_secret=creds_data['client_secret'],
-        scopes=creds_data['scopes']
-    )
+    creds = get_cached_credentials(creds_data)
 
     if not creds.valid:
         if creds.expired and creds.refresh_token:
-            print("Refreshing Google Access Token...")
             try:
-                # CHANGED: Using 'GoogleAuthRequest' to avoid name conflict
-                creds.refresh(GoogleAuthRequest()) 
-                # CHANGED: 'session' is now 'request.session'
-                request.session['credentials'] = credentials_to_dict(creds)
+                with get_credentials_refresh_lock(creds_data):
+                    # Another request may have refreshed the shared credentials meanwhile
+                    if not creds.valid:
+                        print("Refreshing Google Access Token...")
+                        # CHANGED: Using 'GoogleAuthRequest' to avoid name conflict
+                        creds.refresh(GoogleAuthRequest()) 
             except Exception as e:
                 print(f"Failed to refresh token: {e}")
+                evict_cached_credentials(creds_data)
                 # CHANGED: 'session' is now 'request.session'
                 request.session.clear()
                 return None
         else:
             print("Credentials invalid and no refresh token or not expired. Re-authentication needed.")
+            evict_cached_credentials(creds_data)
             # CHANGED: 'session' is now 'request.session'
             request.session.clear()
             return None
+
+    if creds.token != creds_data['token']:
+        # Keep the session in step with the (possibly refreshed) shared credentials
+        # CHANGED: 'session' is now 'request.session'
+        request.session['credentials'] = credentials_to_dict(creds)
     
     try:
-        service = build(service_name, version, credentials=creds)
-        return service
+        return get_cached_service(creds_data, service_name, version)
     except HttpError as error:
         print(f'An error occurred building Google service {service_name} v{version}: {error}')
         return None
 
-def extract_drive_file_id_from_url(url):
-    """
-    Extracts the Google Drive file ID from various Google Drive/Docs/Sheets/Slides URL formats.
-    Returns the file ID string, or None if not found.
-    """
-    # NO CHANGE: This function is framework-independent.
-    match = re.search(r'/d/([a-zA-Z0-9_-]+)', url)
-    if match:
-        return match.group(1)
-    return None
+# --- OUTBOUND RATE LIMITING ---
+# Every outbound call to Gemini, Classroom, Drive, Sheets and Vision takes a token from a
+# per-API token bucket, so parallel grading runs stay at the quota ceiling instead of
+# tripping 429s. Calls that still hit RESOURCE_EXHAUSTED (or a transient 5xx) are retried
+# with jittered exponential backoff instead of becoming lost grades.
+API_RATE_LIMITS_PER_MINUTE = {
+    "gemini": int(os.getenv("GEMINI_RATE_PER_MINUTE", "60")),
+    "classroom": int(os.getenv("CLASSROOM_RATE_PER_MINUTE", "600")),
+    "drive": int(os.getenv("DRIVE_RATE_PER_MINUTE", "600")),
+    "sheets": int(os.getenv("SHEETS_RATE_PER_MINUTE", "300")),
+    "vision": int(os.getenv("VISION_RATE_PER_MINUTE", "600")),
+    "google": int(os.getenv("GOOGLE_API_RATE_PER_MINUTE", "600")),  # Any other Google API
+}
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "5"))
+API_BACKOFF_BASE_SECONDS = float(os.getenv("API_BACKOFF_BASE_SECONDS", "1.0"))
+API_BACKOFF_MAX_SECONDS = float(os.getenv("API_BACKOFF_MAX_SECONDS", "32.0"))
+
+RETRYABLE_HTTP_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_GOOGLE_EXCEPTIONS = (
+    google_api_exceptions.ResourceExhausted,
+    google_api_exceptions.ServiceUnavailable,
+    google_api_exceptions.InternalServerError,
+    google_api_exceptions.DeadlineExceeded,
+)
 
 
-def download_drive_file_content(drive_service, file_id, file_name="unknown"):
+class TokenBucket:
     """
-    Downloads a Google Drive file's content as plain text.
-    
-    - If it's a Google Doc/Sheet, it exports as text/plain.
-    - If it's a Word document (.docx), it extracts text using python-docx.
-    - If it's an Image (JPG, PNG) or PDF, it downloads the bytes 
-      and uses the Google Cloud Vision API to extract handwritten text.
-    - Otherwise, it attempts a standard text download.
+    Thread-safe token bucket refilled at rate_per_minute, holding at most `burst` tokens.
+    Usable from worker threads (acquire) and from the event loop (acquire_async).
     """
-    try:
-        file_metadata = drive_service.files().get(fileId=file_id, fields='mimeType, name').execute()
-        mime_type = file_metadata.get('mimeType')
-        actual_file_name = file_metadata.get('name', file_name)
-        print(f"Downloading '{actual_file_name}' (ID: {file_id}) with MIME type: {mime_type}")
 
-        # --- BRANCH 1: Google Workspace Docs ---
-        if mime_type.startswith('application/vnd.google-apps'):
-            print("File is a Google Doc. Exporting as text/plain.")
-            request = drive_service.files().export_media(fileId=file_id, mimeType='text/plain')
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            return fh.getvalue().decode('utf-8')
+    def __init__(self, name, rate_per_minute, burst=None):
+        self.name = name
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst or max(1, rate_per_minute // 6)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.waiting = 0           # Callers currently queued for a token
+        self.calls = 0             # Tokens granted
+        self.throttled = 0         # Calls that had to wait for a token
+        self.retries = 0           # Calls retried after a 429/5xx
+
+    def _take_or_wait_time(self, count=1):
+        """Takes `count` tokens and returns 0, or returns how long to wait before they are available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate_per_second)
+            self.updated_at = now
+            if self.tokens >= count:
+                self.tokens -= count
+                self.calls += count
+                return 0
+            return (count - self.tokens) / self.rate_per_second
+
+    def acquire(self, count=1):
+        """Blocks until `count` tokens (one per API call, at most `burst`) are available."""
+        wait_time = self._take_or_wait_time(count)
+        if wait_time == 0:
+            return
+        with self._lock:
+            self.throttled += 1
+            self.waiting += 1
+        try:
+            while wait_time > 0:
+                time.sleep(wait_time)
+                wait_time = self._take_or_wait_time(count)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    async def acquire_async(self):
+        wait_time = self._take_or_wait_time()
+        if wait_time == 0:
+            return
+        with self._lock:
+            self.throttled += 1
+            self.waiting += 1
+        try:
+            while wait_time > 0:
+                await asyncio.sleep(wait_time)
+                wait_time = self._take_or_wait_time()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate_per_minute": round(self.rate_per_second * 60),
+                "burst": self.burst,
+                "available_tokens": round(self.tokens, 2),
+                "queue_depth": self.waiting,
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "retries": self.retries
+            }
 
-        # --- BRANCH 2: Word Documents (.docx and .doc) ---
-        elif mime_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword']:
-            print(f"File is a Word document ({mime_type}). Extracting text with python-docx...")
-            request = drive_service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            
-            try:
-                # Extract text from Word document
-                doc = Document(fh)
-                full_text = []
-                for paragraph in doc.paragraphs:
-                    if paragraph.text.strip():  # Skip empty paragraphs
-                        full_text.append(paragraph.text)
-                
-                # Also extract text from tables
-                for table in doc.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            if cell.text.strip():
-                                full_text.append(cell.text)
-                
-                extracted_text = '\n'.join(full_text)
-                print(f"Successfully extracted {len(extracted_text)} characters from Word document.")
-                return extracted_text
-            except Exception as docx_error:
-                print(f"Error extracting text from Word document: {docx_error}")
-                # Fallback: try generic text extraction
-                try:
-                    fh.seek(0)
-                    return fh.getvalue().decode('utf-8')
-                except:
-                    return None
-
-        # --- BRANCH 3: Images or PDFs ---
-        elif mime_type in ['image/jpeg', 'image/png', 'application/pdf']:
-            print("File is an Image/PDF. Downloading bytes for Cloud Vision API...")
-            request = drive_service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            
-            content_bytes = fh.getvalue()
-            
-            print("Bytes downloaded. Sending to Cloud Vision API for handwriting detection...")
-            
-            # --- This is the logic from your detect.py ---
-            client = vision.ImageAnnotatorClient()
-            image = vision.Image(content=content_bytes)
-            image_context = vision.ImageContext(language_hints=["en-t-i0-handwrit"])
-            
-            response = client.document_text_detection(
-                image=image,
-                image_context=image_context
-            )
-            
-            if response.error.message:
-                print(f"Cloud Vision API Error: {response.error.message}")
-                return None
-            
-            if response.full_text_annotation:
-                print("Cloud Vision API successful. Returning extracted text.")
-                print(f"--- OCR TEXT FROM {actual_file_name} ---\n{response.full_text_annotation.text}\n---------------------------------")
-                return response.full_text_annotation.text
-            else:
-                print("Cloud Vision API found no text in the image.")
-                return "" # Return empty string if no text is found
 
-        # --- BRANCH 4: Other files (e.g., .txt) ---
-        else:
-            print("File is not a Google Doc, Word document, or Image. Attempting direct media download.")
-            request = drive_service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
+api_rate_limiters = {
+    api_name: TokenBucket(api_name, rate_per_minute)
+    for api_name, rate_per_minute in API_RATE_LIMITS_PER_MINUTE.items()
+}
 
-            try:
-                return fh.getvalue().decode('utf-8')
-            except UnicodeDecodeError:
-                print(f"UTF-8 decode failed for '{actual_file_name}', trying latin-1.")
-                return fh.getvalue().decode('latin-1')
 
-    except HttpError as error:
-        print(f'Google Drive API Error downloading file "{actual_file_name}" (ID: {file_id}): {error.resp.status} - {error.content.decode("utf-8")}')
-        return None   
+def is_retryable_api_error(error):
+    """True for quota (429) and transient server errors worth retrying."""
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_HTTP_STATUSES
+    return isinstance(error, RETRYABLE_GOOGLE_EXCEPTIONS)
 
-    except Exception as e:
-        print(f'Unexpected error in download_drive_file_content for "{actual_file_name}" (ID: {file_id}): {e}')
-        return None
 
-# --- 3. AUTHENTICATION ROUTES ---
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff delay for the given retry attempt (0-based)."""
+    return random.uniform(0, min(API_BACKOFF_MAX_SECONDS, API_BACKOFF_BASE_SECONDS * (2 ** attempt)))
 
-# CHANGED: Converted Flask @app.route to FastAPI @app.get
-# ADDED: 'request: Request' parameter for session and url_for
-@app.get('/login')
-async def login(request: Request):
-    """Initiates the Google OAuth 2.0 login flow, redirecting to Google's consent screen."""
-    flow = Flow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE,
-        scopes=SCOPES, # Use the updated SCOPES list
-        # CHANGED: 'url_for' is now 'request.url_for' and requires the endpoint 'name'
-        redirect_uri=request.url_for('callback')
+
+def call_with_rate_limit(api_name, func, *args, api_calls=1, **kwargs):
+    """
+    Blocking call through the API's token bucket, retrying quota/transient errors with backoff.
+    `api_calls` is how many API calls func makes (e.g. the size of a batch request); each one
+    takes its own token, as each counts separately against Google's quota.
+    """
+    limiter = api_rate_limiters[api_name]
+    for attempt in range(API_MAX_RETRIES + 1):
+        limiter.acquire(api_calls)
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            if attempt == API_MAX_RETRIES or not is_retryable_api_error(error):
+                raise
+            limiter.record_retry()
+            delay = backoff_delay(attempt)
+            print(f"⏳ {api_name} call throttled/failed ({error.__class__.__name__}); retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+async def call_with_rate_limit_async(api_name, func, *args, **kwargs):
+    """Async equivalent of call_with_rate_limit for coroutine functions."""
+    limiter = api_rate_limiters[api_name]
+    for attempt in range(API_MAX_RETRIES + 1):
+        await limiter.acquire_async()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as error:
+            if attempt == API_MAX_RETRIES or not is_retryable_api_error(error):
+                raise
+            limiter.record_retry()
+            delay = backoff_delay(attempt)
+            print(f"⏳ {api_name} call throttled/failed ({error.__class__.__name__}); retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def generate_gemini_content(model, prompt):
+    """Rate-limited, retrying wrapper around model.generate_content_async."""
+    return await call_with_rate_limit_async("gemini", model.generate_content_async, prompt)
+
+
+async def stream_gemini_content(model, prompt):
+    """
+    Rate-limited wrapper around the streaming generate API; yields text chunks as they
+    arrive. Quota/transient errors are retried only until the first chunk is sent.
+    """
+    limiter = api_rate_limiters["gemini"]
+    for attempt in range(API_MAX_RETRIES + 1):
+        await limiter.acquire_async()
+        started = False
+        try:
+            response = await model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                text = chunk.text if chunk.parts else ""
+                if text:
+                    started = True
+                    yield text
+            return
+        except Exception as error:
+            if started or attempt == API_MAX_RETRIES or not is_retryable_api_error(error):
+                raise
+            limiter.record_retry()
+            delay = backoff_delay(attempt)
+            print(f"⏳ gemini stream throttled/failed ({error.__class__.__name__}); retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+# --- SERVER-SENT EVENTS ---
+def sse_event(event, data):
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def sse_response(event_stream):
+    """Wraps an async generator of sse_event strings in an unbuffered streaming response."""
+    return StreamingResponse(
+        event_stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    authorization_url, state = flow.authorization_url(access_type='offline', prompt='consent')
-    # CHANGED: 'session' is now 'request.session'
-    request.session['state'] = state
-    # CHANGED: 'redirect' is now 'RedirectResponse'
-    return RedirectResponse(authorization_url)
 
-# CHANGED: Converted Flask @app.route to FastAPI @app.get
-# ADDED: 'request: Request' parameter
-# ADDED: 'name="callback"' to allow request.url_for('callback') to work
-@app.get('/auth/callback', name="callback")
-async def callback(request: Request):
-    """Handles the callback from Google after a user grants or denies permissions."""
-    
-    # CHANGED: 'session' is now 'request.session'
-    # CHANGED: 'request.args.get' is now 'request.query_params.get'
-    if 'state' not in request.session or request.session['state'] != request.query_params.get('state'):
-        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-        return JSONResponse(content={"error": "State mismatch. Possible CSRF attack."}, status_code=400)
 
-    flow = Flow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE,
+# --- BLOCKING I/O THREAD POOL ---
+# googleapiclient, Drive downloads and Cloud Vision are all blocking. Routes hand them
+# to this executor so one slow download or OCR call never stalls the event loop.
+# httplib2 transports are not thread-safe, so every worker thread keeps its own.
+GOOGLE_IO_MAX_WORKERS = int(os.getenv("GOOGLE_IO_MAX_WORKERS", "16"))
+google_io_executor = ThreadPoolExecutor(max_workers=GOOGLE_IO_MAX_WORKERS, thread_name_prefix="google-io")
+# Blocking work that makes several rate-limited calls (Drive downloads with OCR, batched
+# roster lookups, job setup) sleeps on its thread while throttled or backing off. It gets a
+# bounded pool of its own, so throttled grading jobs never starve the short calls on
+# google_io_executor (service construction, listing pages) of threads.
+GOOGLE_THROTTLED_IO_MAX_WORKERS = int(os.getenv("GOOGLE_THROTTLED_IO_MAX_WORKERS", "16"))
+throttled_io_executor = ThreadPoolExecutor(max_workers=GOOGLE_THROTTLED_IO_MAX_WORKERS, thread_name_prefix="google-throttled-io")
+google_io_local = threading.local()
+
+
+def get_thread_http(credentials):
+    """
+    Returns an authorized http object backed by this thread's own httplib2 transport,
+    so requests issued from different worker threads never share a connection.
+    """
+    base_http = getattr(google_io_local, 'http', None)
+    if base_http is None:
+        base_http = build_http()
+        google_io_local.http = base_http
+    return google_auth_httplib2.AuthorizedHttp(credentials, http=base_http)
+
+
+def send_google_request(http_request):
+    """Executes a googleapiclient HttpRequest on the calling thread's transport (not rate limited)."""
+    return http_request.execute(http=get_thread_http(http_request.http.credentials))
+
+
+def execute_google_request(http_request, api_name):
+    """
+    Executes a googleapiclient HttpRequest through the `api_name` rate limiter, on the calling
+    thread's transport. Throttle waits block the thread: call it from run_throttled work.
+    """
+    return call_with_rate_limit(api_name, send_google_request, http_request)
+
+
+def download_google_media(media_request, api_name):
+    """
+    Downloads a get_media/export_media request into memory using the calling thread's
+    transport, through the `api_name` rate limiter (call it from run_throttled work).
+    """
+    media_request.http = get_thread_http(media_request.http.credentials)
+
+    def download():
+        fh = io.BytesIO()
+        downloader = MediaIoBaseDownload(fh, media_request)
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
+        return fh
+
+    return call_with_rate_limit(api_name, download)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking function on the Google I/O thread pool and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(google_io_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_throttled(func, *args, **kwargs):
+    """Runs blocking work that makes rate-limited Google calls on the throttled I/O pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(throttled_io_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_google_request(http_request, api_name):
+    """
+    Awaitable, rate-limited equivalent of http_request.execute(). Token-bucket waits and
+    retry backoff are awaited on the event loop; only the HTTP call itself takes a thread.
+    """
+    return await call_with_rate_limit_async(api_name, run_blocking, send_google_request, http_request)
+
+
+# --- PAGINATED LIST CALLS ---
+# Field masks for Classroom list calls: only the fields the routes and the frontend use
+COURSE_LIST_FIELDS = "id,name,section,descriptionHeading,room,courseState,alternateLink"
+COURSEWORK_LIST_FIELDS = "id,title,description,workType,state,dueDate,dueTime,maxPoints,materials,creationTime,updateTime,alternateLink"
+SUBMISSION_LIST_FIELDS = "id,userId,courseWorkId,state,late,assignedGrade,draftGrade,assignmentSubmission,creationTime,updateTime,alternateLink"
+GOOGLE_LIST_PAGE_SIZE = int(os.getenv("GOOGLE_LIST_PAGE_SIZE", "100"))
+
+
+async def iterate_google_pages(list_method, items_key, api_name, fields=None, **params):
+    """
+    Async generator over every page of a paginated Google list call, following
+    nextPageToken until the last page. The next page is requested as soon as the current
+    one arrives, so it downloads while the caller processes the current page.
+
+    Args:
+        list_method: bound list method, e.g. classroom_service.courses().list
+        items_key (str): response key holding the page's items, e.g. 'courses'
+        api_name (str): rate limiter bucket of the service, e.g. 'classroom'
+        fields (str): optional field mask for each item (nextPageToken is always requested)
+        **params: arguments passed to every list call
+
+    Yields:
+        list: the items of one page
+    """
+    def page_request(page_token):
+        request_params = dict(params, pageSize=GOOGLE_LIST_PAGE_SIZE)
+        if fields:
+            request_params['fields'] = f"nextPageToken,{items_key}({fields})"
+        if page_token:
+            request_params['pageToken'] = page_token
+        return list_method(**request_params)
+
+    next_page = asyncio.ensure_future(run_google_request(page_request(None), api_name))
+    try:
+        while next_page is not None:
+            response = await next_page
+            page_token = response.get('nextPageToken')
+            next_page = asyncio.ensure_future(run_google_request(page_request(page_token), api_name)) if page_token else None
+            yield response.get(items_key, [])
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+
+async def iterate_google_items(list_method, items_key, api_name, fields=None, **params):
+    """Async generator over every item of a paginated Google list call (see iterate_google_pages)."""
+    async for page in iterate_google_pages(list_method, items_key, api_name, fields, **params):
+        for item in page:
+            yield item
+
+
+async def list_google_items(list_method, items_key, api_name, fields=None, **params):
+    """Returns all items of a paginated Google list call."""
+    return [item async for item in iterate_google_items(list_method, items_key, api_name, fields, **params)]
+
+
+def build_google_service_from_credentials(creds_data, service_name, version):
+    """
+    Returns an authorized Google API service directly from stored credential data
+    (cached per credential identity, like get_google_service).
+    Used by background jobs, which outlive the request and cannot touch the session.
+    """
+    return get_cached_service(creds_data, service_name, version)
+
+
+# --- STUDENT ROSTER CACHE ---
+# Student names are resolved with batched userProfiles lookups (one HTTP round trip per
+# PROFILE_BATCH_SIZE students instead of one per student) and cached per course and user.
+PROFILE_BATCH_SIZE = 50  # Google batch HTTP limit for the Classroom API
+roster_cache = PersistentLRUCache(
+    "roster",
+    memory_max_bytes=int(os.getenv("ROSTER_CACHE_MEMORY_MB", "4")) * 1024 * 1024,
+    max_entries=int(os.getenv("ROSTER_CACHE_MAX_ENTRIES", "50000")),
+    ttl_seconds=int(os.getenv("ROSTER_CACHE_TTL_MINUTES", "360")) * 60
+)
+
+
+def execute_google_batch(batch_request, call_count, credentials, api_name="google"):
+    """
+    Executes a BatchHttpRequest of `call_count` calls on the calling thread's transport,
+    taking one rate-limit token per call.
+    """
+    http = get_thread_http(credentials)
+    return call_with_rate_limit(api_name, batch_request.execute, api_calls=call_count, http=http)
+
+
+def resolve_student_names(classroom_service, course_id, user_ids):
+    """
+    Blocking. Resolves Classroom user IDs to full names, serving the roster cache first and
+    fetching the rest with batched userProfiles().get calls.
+
+    Returns:
+        dict: user_id -> full name (users whose profile could not be read are omitted)
+    """
+    names = {}
+    missing = []
+    user_ids = list(dict.fromkeys(user_ids))
+    cached = roster_cache.get_many([f"{course_id}:{user_id}" for user_id in user_ids])
+    for user_id in user_ids:
+        entry = cached.get(f"{course_id}:{user_id}")
+        if entry is not None:
+            names[user_id] = entry["name"]
+        else:
+            missing.append(user_id)
+
+    fetched = {}
+
+    def store_profile(request_id, response, exception):
+        if exception is not None:
+            print(f"Error fetching profile for user {request_id}: {exception}")
+            return
+        full_name = response.get('name', {}).get('fullName')
+        if full_name:
+            names[request_id] = full_name
+            fetched[f"{course_id}:{request_id}"] = {"name": full_name, "course_id": course_id}
+
+    # A batch takes one token per call, so it may not exceed what the bucket can ever hold
+    batch_size = min(PROFILE_BATCH_SIZE, api_rate_limiters["classroom"].burst)
+    for start in range(0, len(missing), batch_size):
+        # Need the 'classroom.profile.emails' scope for userProfiles().get
+        profile_requests = [
+            (user_id, classroom_service.userProfiles().get(userId=user_id))
+            for user_id in missing[start:start + batch_size]
+        ]
+        batch_request = classroom_service.new_batch_http_request(callback=store_profile)
+        for user_id, profile_request in profile_requests:
+            batch_request.add(profile_request, request_id=user_id)
+        try:
+            execute_google_batch(batch_request, len(profile_requests), profile_requests[0][1].http.credentials, "classroom")
+        except Exception as e:
+            print(f"Batched profile lookup failed for {len(profile_requests)} users: {e}")
+
+    roster_cache.set_many(fetched)
+    return names
+
+def extract_drive_file_id_from_url(url):
+    """
+    Extracts the Google Drive file ID from various Google Drive/Docs/Sheets/Slides URL formats.
+    Returns the file ID string, or None if not found.
+    """
+    # NO CHANGE: This function is framework-independent.
+    match = re.search(r'/d/([a-zA-Z0-9_-]+)', url)
+    if match:
+        return match.group(1)
+    return None
+
+
+# --- OCR ENGINES ---
+# OCR is pluggable: every engine is a function (content_bytes) -> {"text", "pages"} or None.
+# OCR_ENGINE picks the engine; OCR_FALLBACK_ENGINE (optional) is tried when the primary one
+# fails, e.g. when the Vision quota is exhausted. Results are kept in a persistent store
+# keyed by engine name plus the SHA-256 of the image/PDF bytes, shared across sessions
+# and teachers, so re-grades and duplicate uploads skip OCR entirely.
+OCR_ENGINE = os.getenv("OCR_ENGINE", "vision").lower()
+OCR_FALLBACK_ENGINE = os.getenv("OCR_FALLBACK_ENGINE", "").lower() or None
+
+ocr_result_store = PersistentLRUCache(
+    "ocr_results",
+    memory_max_bytes=int(os.getenv("OCR_STORE_MEMORY_MB", "64")) * 1024 * 1024,
+    max_entries=int(os.getenv("OCR_STORE_MAX_ENTRIES", "20000"))
+)
+
+# Cloud Vision: one long-lived client (gRPC channels are thread-safe and expensive to create)
+vision_client = None
+vision_client_lock = threading.Lock()
+
+# Tesseract: local, quota-free engine running pages in parallel worker processes
+TESSERACT_LANG = os.getenv("TESSERACT_LANG", "eng")
+TESSERACT_CONFIG = os.getenv("TESSERACT_CONFIG", "")
+TESSERACT_WORKERS = int(os.getenv("TESSERACT_WORKERS", str(os.cpu_count() or 2)))
+tesseract_process_pool = None
+tesseract_process_pool_lock = threading.Lock()
+
+
+def get_vision_client():
+    """Returns the shared Cloud Vision client, creating it on first use."""
+    global vision_client
+    if vision_client is None:
+        with vision_client_lock:
+            if vision_client is None:
+                vision_client = vision.ImageAnnotatorClient()
+    return vision_client
+
+
+def summarize_vision_annotation(full_text_annotation):
+    """
+    Converts a Vision full_text_annotation into a JSON-serialisable dict holding the
+    full text plus the page/block structure (block type, confidence, bounding box, text).
+    """
+    pages = []
+    for page in full_text_annotation.pages:
+        blocks = []
+        for block in page.blocks:
+            paragraphs_text = []
+            for paragraph in block.paragraphs:
+                words = [''.join(symbol.text for symbol in word.symbols) for word in paragraph.words]
+                paragraphs_text.append(' '.join(words))
+            blocks.append({
+                "block_type": vision.Block.BlockType(block.block_type).name,
+                "confidence": block.confidence,
+                "bounding_box": [[vertex.x, vertex.y] for vertex in block.bounding_box.vertices],
+                "text": '\n'.join(paragraphs_text)
+            })
+        pages.append({
+            "width": page.width,
+            "height": page.height,
+            "confidence": page.confidence,
+            "blocks": blocks
+        })
+    return {"text": full_text_annotation.text, "pages": pages}
+
+
+def vision_ocr_engine(content_bytes):
+    """OCR engine backed by the Cloud Vision handwriting model."""
+    image = vision.Image(content=content_bytes)
+    image_context = vision.ImageContext(language_hints=["en-t-i0-handwrit"])
+
+    response = call_with_rate_limit(
+        "vision",
+        get_vision_client().document_text_detection,
+        image=image,
+        image_context=image_context
+    )
+
+    if response.error.message:
+        print(f"Cloud Vision API Error: {response.error.message}")
+        return None
+
+    if response.full_text_annotation:
+        return summarize_vision_annotation(response.full_text_annotation)
+    return {"text": "", "pages": []}
+
+
+def get_tesseract_process_pool():
+    """Returns the shared Tesseract worker process pool, starting it on first use."""
+    global tesseract_process_pool
+    if tesseract_process_pool is None:
+        with tesseract_process_pool_lock:
+            if tesseract_process_pool is None:
+                # Spawned (not forked) workers, like the MiniLM pool: forking this
+                # multithreaded server process can deadlock the children
+                tesseract_process_pool = ProcessPoolExecutor(
+                    max_workers=TESSERACT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return tesseract_process_pool
+
+
+def tesseract_ocr_engine(content_bytes):
+    """OCR engine backed by a local Tesseract install, run in the worker process pool."""
+    future = get_tesseract_process_pool().submit(tesseract_ocr, content_bytes, TESSERACT_LANG, TESSERACT_CONFIG)
+    return future.result()
+
+
+OCR_ENGINES = {
+    "vision": vision_ocr_engine,
+    "tesseract": tesseract_ocr_engine,
+}
+
+if OCR_ENGINE not in OCR_ENGINES:
+    print(f"⚠️ Unknown OCR_ENGINE '{OCR_ENGINE}', using 'vision'")
+    OCR_ENGINE = "vision"
+if OCR_FALLBACK_ENGINE is not None and OCR_FALLBACK_ENGINE not in OCR_ENGINES:
+    print(f"⚠️ Unknown OCR_FALLBACK_ENGINE '{OCR_FALLBACK_ENGINE}', fallback disabled")
+    OCR_FALLBACK_ENGINE = None
+print(f"🔎 OCR engine: {OCR_ENGINE}" + (f" (fallback: {OCR_FALLBACK_ENGINE})" if OCR_FALLBACK_ENGINE else ""))
+
+
+def run_ocr_engine(engine_name, content_bytes, file_name):
+    """Runs one OCR engine through the result store. Returns None if the engine failed."""
+    content_hash = hashlib.sha256(content_bytes).hexdigest()
+    store_key = f"{engine_name}:{content_hash}"
+
+    stored = ocr_result_store.get(store_key)
+    if stored is not None:
+        print(f"⚡ Reusing stored {engine_name} OCR result for '{file_name}' (sha256 {content_hash[:12]}...)")
+        return stored
+
+    print(f"Running {engine_name} OCR on '{file_name}'...")
+    try:
+        ocr_result = OCR_ENGINES[engine_name](content_bytes)
+    except Exception as e:
+        print(f"⚠️ {engine_name} OCR failed for '{file_name}': {e}")
+        return None
+
+    if ocr_result is not None:
+        ocr_result_store.set(store_key, ocr_result)
+    return ocr_result
+
+
+def run_ocr(content_bytes, file_name="unknown"):
+    """
+    Extracts text from image/PDF bytes with the configured OCR engine,
+    falling back to OCR_FALLBACK_ENGINE if the primary engine fails.
+
+    Returns:
+        dict or None: {"text": str, "pages": [...]} or None if every engine failed
+    """
+    ocr_result = run_ocr_engine(OCR_ENGINE, content_bytes, file_name)
+    if ocr_result is None and OCR_FALLBACK_ENGINE and OCR_FALLBACK_ENGINE != OCR_ENGINE:
+        print(f"🔄 Falling back to {OCR_FALLBACK_ENGINE} OCR for '{file_name}'")
+        ocr_result = run_ocr_engine(OCR_FALLBACK_ENGINE, content_bytes, file_name)
+    return ocr_result
+
+
+# --- LOCAL PDF TEXT EXTRACTION ---
+# Typed PDFs (exported from Word/Docs) already carry a text layer, which is read locally.
+# Only pages without usable text (scans, handwriting) are rendered and sent to OCR.
+# Large PDFs are split into page ranges and parsed in parallel worker processes.
+PDF_MIN_PAGE_CHARS = int(os.getenv("PDF_MIN_PAGE_CHARS", "25"))
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "200"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "8"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+# Pages OCR'd at once. Vision calls are network-bound; Tesseract pages each occupy a
+# worker process, so with Tesseract the default matches the pool to keep every worker busy.
+OCR_PAGE_CONCURRENCY = int(
+    os.getenv("OCR_PAGE_CONCURRENCY") or (TESSERACT_WORKERS if OCR_ENGINE == "tesseract" else 4)
+)
+
+pdf_process_pool = None
+pdf_process_pool_lock = threading.Lock()
+ocr_page_executor = ThreadPoolExecutor(max_workers=OCR_PAGE_CONCURRENCY, thread_name_prefix="ocr-page")
+
+
+def get_pdf_process_pool():
+    """Returns the shared PDF worker process pool, starting it on first use."""
+    global pdf_process_pool
+    if pdf_process_pool is None:
+        with pdf_process_pool_lock:
+            if pdf_process_pool is None:
+                # Spawned (not forked) workers, like the MiniLM pool: forking this
+                # multithreaded server process can deadlock the children
+                pdf_process_pool = ProcessPoolExecutor(
+                    max_workers=PDF_EXTRACT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return pdf_process_pool
+
+
+def extract_pdf_pages(pdf_bytes):
+    """
+    Splits a PDF into per-page text (or rendered images for pages without a text layer).
+    Small PDFs are handled inline; larger ones are parsed in parallel page ranges.
+    """
+    page_count = count_pdf_pages(pdf_bytes)
+
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS <= 1:
+        return extract_pdf_page_range(pdf_bytes, 0, page_count, PDF_MIN_PAGE_CHARS, PDF_RENDER_DPI)
+
+    chunk_size = -(-page_count // PDF_EXTRACT_WORKERS)  # Ceiling division
+    pool = get_pdf_process_pool()
+    futures = [
+        pool.submit(extract_pdf_page_range, pdf_bytes, start, start + chunk_size, PDF_MIN_PAGE_CHARS, PDF_RENDER_DPI)
+        for start in range(0, page_count, chunk_size)
+    ]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+def extract_pdf_text(pdf_bytes, file_name="unknown"):
+    """
+    Extracts the text of a PDF, using the embedded text layer where available and
+    OCR for the remaining pages. Falls back to OCR of the whole file if the PDF
+    cannot be parsed locally.
+
+    Returns:
+        str or None: The page texts joined in page order, or None if any page could not be
+            read (partial text would be graded as if the missing pages were blank, and cached)
+    """
+    try:
+        pages = extract_pdf_pages(pdf_bytes)
+    except Exception as e:
+        print(f"⚠️ Local PDF parsing failed for '{file_name}': {e}. Falling back to OCR of the whole file.")
+        ocr_result = run_ocr(pdf_bytes, file_name)
+        return ocr_result["text"] if ocr_result is not None else None
+
+    ocr_pages = [page for page in pages if page["text"] is None]
+    print(f"PDF '{file_name}': {len(pages)} page(s), {len(pages) - len(ocr_pages)} with a text layer, {len(ocr_pages)} need OCR.")
+
+    if ocr_pages:
+        ocr_results = ocr_page_executor.map(
+            lambda page: run_ocr(page["image"], f"{file_name} (page {page['page']})"),
+            ocr_pages
+        )
+        failed_pages = []
+        for page, ocr_result in zip(ocr_pages, ocr_results):
+            if ocr_result is None:
+                failed_pages.append(page["page"])
+            else:
+                page["text"] = ocr_result["text"]
+        if failed_pages:
+            print(f"⚠️ OCR failed for page(s) {failed_pages} of '{file_name}'; not using partial text")
+            return None
+
+    return '\n\n'.join(page["text"] for page in pages if page["text"])
+
+
+# --- EXTRACTED TEXT CACHE ---
+# Text extracted from Drive files, keyed by file ID plus the file's content version
+# (md5Checksum for uploaded files, modifiedTime for Google Docs, which have no checksum).
+# Re-grading an assignment then skips the Drive export/download and OCR for unchanged files.
+extracted_text_cache = PersistentLRUCache(
+    "extracted_text",
+    memory_max_bytes=int(os.getenv("TEXT_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+    max_entries=int(os.getenv("TEXT_CACHE_MAX_ENTRIES", "5000"))
+)
+
+
+def download_drive_file_content(drive_service, file_id, file_name="unknown"):
+    """
+    Downloads a Google Drive file's content as plain text.
+    
+    - If it's a Google Doc/Sheet, it exports as text/plain.
+    - If it's a Word document (.docx), it extracts text using python-docx.
+    - If it's a PDF, it reads the embedded text layer locally and OCRs only
+      the pages without usable text.
+    - If it's an Image (JPG, PNG), it downloads the bytes and runs the configured
+      OCR engine (Google Cloud Vision by default) to extract handwritten text.
+    - Otherwise, it attempts a standard text download.
+
+    Extracted text is cached per file version, so unchanged files are only
+    downloaded and OCR'd once.
+    """
+    actual_file_name = file_name
+    try:
+        file_metadata = execute_google_request(drive_service.files().get(
+            fileId=file_id, fields='mimeType, name, modifiedTime, md5Checksum'), 'drive')
+        mime_type = file_metadata.get('mimeType')
+        actual_file_name = file_metadata.get('name', file_name)
+
+        file_version = file_metadata.get('md5Checksum') or file_metadata.get('modifiedTime')
+        cache_key = f"{file_id}:{file_version}" if file_version else None
+        if cache_key:
+            cached = extracted_text_cache.get(cache_key)
+            if cached is not None:
+                print(f"⚡ Using cached text for '{actual_file_name}' (ID: {file_id})")
+                return cached["text"]
+
+        print(f"Downloading '{actual_file_name}' (ID: {file_id}) with MIME type: {mime_type}")
+        extracted_text = extract_drive_file_text(drive_service, file_id, mime_type, actual_file_name)
+
+        if extracted_text is not None and cache_key:
+            extracted_text_cache.set(cache_key, {
+                "text": extracted_text,
+                "mime_type": mime_type,
+                "file_name": actual_file_name
+            })
+        return extracted_text
+
+    except HttpError as error:
+        print(f'Google Drive API Error downloading file "{actual_file_name}" (ID: {file_id}): {error.resp.status} - {error.content.decode("utf-8")}')
+        return None   
+
+    except Exception as e:
+        print(f'Unexpected error in download_drive_file_content for "{actual_file_name}" (ID: {file_id}): {e}')
+        return None
+
+
+def extract_drive_file_text(drive_service, file_id, mime_type, actual_file_name):
+    """
+    Downloads a Drive file and extracts its text according to its MIME type.
+    Google API errors propagate to download_drive_file_content, which handles them.
+    """
+    # --- BRANCH 1: Google Workspace Docs ---
+    if mime_type.startswith('application/vnd.google-apps'):
+        print("File is a Google Doc. Exporting as text/plain.")
+        request = drive_service.files().export_media(fileId=file_id, mimeType='text/plain')
+        fh = download_google_media(request, 'drive')
+        return fh.getvalue().decode('utf-8')
+
+    # --- BRANCH 2: Word Documents (.docx and .doc) ---
+    elif mime_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword']:
+        print(f"File is a Word document ({mime_type}). Extracting text with python-docx...")
+        request = drive_service.files().get_media(fileId=file_id)
+        fh = download_google_media(request, 'drive')
+        
+        try:
+            # Extract text from Word document
+            doc = Document(fh)
+            full_text = []
+            for paragraph in doc.paragraphs:
+                if paragraph.text.strip():  # Skip empty paragraphs
+                    full_text.append(paragraph.text)
+            
+            # Also extract text from tables
+            for table in doc.tables:
+                for row in table.rows:
+                    for cell in row.cells:
+                        if cell.text.strip():
+                            full_text.append(cell.text)
+            
+            extracted_text = '\n'.join(full_text)
+            print(f"Successfully extracted {len(extracted_text)} characters from Word document.")
+            return extracted_text
+        except Exception as docx_error:
+            print(f"Error extracting text from Word document: {docx_error}")
+            # Fallback: try generic text extraction
+            try:
+                fh.seek(0)
+                return fh.getvalue().decode('utf-8')
+            except:
+                return None
+
+    # --- BRANCH 3a: PDFs (local text layer first, OCR only for pages without text) ---
+    elif mime_type == 'application/pdf':
+        print("File is a PDF. Downloading bytes for local text-layer extraction...")
+        request = drive_service.files().get_media(fileId=file_id)
+        fh = download_google_media(request, 'drive')
+        return extract_pdf_text(fh.getvalue(), actual_file_name)
+
+    # --- BRANCH 3b: Images ---
+    elif mime_type in ['image/jpeg', 'image/png']:
+        print("File is an Image. Downloading bytes for OCR...")
+        request = drive_service.files().get_media(fileId=file_id)
+        fh = download_google_media(request, 'drive')
+        
+        content_bytes = fh.getvalue()
+        
+        print("Bytes downloaded. Running handwriting OCR...")
+        ocr_result = run_ocr(content_bytes, actual_file_name)
+        if ocr_result is None:
+            return None
+        
+        if ocr_result["text"]:
+            print(f"OCR successful. Extracted {len(ocr_result['text'])} characters from {actual_file_name}.")
+        else:
+            print("OCR found no text in the image.")
+        return ocr_result["text"]  # Empty string if no text is found
+
+    # --- BRANCH 4: Other files (e.g., .txt) ---
+    else:
+        print("File is not a Google Doc, Word document, or Image. Attempting direct media download.")
+        request = drive_service.files().get_media(fileId=file_id)
+        fh = download_google_media(request, 'drive')
+
+        try:
+            return fh.getvalue().decode('utf-8')
+        except UnicodeDecodeError:
+            print(f"UTF-8 decode failed for '{actual_file_name}', trying latin-1.")
+            return fh.getvalue().decode('latin-1')
+
+
+# --- 3. AUTHENTICATION ROUTES ---
+
+# CHANGED: Converted Flask @app.route to FastAPI @app.get
+# ADDED: 'request: Request' parameter for session and url_for
+@app.get('/login')
+async def login(request: Request):
+    """Initiates the Google OAuth 2.0 login flow, redirecting to Google's consent screen."""
+    flow = Flow.from_client_secrets_file(
+        CLIENT_SECRETS_FILE,
+        scopes=SCOPES, # Use the updated SCOPES list
+        # CHANGED: 'url_for' is now 'request.url_for' and requires the endpoint 'name'
+        redirect_uri=request.url_for('callback')
+    )
+    authorization_url, state = flow.authorization_url(access_type='offline', prompt='consent')
+    # CHANGED: 'session' is now 'request.session'
+    request.session['state'] = state
+    # CHANGED: 'redirect' is now 'RedirectResponse'
+    return RedirectResponse(authorization_url)
+
+# CHANGED: Converted Flask @app.route to FastAPI @app.get
+# ADDED: 'request: Request' parameter
+# ADDED: 'name="callback"' to allow request.url_for('callback') to work
+@app.get('/auth/callback', name="callback")
+async def callback(request: Request):
+    """Handles the callback from Google after a user grants or denies permissions."""
+    
+    # CHANGED: 'session' is now 'request.session'
+    # CHANGED: 'request.args.get' is now 'request.query_params.get'
+    if 'state' not in request.session or request.session['state'] != request.query_params.get('state'):
+        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+        return JSONResponse(content={"error": "State mismatch. Possible CSRF attack."}, status_code=400)
+
+    flow = Flow.from_client_secrets_file(
+        CLIENT_SECRETS_FILE,
         scopes=SCOPES, # Use the updated SCOPES list
         state=request.session['state'], # CHANGED: 'session' is now 'request.session'
         redirect_uri=request.url_for('callback') # CHANGED: 'url_for' is now 'request.url_for'
@@ -563,6 +2106,9 @@ async def callback(request: Request):
 @app.get('/logout')
 async def logout(request: Request):
     """Logs the user out by clearing the session."""
+    if 'credentials' in request.session:
+        invalidate_listing_cache(credential_identity(request.session['credentials']))
+        evict_cached_credentials(request.session['credentials'])
     # CHANGED: 'session' is now 'request.session'
     request.session.clear()
     # CHANGED: 'jsonify' is replaced with returning a dictionary (FastAPI handles it)
@@ -575,31 +2121,179 @@ async def logout(request: Request):
 
 # --- 4. API DATA-FETCHING ROUTES ---
 
+# --- LISTING RESPONSE CACHE ---
+# Course and assignment listings are requested on every dashboard navigation. Responses are
+# cached per user (credential identity): fresh for LISTING_CACHE_TTL_SECONDS, then served
+# stale while a background refresh runs, up to LISTING_CACHE_STALE_SECONDS. Each response
+# carries an ETag, so a browser revalidating with If-None-Match gets a bodiless 304.
+LISTING_CACHE_TTL_SECONDS = int(os.getenv("LISTING_CACHE_TTL_SECONDS", "60"))
+LISTING_CACHE_STALE_SECONDS = int(os.getenv("LISTING_CACHE_STALE_SECONDS", "600"))
+LISTING_CACHE_MAX_ENTRIES = int(os.getenv("LISTING_CACHE_MAX_ENTRIES", "2000"))
+# (credential identity, listing key) -> {"data", "etag", "fetched_at"}
+listing_cache = OrderedDict()
+# Listing keys with a background refresh in flight (and strong references to the tasks)
+listing_refresh_tasks = {}
+
+
+def store_listing(cache_key, data):
+    """Caches a listing response and returns its cache entry."""
+    entry = {
+        "data": data,
+        "etag": '"' + hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32] + '"',
+        "fetched_at": time.time()
+    }
+    listing_cache[cache_key] = entry
+    listing_cache.move_to_end(cache_key)
+    while len(listing_cache) > LISTING_CACHE_MAX_ENTRIES:
+        listing_cache.popitem(last=False)
+    return entry
+
+
+def invalidate_listing_cache(identity):
+    """Drops every cached listing of one user."""
+    for cache_key in [cache_key for cache_key in listing_cache if cache_key[0] == identity]:
+        listing_cache.pop(cache_key, None)
+
+
+async def refresh_listing(cache_key, fetch):
+    """Background refresh of a stale listing; on failure the stale entry is kept."""
+    try:
+        data = await fetch()
+        if not isinstance(data, Response):
+            store_listing(cache_key, data)
+    except Exception as e:
+        print(f"⚠️ Background refresh of {cache_key[1]} failed: {e}")
+    finally:
+        listing_refresh_tasks.pop(cache_key, None)
+
+
+def listing_response(request, entry):
+    """JSON response for a cached listing, or 304 if the browser already has this version."""
+    headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == entry["etag"]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=entry["data"], headers=headers)
+
+
+async def get_cached_listing(request, listing_key, fetch):
+    """
+    Returns the per-user cache entry of a listing, calling `fetch` (an async function returning
+    the data, or a JSONResponse on error) on a miss or starting a background refresh when
+    the cached copy is stale. Error responses are returned as-is and never cached.
+    """
+    cache_key = (credential_identity(request.session['credentials']), listing_key)
+    entry = listing_cache.get(cache_key)
+    age = time.time() - entry["fetched_at"] if entry is not None else None
+
+    if entry is None or age >= LISTING_CACHE_STALE_SECONDS:
+        data = await fetch()
+        if isinstance(data, Response):
+            return data
+        entry = store_listing(cache_key, data)
+    elif age >= LISTING_CACHE_TTL_SECONDS and cache_key not in listing_refresh_tasks:
+        listing_refresh_tasks[cache_key] = asyncio.create_task(refresh_listing(cache_key, fetch))
+    else:
+        listing_cache.move_to_end(cache_key)
+
+    return entry
+
+
+async def cached_listing(request, listing_key, fetch):
+    """Serves a listing from the per-user cache (see get_cached_listing), honouring If-None-Match."""
+    entry = await get_cached_listing(request, listing_key, fetch)
+    if isinstance(entry, Response):
+        return entry
+    return listing_response(request, entry)
+
+
+async def fetch_course_listing(classroom_service):
+    """The teacher's active courses, or a JSONResponse describing the Classroom error."""
+    try:
+        courses = await list_google_items(
+            classroom_service.courses().list, 'courses', 'classroom', COURSE_LIST_FIELDS,
+            teacherId='me', courseStates=['ACTIVE']
+        )
+        # CHANGED: Returned dictionary directly, FastAPI handles 'jsonify'
+        return courses
+    except HttpError as error:
+        print(f"Google Classroom API Error in get_courses: {error.resp.status} - {error.content.decode('utf-8')}")
+        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+        return JSONResponse(
+            content={"error": f"Failed to fetch courses: {error.content.decode('utf-8')}"}, 
+            status_code=error.resp.status
+        )
+
+
+async def fetch_assignment_listing(classroom_service, course_id):
+    """The assignments (coursework of type ASSIGNMENT) of a course, or a JSONResponse describing the error."""
+    try:
+        assignments_only = [
+            item async for item in iterate_google_items(
+                classroom_service.courses().courseWork().list, 'courseWork', 'classroom', COURSEWORK_LIST_FIELDS, courseId=course_id
+            )
+            if item.get('workType') == 'ASSIGNMENT'
+        ]
+        # CHANGED: Returned list directly, FastAPI handles 'jsonify'
+        return assignments_only
+
+    except HttpError as error:
+        print(f"Google Classroom API Error in get_assignments for course {course_id}: {error.resp.status} - {error.content.decode('utf-8')}")
+        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+        return JSONResponse(
+            content={"error": f"Failed to fetch assignments: {error.content.decode('utf-8')}"}, 
+            status_code=error.resp.status
+        )
+    except Exception as e:
+        print(f"An unexpected error occurred in get_assignments: {e}")
+        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+        return JSONResponse(
+            content={"error": f"An unexpected error occurred: {str(e)}"}, 
+            status_code=500
+        )
+
+
+async def list_submissions_with_names(classroom_service, course_id, assignment_id):
+    """
+    Every turned-in submission of an assignment, each with a 'studentName' attached.
+    Raises HttpError on Classroom failures.
+    """
+    processed_submissions = []
+    async for submissions in iterate_google_pages(
+        classroom_service.courses().courseWork().studentSubmissions().list,
+        'studentSubmissions',
+        'classroom',
+        SUBMISSION_LIST_FIELDS,
+        courseId=course_id,
+        courseWorkId=assignment_id,
+        states=['TURNED_IN']
+    ):
+        # Fetch student profiles for names (batched, cached per course) while the next page loads
+        student_names = await run_throttled(
+            resolve_student_names, classroom_service, course_id, [submission['userId'] for submission in submissions]
+        )
+        for submission in submissions:
+            user_id = submission['userId']
+            # Default name in case the profile could not be fetched
+            submission['studentName'] = student_names.get(user_id, f"Unknown Student ({user_id})")
+            processed_submissions.append(submission)
+    return processed_submissions
+
+
 # CHANGED: Converted Flask route to FastAPI GET endpoint
 # ADDED: 'request: Request' parameter
 @app.get('/api/courses')
 async def get_courses(request: Request):
     """Fetches and returns a list of the teacher's active Google Classroom courses."""
     # CHANGED: Passed 'request' object to get_google_service
-    classroom_service = get_google_service('classroom', 'v1', request)
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
     if not classroom_service:
         # CHANGED: 'jsonify' is replaced with 'JSONResponse'
         return JSONResponse(
             content={"error": "User not authenticated or session expired. Please re-login."}, 
             status_code=401
         )
-    
-    try:
-        courses = classroom_service.courses().list(teacherId='me', courseStates=['ACTIVE']).execute()
-        # CHANGED: Returned dictionary directly, FastAPI handles 'jsonify'
-        return courses.get('courses', [])
-    except HttpError as error:
-        print(f"Google Classroom API Error in get_courses: {error.resp.status} - {error.content.decode('utf-8')}")
-        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-        return JSONResponse(
-            content={"error": f"Failed to fetch courses: {error.content.decode('utf-8')}"}, 
-            status_code=error.resp.status
-        )
+
+    return await cached_listing(request, "courses", functools.partial(fetch_course_listing, classroom_service))
 
 # CHANGED: Converted Flask route to FastAPI GET endpoint
 # ADDED: 'request: Request' parameter and type hint for 'course_id'
@@ -607,110 +2301,477 @@ async def get_courses(request: Request):
 async def get_assignments(course_id: str, request: Request):
     """Fetches and returns a list of assignments for a given course ID."""
     # CHANGED: Passed 'request' object to get_google_service
-    classroom_service = get_google_service('classroom', 'v1', request)
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
     if not classroom_service:
         # CHANGED: 'jsonify' is replaced with 'JSONResponse'
         return JSONResponse(
             content={"error": "User not authenticated or session expired. Please re-login."}, 
             status_code=401
         )
+
+    return await cached_listing(
+        request, f"assignments:{course_id}", functools.partial(fetch_assignment_listing, classroom_service, course_id)
+    )
+
+# CHANGED: Converted Flask route to FastAPI GET endpoint
+# ADDED: 'request: Request' parameter and type hints for path parameters
+@app.get('/api/courses/{course_id}/assignments/{assignment_id}/submissions')
+async def get_submissions(course_id: str, assignment_id: str, request: Request):
+    """
+    Fetches and returns a list of student submissions for a specific assignment.
+    Now includes logic to fetch and attach student names to each submission.
+    """
+    # CHANGED: Passed 'request' object to get_google_service
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
+    if not classroom_service:
+        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+        return JSONResponse(
+            content={"error": "User not authenticated or session expired. Please re-login."}, 
+            status_code=401
+        )
+    
     try:
-        all_coursework = classroom_service.courses().courseWork().list(courseId=course_id).execute()
-        assignments_only = [
-            item for item in all_coursework.get('courseWork', []) 
-            if item.get('workType') == 'ASSIGNMENT'
-        ]
+        processed_submissions = await list_submissions_with_names(classroom_service, course_id, assignment_id)
+
         # CHANGED: Returned list directly, FastAPI handles 'jsonify'
-        return assignments_only
+        return processed_submissions
+    except HttpError as error:
+        print(f"Google Classroom API Error in get_submissions for course {course_id}, assignment {assignment_id}: {error.resp.status} - {error.content.decode('utf-8')}")
+        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+        return JSONResponse(
+            content={"error": f"Failed to fetch submissions: {error.content.decode('utf-8')}"}, 
+            status_code=error.resp.status
+        )
+
+
+# --- DASHBOARD BOOTSTRAP ---
+
+@app.get('/api/dashboard/bootstrap')
+async def get_dashboard_bootstrap(request: Request, course_id: str = None, assignment_id: str = None):
+    """
+    Everything the grading view needs for one selection in a single round trip: the teacher's
+    courses, the assignments of `course_id`, and the submissions (with student names) and saved
+    grades of `assignment_id`. All parts are fetched concurrently; course and assignment lists
+    are served from the per-user listing cache. Parts that were not selected are null. A part
+    that fails is null as well, with its error message under "errors", so the client can
+    retry just that part through its own endpoint.
+    """
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
+    if not classroom_service:
+        return JSONResponse(
+            content={"error": "User not authenticated or session expired. Please re-login."}, 
+            status_code=401
+        )
+    if assignment_id and not course_id:
+        return JSONResponse(content={"error": "assignment_id requires course_id"}, status_code=400)
+
+    parts = {
+        "courses": get_cached_listing(request, "courses", functools.partial(fetch_course_listing, classroom_service))
+    }
+    if course_id:
+        parts["assignments"] = get_cached_listing(
+            request, f"assignments:{course_id}", functools.partial(fetch_assignment_listing, classroom_service, course_id)
+        )
+    if assignment_id:
+        parts["submissions"] = list_submissions_with_names(classroom_service, course_id, assignment_id)
+        parts["grades"] = run_blocking(load_graded_history, course_id, assignment_id)
+
+    results = dict(zip(parts, await asyncio.gather(*parts.values(), return_exceptions=True)))
+
+    bootstrap = {"courses": None, "assignments": None, "submissions": None, "grades": None, "errors": {}}
+    for name, result in results.items():
+        if isinstance(result, Response):
+            # Listing fetch errors come back as responses
+            bootstrap["errors"][name] = json.loads(result.body).get("error")
+        elif isinstance(result, HttpError):
+            print(f"Google Classroom API Error in get_dashboard_bootstrap ({name}) for course {course_id}, assignment {assignment_id}: {result.resp.status} - {result.content.decode('utf-8')}")
+            bootstrap["errors"][name] = f"Failed to fetch {name}: {result.content.decode('utf-8')}"
+        elif isinstance(result, BaseException):
+            print(f"An unexpected error occurred in get_dashboard_bootstrap ({name}): {result}")
+            bootstrap["errors"][name] = f"An unexpected error occurred: {str(result)}"
+        else:
+            bootstrap[name] = result["data"] if name in ("courses", "assignments") else result
+    return bootstrap
+
+import uvicorn # ADDED: For running the FastAPI server
+import datetime # ADDED: This import was used in the grading logic
+
+# --- (Previous code from last snippet) ---
+# ... (imports, helpers, auth routes, and data-fetching routes) ...
+
+
+# --- 5. CORE GRADING ROUTE ---
+
+# Grading criteria (instructions 1-7) shared by the single and batched grading prompts
+GRADING_CRITERIA = """        1.  **Understanding the Task:** Carefully read the QUESTIONNAIRE to grasp the specific requirements and learning objectives.
+
+        2.  **Content Accuracy & Completeness:** Compare the STUDENT'S SUBMISSION against the OFFICIAL ANSWER KEY.
+            * How accurately does the student address each question/task?
+            * Is the information presented correct?
+            * Are all parts of the question/task attempted and completed?
+            * **Award points for partially correct or reasonable attempts. Avoid giving a 0 unless the submission is entirely blank, off-topic, or completely nonsensical.** Even minimal effort to address the prompt should receive some credit.
+
+        3.  **Structure & Clarity:** Evaluate the organization, clarity, and readability of the student's response.
+
+        4.  **Meaning & Comprehension:** Assess the student's understanding of the concepts. Does their submission demonstrate comprehension, or is it just rote memorization/copying?
+
+        5.  **Assign a Numerical Grade (0-100):** Based on the above criteria, assign a numerical grade, using the following guidelines to achieve scores between 70-80 for conceptually correct but less precise answers:
+            * **90-100 (Excellent):** Answers are accurate, complete, well-structured, and demonstrate deep comprehension. Critically, they are also *precise* and leverage key terminology from the answer key where appropriate.
+            * **75-89 (Good/Strong):** Answers are *conceptually correct* and show good understanding, but might lack the highest level of precision or miss some specific key terminology from the answer key. They are clear, mostly complete, but could be more refined.
+            * **50-74 (Fair/Developing):** Answers are partially correct, contain some inaccuracies, or are vague. They may demonstrate some understanding but require significant improvement in content, clarity, or completeness.
+            * **< 50 (Limited/Poor):** Answers are largely incorrect, off-topic, or show minimal understanding. This category should only be used if attempts are very weak or absent.
+
+        6.  **Provide Comprehensive Feedback:**
+            * Start with positive aspects or areas where the student demonstrated understanding.
+            * Clearly explain where points were lost, referencing specific parts of the questionnaire or answer key.
+            * For "Good/Strong" answers, specifically suggest how they could make their explanation more precise or complete by integrating relevant key terms or more detailed examples.
+            * Suggest concrete steps for improvement.
+
+        7.  **Justify the Grade (Briefly):** Include a short sentence explaining the overall reasoning for the assigned score, linking it to the guidelines above (e.g., "Conceptually solid but lacked some precision and specific terminology for full marks.")"""
+
+
+def build_gemini_grading_prompt(assignment_title, questionnaire_text, answer_key_content, student_submission_text):
+    """Builds the grading prompt shared by /api/grade and the whole-class grading jobs."""
+    return f"""
+        You are an expert AI teaching assistant for a Google Classroom assignment titled "{assignment_title}". Your task is to rigorously grade the student's submission, providing a score out of 100, and comprehensive feedback.
+
+        --- QUESTIONNAIRE (The questions/tasks presented to the student) ---
+        {questionnaire_text}
+
+        --- OFFICIAL ANSWER KEY (The expected correct responses/solutions) ---
+        {answer_key_content}
+
+        --- STUDENT'S SUBMISSION (The student's actual answers/work) ---
+        {student_submission_text}
+
+        --- GRADING INSTRUCTIONS ---
+{GRADING_CRITERIA}
+
+        8.  **Respond ONLY with a JSON object with exactly these fields:**
+            * "grade": integer score from 0 to 100
+            * "grade_justification": a brief, one-sentence reason for the score
+            * "feedback": your detailed feedback paragraph, covering all points from instruction 6
+        """
+
+
+class GradingResult(TypedDict):
+    """Response schema Gemini is constrained to for a single grade."""
+    grade: int
+    grade_justification: str
+    feedback: str
+
+
+GRADING_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=GradingResult
+)
+
+
+def validate_grading_result(result):
+    """
+    Validates one decoded grading object against the GradingResult schema.
+
+    Returns:
+        tuple: (int grade, str justification, str feedback)
+
+    Raises:
+        ValueError: Describing the first schema violation found
+    """
+    if not isinstance(result, dict):
+        raise ValueError("the response must be a JSON object")
+
+    missing_fields = [field for field in ('grade', 'grade_justification', 'feedback') if field not in result]
+    if missing_fields:
+        raise ValueError(f"missing required field(s): {', '.join(missing_fields)}")
+
+    grade = result['grade']
+    if isinstance(grade, str) and grade.strip().isdigit():
+        grade = int(grade.strip())
+    if isinstance(grade, float) and grade.is_integer():
+        grade = int(grade)
+    if isinstance(grade, bool) or not isinstance(grade, int):
+        raise ValueError("'grade' must be an integer")
+    if not 0 <= grade <= 100:
+        raise ValueError("'grade' must be between 0 and 100")
+
+    for field in ('grade_justification', 'feedback'):
+        if not isinstance(result[field], str) or not result[field].strip():
+            raise ValueError(f"'{field}' must be a non-empty string")
+
+    return grade, result['grade_justification'].strip(), result['feedback'].strip()
+
+
+def load_json_response(response_text):
+    """Decodes a JSON model response, tolerating a surrounding ```json code fence."""
+    text = response_text.strip()
+    fence_match = re.match(r'^```(?:json)?\s*(.*?)\s*```$', text, re.DOTALL)
+    if fence_match:
+        text = fence_match.group(1)
+    return json.loads(text)
+
+
+def parse_gemini_grading_response(grade_text_output):
+    """
+    Extracts (grade, justification, feedback) from a Gemini grading response.
+    Expects the GradingResult JSON object; responses in the older
+    GRADE: / GRADE_JUSTIFICATION: / FEEDBACK: text format are still accepted.
+
+    Returns:
+        tuple or None: (int grade, str justification, str feedback), or None if the
+        response matches neither format.
+    """
+    try:
+        return validate_grading_result(load_json_response(grade_text_output))
+    except ValueError:
+        pass
+
+    grade_match = re.search(r'GRADE:\s*(\d+)/100', grade_text_output, re.IGNORECASE)
+    justification_match = re.search(r'GRADE_JUSTIFICATION:\s*(.*)', grade_text_output, re.IGNORECASE)
+    feedback_match = re.search(r'FEEDBACK:\s*(.*)', grade_text_output, re.IGNORECASE | re.DOTALL)
+
+    if not grade_match or not feedback_match or not justification_match:
+        return None
+
+    return (
+        int(grade_match.group(1)),
+        justification_match.group(1).strip(),
+        feedback_match.group(1).strip()
+    )
+
+
+def describe_grading_response_error(grade_text_output):
+    """Returns a short explanation of why a grading response failed validation."""
+    try:
+        validate_grading_result(load_json_response(grade_text_output))
+    except ValueError as e:
+        return str(e)
+    return "unknown format error"
+
+
+def build_grading_repair_prompt(invalid_output, error_description):
+    """Builds the one-shot repair prompt sent when a grading response fails validation."""
+    return f"""Your previous grading response could not be used because it did not match the required JSON schema ({error_description}).
+
+--- PREVIOUS RESPONSE ---
+{invalid_output}
+
+--- INSTRUCTIONS ---
+Return the same grade, justification and feedback as a single JSON object with exactly these fields:
+"grade" (integer from 0 to 100), "grade_justification" (one sentence), "feedback" (detailed paragraph).
+Do not re-grade the submission and do not add any text outside the JSON object."""
+
+
+# --- GEMINI GRADING CACHE ---
+# Grading results are cached by a hash of (model name, prompt template version, full prompt).
+# The prompt embeds the assignment title, questionnaire, answer key and submission text,
+# so an unchanged regrade is served from the cache instead of paying for a new Gemini call.
+GEMINI_GRADING_MODEL = "gemini-2.5-flash"
+# Bump whenever build_gemini_grading_prompt or the expected response format changes
+GRADING_PROMPT_VERSION = "2"
+
+grading_response_cache = PersistentLRUCache(
+    "grading_responses",
+    memory_max_bytes=int(os.getenv("GRADING_CACHE_MEMORY_MB", "16")) * 1024 * 1024,
+    max_entries=int(os.getenv("GRADING_CACHE_MAX_ENTRIES", "20000")),
+    ttl_seconds=int(os.getenv("GRADING_CACHE_TTL_HOURS", "168")) * 3600
+)
+
+
+def grading_cache_key(model_name, prompt):
+    """Returns the cache key for a grading prompt sent to a given model."""
+    return hashlib.sha256(f"{model_name}\n{GRADING_PROMPT_VERSION}\n{prompt}".encode('utf-8')).hexdigest()
 
-    except HttpError as error:
-        print(f"Google Classroom API Error in get_assignments for course {course_id}: {error.resp.status} - {error.content.decode('utf-8')}")
-        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-        return JSONResponse(
-            content={"error": f"Failed to fetch assignments: {error.content.decode('utf-8')}"}, 
-            status_code=error.resp.status
-        )
-    except Exception as e:
-        print(f"An unexpected error occurred in get_assignments: {e}")
-        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-        return JSONResponse(
-            content={"error": f"An unexpected error occurred: {str(e)}"}, 
-            status_code=500
-        )
 
-# CHANGED: Converted Flask route to FastAPI GET endpoint
-# ADDED: 'request: Request' parameter and type hints for path parameters
-@app.get('/api/courses/{course_id}/assignments/{assignment_id}/submissions')
-async def get_submissions(course_id: str, assignment_id: str, request: Request):
+async def request_gemini_grade(prompt, cache_tags=None, use_cache=True):
     """
-    Fetches and returns a list of student submissions for a specific assignment.
-    Now includes logic to fetch and attach student names to each submission.
+    Sends a grading prompt to Gemini with schema-constrained JSON output and validates
+    the response, reusing the cached result for an identical prompt when available.
+    If validation fails, Gemini is asked once to repair its output instead of the
+    already-paid-for result being discarded.
+
+    Args:
+        prompt (str): Prompt built by build_gemini_grading_prompt
+        cache_tags (dict): course_id / assignment_id / submission_id stored with the
+            cached entry so it can be invalidated explicitly later
+        use_cache (bool): False forces a fresh Gemini call (the result is still cached)
+
+    Returns:
+        tuple: (parsed_grade or None, raw response text, from_cache)
     """
-    # CHANGED: Passed 'request' object to get_google_service
-    classroom_service = get_google_service('classroom', 'v1', request)
-    if not classroom_service:
-        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-        return JSONResponse(
-            content={"error": "User not authenticated or session expired. Please re-login."}, 
-            status_code=401
-        )
-    
-    try:
-        submissions_response = classroom_service.courses().courseWork().studentSubmissions().list(
-            courseId=course_id,
-            courseWorkId=assignment_id,
-            states=['TURNED_IN'] 
-        ).execute()
-        
-        submissions = submissions_response.get('studentSubmissions', [])
-        
-        # Fetch student profiles for names and enrich submissions
-        processed_submissions = []
-        for submission in submissions:
-            user_id = submission['userId']
-            student_name = f"Unknown Student ({user_id})" # Default name in case of error
+    cache_key = grading_cache_key(GEMINI_GRADING_MODEL, prompt)
 
-            try:
-                # Need the 'classroom.profile.emails' scope for userProfiles().get
-                student_profile = classroom_service.userProfiles().get(userId=user_id).execute()
-                student_name = student_profile.get('name', {}).get('fullName', student_name)
-            except HttpError as e:
-                print(f"Error fetching profile for user {user_id}: {e.resp.status} - {e.content.decode('utf-8')}")
-                # If there's an HTTP error, keep the default name
-            except Exception as e:
-                print(f"An unexpected error occurred while fetching profile for user {user_id}: {e}")
-                # If any other error, keep the default name
-            
-            submission['studentName'] = student_name # Add the name to the submission object
-            processed_submissions.append(submission)
+    if use_cache:
+        cached = await run_blocking(grading_response_cache.get, cache_key)
+        if cached is not None:
+            print("⚡ Using cached Gemini grading result")
+            return parse_gemini_grading_response(cached["text"]), cached["text"], True
 
-        # CHANGED: Returned list directly, FastAPI handles 'jsonify'
-        return processed_submissions
-    except HttpError as error:
-        print(f"Google Classroom API Error in get_submissions for course {course_id}, assignment {assignment_id}: {error.resp.status} - {error.content.decode('utf-8')}")
-        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-        return JSONResponse(
-            content={"error": f"Failed to fetch submissions: {error.content.decode('utf-8')}"}, 
-            status_code=error.resp.status
+    model = genai.GenerativeModel(model_name=GEMINI_GRADING_MODEL, generation_config=GRADING_GENERATION_CONFIG)
+    response = await generate_gemini_content(model, prompt)
+    parsed_grade, grade_text_output = await finish_gemini_grade(model, cache_key, response.text, cache_tags)
+    return parsed_grade, grade_text_output, False
+
+
+async def finish_gemini_grade(model, cache_key, grade_text_output, cache_tags=None):
+    """
+    Parses a complete Gemini grading response, asking Gemini once to repair it if it fails
+    validation, and caches the result when it is well-formed.
+
+    Returns:
+        tuple: (parsed_grade or None, final response text)
+    """
+    parsed_grade = parse_gemini_grading_response(grade_text_output)
+    if parsed_grade is None:
+        error_description = describe_grading_response_error(grade_text_output)
+        print(f"⚠️ Gemini grading response failed validation ({error_description}). Retrying once with a repair prompt...")
+        repair_response = await generate_gemini_content(
+            model, build_grading_repair_prompt(grade_text_output, error_description)
         )
+        repaired_output = repair_response.text
+        parsed_grade = parse_gemini_grading_response(repaired_output)
+        if parsed_grade is not None:
+            grade_text_output = repaired_output
+
+    if parsed_grade is not None:
+        # Only well-formed responses are cached, so a bad response is never replayed
+        await run_blocking(grading_response_cache.set, cache_key, {
+            "text": grade_text_output,
+            "model": GEMINI_GRADING_MODEL,
+            "prompt_version": GRADING_PROMPT_VERSION,
+            **(cache_tags or {})
+        })
+    return parsed_grade, grade_text_output
+
+
+# --- BATCHED GEMINI GRADING ---
+# Packs several submissions for the same assignment into one structured request. The shared
+# questionnaire and answer key are sent once per batch instead of once per student, and the
+# batch size is bounded by an estimated token budget.
+GRADING_BATCH_MODE = os.getenv("GRADING_BATCH_MODE", "false").lower() == "true"
+GRADING_BATCH_TOKEN_BUDGET = int(os.getenv("GRADING_BATCH_TOKEN_BUDGET", "24000"))
+GRADING_BATCH_MAX_SUBMISSIONS = int(os.getenv("GRADING_BATCH_MAX_SUBMISSIONS", "8"))
+
+
+class BatchGradingResult(TypedDict):
+    """Response schema for one student inside a batched grading response."""
+    submission_id: str
+    grade: int
+    grade_justification: str
+    feedback: str
+
+
+BATCH_GRADING_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=list[BatchGradingResult]
+)
 
-import uvicorn # ADDED: For running the FastAPI server
-import datetime # ADDED: This import was used in the grading logic
 
-# --- (Previous code from last snippet) ---
-# ... (imports, helpers, auth routes, and data-fetching routes) ...
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used for sizing batches."""
+    return len(text) // 4 + 1
 
 
-# --- 5. CORE GRADING ROUTE ---
+def build_gemini_batch_grading_prompt(assignment_title, questionnaire_text, answer_key_content, submissions):
+    """
+    Builds one prompt grading several submissions of the same assignment.
 
-# CHANGED: Converted Flask route to FastAPI POST endpoint
-# ADDED: 'request: Request' parameter
-@app.post('/api/grade')
-async def grade_submission(request: Request):
-    global graded_assignments_history 
+    Args:
+        submissions (list): dicts with 'submission_id' and 'text'
+    """
+    submission_sections = '\n\n'.join(
+        f"--- STUDENT SUBMISSION (submission_id: {item['submission_id']}) ---\n{item['text']}"
+        for item in submissions
+    )
+    return f"""
+        You are an expert AI teaching assistant for a Google Classroom assignment titled "{assignment_title}". Your task is to rigorously and independently grade each of the {len(submissions)} student submissions below, providing a score out of 100 and comprehensive feedback for each one.
 
-    # CHANGED: 'request.json' is now 'await request.json()'
-    data = await request.json()
+        --- QUESTIONNAIRE (The questions/tasks presented to the students) ---
+        {questionnaire_text}
+
+        --- OFFICIAL ANSWER KEY (The expected correct responses/solutions) ---
+        {answer_key_content}
+
+{submission_sections}
+
+        --- GRADING INSTRUCTIONS (apply to each submission on its own; never compare students) ---
+{GRADING_CRITERIA}
+
+        8.  **Respond ONLY with a JSON array containing one object per submission, with exactly these fields:**
+            * "submission_id": the submission_id shown in that submission's header
+            * "grade": integer score from 0 to 100
+            * "grade_justification": a brief, one-sentence reason for the score
+            * "feedback": your detailed feedback paragraph, covering all points from instruction 6
+        """
+
+
+def pack_grading_batches(items, base_tokens):
+    """
+    Greedily packs submissions into batches bounded by GRADING_BATCH_TOKEN_BUDGET
+    (including the shared questionnaire/key tokens) and GRADING_BATCH_MAX_SUBMISSIONS.
+    A submission that alone exceeds the budget gets a batch of its own.
+    """
+    batches = []
+    current_batch = []
+    current_tokens = base_tokens
+
+    for item in items:
+        item_tokens = estimate_tokens(item['text'])
+        if current_batch and (current_tokens + item_tokens > GRADING_BATCH_TOKEN_BUDGET
+                              or len(current_batch) >= GRADING_BATCH_MAX_SUBMISSIONS):
+            batches.append(current_batch)
+            current_batch = []
+            current_tokens = base_tokens
+        current_batch.append(item)
+        current_tokens += item_tokens
+
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+async def request_gemini_batch_grade(assignment_title, questionnaire_text, answer_key_content, submissions):
+    """
+    Grades a batch of submissions with one Gemini call.
+
+    Returns:
+        dict: submission_id -> (grade, justification, feedback) for every submission whose
+        result was present and valid. Missing or invalid entries are left out so the caller
+        can grade them individually.
+    """
+    prompt = build_gemini_batch_grading_prompt(assignment_title, questionnaire_text, answer_key_content, submissions)
+    model = genai.GenerativeModel(model_name=GEMINI_GRADING_MODEL, generation_config=BATCH_GRADING_GENERATION_CONFIG)
+    response = await generate_gemini_content(model, prompt)
+
+    try:
+        batch_results = load_json_response(response.text)
+    except ValueError as e:
+        print(f"⚠️ Batched grading response was not valid JSON: {e}")
+        return {}
+    if not isinstance(batch_results, list):
+        print("⚠️ Batched grading response was not a JSON array")
+        return {}
+
+    expected_ids = {item['submission_id'] for item in submissions}
+    graded = {}
+    for result in batch_results:
+        submission_id = result.get('submission_id') if isinstance(result, dict) else None
+        if submission_id not in expected_ids:
+            continue
+        try:
+            graded[submission_id] = validate_grading_result(result)
+        except ValueError as e:
+            print(f"⚠️ Invalid batched result for submission {submission_id}: {e}")
+    return graded
+
+
+async def load_grading_inputs(request, data):
+    """
+    Validates a single-submission grading request and fetches everything the Gemini
+    prompt needs (answer key, questionnaire, student submission).
+
+    Returns:
+        dict: grading inputs including the built prompt, or a JSONResponse describing the error
+    """
     course_id = data.get('course_id')
     course_name = data.get('course_name') 
     assignment_id = data.get('assignment_id')
@@ -720,6 +2781,7 @@ async def grade_submission(request: Request):
     answer_key_url = data.get('answer_key_url')
     answer_key_text = data.get('answer_key_text')  # NEW: Accept answer key as text
     use_hybrid = data.get('use_hybrid', True)  # NEW: Flag to enable/disable hybrid grading (default: True)
+    force_regrade = data.get('force_regrade', False)  # Bypass the cached Gemini result for this submission
 
     # Debug logging
     print(f"📥 Received grading request:")
@@ -756,8 +2818,8 @@ async def grade_submission(request: Request):
         )
 
     # CHANGED: Passed 'request' object to get_google_service
-    classroom_service = get_google_service('classroom', 'v1', request)
-    drive_service = get_google_service('drive', 'v3', request)
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
+    drive_service = await run_blocking(get_google_service, 'drive', 'v3', request)
 
     if not classroom_service or not drive_service:
         # CHANGED: 'jsonify' is replaced with 'JSONResponse'
@@ -767,10 +2829,10 @@ async def grade_submission(request: Request):
         )
     
     try:
-        # Get answer key - either from URL or use provided text
+        # Resolve the answer key source up front (no I/O needed)
+        answer_key_file_id = None
         if answer_key_text:
             # Use the provided answer key text directly
-            answer_key_content = answer_key_text
             print("Using provided answer key text (generated by AI)")
         else:
             # Download from URL (original behavior)
@@ -783,56 +2845,70 @@ async def grade_submission(request: Request):
                     content={"error": "Invalid Google Drive URL provided for the Answer Key. Please check the URL format (should contain /d/FILE_ID/)."},
                     status_code=400
                 )
-            
             print(f"✅ Extracted file ID: {answer_key_file_id}")
+
+        # --- Document dependency graph ---
+        # answer key download ---------------------------------------------+
+        # assignment details -> questionnaire file ID -> download --------+--> Gemini prompt
+        # submission details -> student file ID -> download --------------+
+        # The three chains are independent, so they are fetched concurrently.
+        # Each chain returns its result, or a JSONResponse describing why it failed.
+
+        async def fetch_answer_key():
+            if answer_key_text:
+                return answer_key_text
             print(f"Attempting to download answer key from Google Drive...")
-            
-            answer_key_content = download_drive_file_content(drive_service, answer_key_file_id, "Answer Key")
-            if not answer_key_content:
+            content = await run_throttled(download_drive_file_content, drive_service, answer_key_file_id, "Answer Key")
+            if not content:
                 print(f"❌ Failed to download answer key. File ID: {answer_key_file_id}")
                 return JSONResponse(
                     content={"error": "Failed to download answer key from URL. Please ensure: 1) The file is shared with your Google account, 2) You have View access, 3) The URL is correct."},
                     status_code=500
                 )
+            return content
 
-        assignment_details = classroom_service.courses().courseWork().get(courseId=course_id, id=assignment_id).execute()
-        materials = assignment_details.get('materials', [])
-        questionnaire_file_id = None
-        
-        for material in materials:
-            if 'driveFile' in material and 'driveFile' in material['driveFile']:
-                questionnaire_file_id = material['driveFile']['driveFile']['id']
-                print(f"Identified questionnaire file ID: {questionnaire_file_id} from assignment materials.")
-                break 
-        
-        if not questionnaire_file_id:
-            # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-            return JSONResponse(
-                content={"error": "No Google Drive document (questionnaire) found attached to this assignment."},
-                status_code=404
-            )
+        async def fetch_questionnaire():
+            assignment_details = await run_google_request(classroom_service.courses().courseWork().get(courseId=course_id, id=assignment_id), 'classroom')
+            questionnaire_file_id = None
 
-        submission_details = classroom_service.courses().courseWork().studentSubmissions().get(
-            courseId=course_id, courseWorkId=assignment_id, id=submission_id).execute()
-        
-        attachments = submission_details.get('assignmentSubmission', {}).get('attachments', [])
-        if not attachments:
-            # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-            return JSONResponse(
-                content={"error": "This student has not attached any file to their submission."},
-                status_code=404
-            )
-        
-        student_submission_file_id = attachments[0]['driveFile']['id']
-        print(f"Identified student submission file ID: {student_submission_file_id}.")
+            for material in assignment_details.get('materials', []):
+                if 'driveFile' in material and 'driveFile' in material['driveFile']:
+                    questionnaire_file_id = material['driveFile']['driveFile']['id']
+                    print(f"Identified questionnaire file ID: {questionnaire_file_id} from assignment materials.")
+                    break
+
+            if not questionnaire_file_id:
+                return JSONResponse(
+                    content={"error": "No Google Drive document (questionnaire) found attached to this assignment."},
+                    status_code=404
+                )
+
+            questionnaire_text = await run_throttled(download_drive_file_content, drive_service, questionnaire_file_id, "Questionnaire")
+            return assignment_details, questionnaire_text
+
+        async def fetch_student_submission():
+            submission_details = await run_google_request(classroom_service.courses().courseWork().studentSubmissions().get(
+                courseId=course_id, courseWorkId=assignment_id, id=submission_id), 'classroom')
+
+            attachments = submission_details.get('assignmentSubmission', {}).get('attachments', [])
+            if not attachments:
+                return JSONResponse(
+                    content={"error": "This student has not attached any file to their submission."},
+                    status_code=404
+                )
+
+            student_submission_file_id = attachments[0]['driveFile']['id']
+            print(f"Identified student submission file ID: {student_submission_file_id}.")
+            return await run_throttled(download_drive_file_content, drive_service, student_submission_file_id, "Student Submission")
 
+        print("Initiating concurrent document downloads...")
+        fetch_results = await asyncio.gather(fetch_answer_key(), fetch_questionnaire(), fetch_student_submission())
 
-        print("Initiating document downloads...")
-        # NOTE: download_drive_file_content is synchronous.
-        # For a fully async app, these should be run in a thread pool,
-        # but leaving as-is for direct conversion.
-        questionnaire_text = download_drive_file_content(drive_service, questionnaire_file_id, "Questionnaire")
-        student_submission_text = download_drive_file_content(drive_service, student_submission_file_id, "Student Submission")
+        for fetch_result in fetch_results:
+            if isinstance(fetch_result, JSONResponse):
+                return fetch_result
+
+        answer_key_content, (assignment_details, questionnaire_text), student_submission_text = fetch_results
 
         if not all([questionnaire_text, answer_key_content, student_submission_text]):
             # CHANGED: 'jsonify' is replaced with 'JSONResponse'
@@ -841,236 +2917,275 @@ async def grade_submission(request: Request):
                 status_code=500
             )
         
-        print("Documents downloaded. Constructing Gemini prompt and calling AI...")
-        model = genai.GenerativeModel(model_name="gemini-2.5-flash") # Using 1.5 Flash as a modern equivalent
-        
-        prompt = f"""
-        You are an expert AI teaching assistant for a Google Classroom assignment titled "{assignment_details.get('title', 'Unknown Assignment')}". Your task is to rigorously grade the student's submission, providing a score out of 100, and comprehensive feedback.
-
-        --- QUESTIONNAIRE (The questions/tasks presented to the student) ---
-        {questionnaire_text}
-
-        --- OFFICIAL ANSWER KEY (The expected correct responses/solutions) ---
-        {answer_key_content}
-
-        --- STUDENT'S SUBMISSION (The student's actual answers/work) ---
-        {student_submission_text}
-
-        --- GRADING INSTRUCTIONS ---
-        1.  **Understanding the Task:** Carefully read the QUESTIONNAIRE to grasp the specific requirements and learning objectives.
-
-        2.  **Content Accuracy & Completeness:** Compare the STUDENT'S SUBMISSION against the OFFICIAL ANSWER KEY.
-            * How accurately does the student address each question/task?
-            * Is the information presented correct?
-            * Are all parts of the question/task attempted and completed?
-            * **Award points for partially correct or reasonable attempts. Avoid giving a 0 unless the submission is entirely blank, off-topic, or completely nonsensical.** Even minimal effort to address the prompt should receive some credit.
+        print("Documents downloaded. Constructing Gemini prompt...")
+        prompt = build_gemini_grading_prompt(
+            assignment_details.get('title', 'Unknown Assignment'),
+            questionnaire_text,
+            answer_key_content,
+            student_submission_text
+        )
 
-        3.  **Structure & Clarity:** Evaluate the organization, clarity, and readability of the student's response.
+        return {
+            "course_id": course_id,
+            "course_name": course_name,
+            "assignment_id": assignment_id,
+            "assignment_title": assignment_title,
+            "submission_id": submission_id,
+            "student_name": student_name,
+            "use_hybrid": use_hybrid,
+            "force_regrade": force_regrade,
+            "answer_key_content": answer_key_content,
+            "student_submission_text": student_submission_text,
+            "questionnaire_text": questionnaire_text,
+            "prompt": prompt
+        }
 
-        4.  **Meaning & Comprehension:** Assess the student's understanding of the concepts. Does their submission demonstrate comprehension, or is it just rote memorization/copying?
+    except HttpError as error:
+        error_details = error.content.decode('utf-8')
+        print(f"Google API Error while loading grading documents: {error.resp.status} - {error_details}")
+        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+        return JSONResponse(
+            content={"error": f"Google API Error: {error_details}"},
+            status_code=error.resp.status
+        )
+    except Exception as e:
+        print(f"An unexpected error occurred while loading grading documents: {e}")
+        # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+        return JSONResponse(
+            content={"error": f"An unexpected error occurred: {str(e)}"},
+            status_code=500
+        )
 
-        5.  **Assign a Numerical Grade (0-100):** Based on the above criteria, assign a numerical grade, using the following guidelines to achieve scores between 70-80 for conceptually correct but less precise answers:
-            * **90-100 (Excellent):** Answers are accurate, complete, well-structured, and demonstrate deep comprehension. Critically, they are also *precise* and leverage key terminology from the answer key where appropriate.
-            * **75-89 (Good/Strong):** Answers are *conceptually correct* and show good understanding, but might lack the highest level of precision or miss some specific key terminology from the answer key. They are clear, mostly complete, but could be more refined.
-            * **50-74 (Fair/Developing):** Answers are partially correct, contain some inaccuracies, or are vague. They may demonstrate some understanding but require significant improvement in content, clarity, or completeness.
-            * **< 50 (Limited/Poor):** Answers are largely incorrect, off-topic, or show minimal understanding. This category should only be used if attempts are very weak or absent.
 
-        6.  **Provide Comprehensive Feedback:**
-            * Start with positive aspects or areas where the student demonstrated understanding.
-            * Clearly explain where points were lost, referencing specific parts of the questionnaire or answer key.
-            * For "Good/Strong" answers, specifically suggest how they could make their explanation more precise or complete by integrating relevant key terms or more detailed examples.
-            * Suggest concrete steps for improvement.
+def grading_inputs_cache_tags(grading_inputs):
+    """Tags stored with the cached Gemini result for a single-submission grade."""
+    return {
+        "course_id": grading_inputs["course_id"],
+        "assignment_id": grading_inputs["assignment_id"],
+        "submission_id": grading_inputs["submission_id"]
+    }
 
-        7.  **Justify the Grade (Briefly):** Include a short sentence explaining the overall reasoning for the assigned score, linking it to the guidelines above (e.g., "Conceptually solid but lacked some precision and specific terminology for full marks.")
 
-        8.  **Format your response STRICTLY as follows, with no extra text before or after, ensuring clear separation for parsing:
-        GRADE: [SCORE]/100
-        GRADE_JUSTIFICATION: [A brief, one-sentence reason for the score]
-        FEEDBACK: [Your detailed feedback paragraph here, covering all points from instruction 6]
-        """
-        
-        # CHANGED: Switched to the async version of the call
-        response = await model.generate_content_async(prompt)
+def complete_grading(grading_inputs, parsed_grade, from_cache):
+    """
+    Applies hybrid MiniLM verification to a parsed Gemini grade, saves the graded item
+    and builds the /api/grade response body.
+    """
+    course_id = grading_inputs["course_id"]
+    course_name = grading_inputs["course_name"]
+    assignment_id = grading_inputs["assignment_id"]
+    assignment_title = grading_inputs["assignment_title"]
+    submission_id = grading_inputs["submission_id"]
+    student_name = grading_inputs["student_name"]
+    use_hybrid = grading_inputs["use_hybrid"]
+    answer_key_content = grading_inputs["answer_key_content"]
+    student_submission_text = grading_inputs["student_submission_text"]
+    ai_grade, ai_justification, ai_feedback = parsed_grade
+    
+    # --- CONDITIONAL HYBRID GRADING ---
+    if use_hybrid:
+        # Use hybrid grading (MiniLM + Gemini) for Grade WITH Key workflow
+        print("=" * 60)
+        print("Starting hybrid grading (MiniLM + Gemini)...")
+        print("=" * 60)
         
-        print("Gemini response received. Parsing...")
-        grade_text_output = response.text
+        # Get Gemini's grade
+        gemini_grade = ai_grade
+        print(f"📝 Gemini grade: {gemini_grade}/100")
         
-        grade_match = re.search(r'GRADE:\s*(\d+)/100', grade_text_output, re.IGNORECASE)
-        justification_match = re.search(r'GRADE_JUSTIFICATION:\s*(.*)', grade_text_output, re.IGNORECASE)
-        feedback_match = re.search(r'FEEDBACK:\s*(.*)', grade_text_output, re.IGNORECASE | re.DOTALL)
-
-        if not grade_match or not feedback_match or not justification_match:
-            print(f"Gemini response was not in the expected format. Raw response:\n{grade_text_output}")
-            # CHANGED: 'jsonify' is replaced with 'JSONResponse'
-            return JSONResponse(
-                content={"error": "Failed to parse grade, justification, or feedback from AI response. Please ensure Gemini's output adheres to the specified format."},
-                status_code=500
-            )
-            
-        ai_grade = int(grade_match.group(1))
-        ai_justification = justification_match.group(1).strip()
-        ai_feedback = feedback_match.group(1).strip()
-        
-        # --- CONDITIONAL HYBRID GRADING ---
-        if use_hybrid:
-            # Use hybrid grading (MiniLM + Gemini) for Grade WITH Key workflow
-            print("=" * 60)
-            print("Starting hybrid grading (MiniLM + Gemini)...")
-            print("=" * 60)
-            
-            # Get Gemini's grade
-            gemini_grade = ai_grade
-            print(f"📝 Gemini grade: {gemini_grade}/100")
-            
-            # Try to get MiniLM semantic similarity score
-            print(f"🔍 Calculating MiniLM semantic similarity...")
+        # Try to get MiniLM semantic similarity score (per question when both texts use "Question N:" numbering)
+        print(f"🔍 Calculating MiniLM semantic similarity...")
+        question_scores = get_minilm_question_scores(
+            answer_key_content, student_submission_text, grading_inputs.get("questionnaire_text")
+        )
+        if question_scores is not None:
+            minilm_similarity = question_scores["similarity"]
+            print(f"🧩 Scored {len(question_scores['questions'])} questions individually")
+        else:
             minilm_similarity = get_minilm_semantic_score(answer_key_content, student_submission_text)
-            
-            if minilm_similarity is not None:
-                print(f"✅ MiniLM similarity score: {minilm_similarity:.4f}")
-                minilm_grade = normalize_minilm_score_to_grade(minilm_similarity)
-                print(f"📊 MiniLM normalized grade: {minilm_grade}/100")
-            else:
-                print(f"⚠️ MiniLM model not available, using Gemini only")
-                minilm_grade = None
-            
-            # Compare and decide final grade
-            grade_analysis = compare_minilm_and_gemini_grades(minilm_grade, gemini_grade)
-            
-            final_grade = grade_analysis['final_grade']
-            confidence_level = grade_analysis['confidence']
-            grading_method = grade_analysis['method']
-            
-            print(f"🎯 Final grade: {final_grade}/100")
-            print(f"📊 Confidence: {confidence_level}")
-            print(f"🔧 Method: {grading_method}")
-            print(f"💡 {grade_analysis['recommendation']}")
-            print("=" * 60)
-            
-            # Build comprehensive justification
-            if minilm_grade is not None:
-                grade_justification = (
-                    f"{ai_justification} "
-                    f"[Verified with MiniLM semantic model: {minilm_similarity:.3f} similarity, "
-                    f"{minilm_grade}/100. Difference: {grade_analysis['difference']}pts]"
-                )
-                remarks = (
-                    f"Hybrid grading ({grading_method}): MiniLM similarity={minilm_similarity:.3f}, "
-                    f"MiniLM grade={minilm_grade}, Gemini grade={gemini_grade}, Final={final_grade}. "
-                    f"{grade_analysis['recommendation']}"
-                )
-            else:
-                grade_justification = f"{ai_justification} [Gemini-only grading]"
-                remarks = "Graded using Gemini AI only (MiniLM model not available)."
-            
-            feedback_str = ai_feedback
+        
+        if minilm_similarity is not None:
+            print(f"✅ MiniLM similarity score: {minilm_similarity:.4f}")
+            minilm_grade = normalize_minilm_score_to_grade(minilm_similarity)
+            print(f"📊 MiniLM normalized grade: {minilm_grade}/100")
         else:
-            # Use Gemini-only grading for Grade WITHOUT Key workflow
-            print("=" * 60)
-            print("Using Gemini-only grading (hybrid disabled)...")
-            print("=" * 60)
-            
-            final_grade = ai_grade
-            confidence_level = "high"
-            grading_method = "gemini_only"
-            grade_justification = f"{ai_justification} [Gemini-only grading]"
-            remarks = "Graded using Gemini AI only (no hybrid model)."
-            feedback_str = ai_feedback
+            print(f"⚠️ MiniLM model not available, using Gemini only")
             minilm_grade = None
-            grade_analysis = None
-            
-            print(f"🎯 Final grade: {final_grade}/100")
-            print(f"📝 Method: Gemini only")
-            print("=" * 60)
         
-        # --- END CONDITIONAL GRADING ---
+        # Compare and decide final grade
+        grade_analysis = compare_minilm_and_gemini_grades(minilm_grade, gemini_grade)
         
-        # import datetime # This was here, moved to top
-        graded_item = {
-            "course_id": course_id,
-            "course_name": course_name,
-            "assignment_id": assignment_id,
-            "assignment_title": assignment_title,
-            "submission_id": submission_id,
-            "student_name": student_name,
-            "assignedGrade": final_grade,
-            "confidence": confidence_level,
-            "grading_method": grading_method,
-            "feedback": feedback_str,
-            "grade_justification": grade_justification,
-            "remarks": remarks,
-            "timestamp": datetime.datetime.now().isoformat()
-        }
+        final_grade = grade_analysis['final_grade']
+        confidence_level = grade_analysis['confidence']
+        grading_method = grade_analysis['method']
         
-        # Save to MongoDB (with fallback to in-memory)
-        if grades_collection is not None:
-            try:
-                result = grades_collection.insert_one(graded_item.copy())
-                print(f"✅ Grade saved to MongoDB with ID: {result.inserted_id}")
-                
-                # Update student's record
-                students_collection.update_one(
-                    {"student_name": student_name, "course_id": course_id},
-                    {
-                        "$set": {
-                            "student_name": student_name,
-                            "course_id": course_id,
-                            "course_name": course_name,
-                            "last_updated": datetime.datetime.now().isoformat()
-                        },
-                        "$inc": {"total_assignments": 1},
-                        "$push": {
-                            "grades_history": {
-                                "assignment_id": assignment_id,
-                                "assignment_title": assignment_title,
-                                "grade": final_grade,
-                                "timestamp": graded_item["timestamp"]
-                            }
-                        }
-                    },
-                    upsert=True
-                )
-                print(f"✅ Student profile updated for {student_name}")
-            except Exception as mongo_error:
-                print(f"⚠️ MongoDB save error: {mongo_error}")
-                print("⚠️ Falling back to in-memory storage")
-                graded_assignments_history.append(graded_item)
+        print(f"🎯 Final grade: {final_grade}/100")
+        print(f"📊 Confidence: {confidence_level}")
+        print(f"🔧 Method: {grading_method}")
+        print(f"💡 {grade_analysis['recommendation']}")
+        print("=" * 60)
+        
+        # Build comprehensive justification
+        if minilm_grade is not None:
+            grade_justification = (
+                f"{ai_justification} "
+                f"[Verified with MiniLM semantic model: {minilm_similarity:.3f} similarity, "
+                f"{minilm_grade}/100. Difference: {grade_analysis['difference']}pts]"
+            )
+            remarks = (
+                f"Hybrid grading ({grading_method}): MiniLM similarity={minilm_similarity:.3f}, "
+                f"MiniLM grade={minilm_grade}, Gemini grade={gemini_grade}, Final={final_grade}. "
+                f"{grade_analysis['recommendation']}"
+            )
         else:
-            # Fallback to in-memory if MongoDB not connected
-            graded_assignments_history.append(graded_item)
-            print("⚠️ Using in-memory storage (MongoDB not connected)")
-
-        print(f"Gemini Grade: {final_grade}/100. Providing review for dashboard display only (no Classroom update).")
-        
-        # Build response with grading information
-        response_data = {
-            "message": f"{'Hybrid' if use_hybrid else 'Gemini-only'} grading complete. Review provided for dashboard display only.",
-            "assignedGrade": final_grade,
-            "confidence": confidence_level,
-            "grading_method": grading_method,
-            "feedback": feedback_str,
-            "grade_justification": grade_justification,
-            "remarks": remarks,
-            "status": "review_only", 
-            "graded_history": graded_assignments_history
-        }
+            grade_justification = f"{ai_justification} [Gemini-only grading]"
+            remarks = "Graded using Gemini AI only (MiniLM model not available)."
+        
+        feedback_str = ai_feedback
+    else:
+        # Use Gemini-only grading for Grade WITHOUT Key workflow
+        print("=" * 60)
+        print("Using Gemini-only grading (hybrid disabled)...")
+        print("=" * 60)
+        
+        final_grade = ai_grade
+        confidence_level = "high"
+        grading_method = "gemini_only"
+        grade_justification = f"{ai_justification} [Gemini-only grading]"
+        remarks = "Graded using Gemini AI only (no hybrid model)."
+        feedback_str = ai_feedback
+        minilm_grade = None
+        grade_analysis = None
+        question_scores = None
         
-        # Add separate grades when hybrid grading is enabled and available
-        if use_hybrid and minilm_grade is not None and grade_analysis is not None:
-            response_data["minilm_grade"] = minilm_grade
-            response_data["gemini_grade"] = ai_grade
-            response_data["grade_difference"] = grade_analysis.get('difference')
-            response_data["minilm_similarity"] = round(get_minilm_semantic_score(answer_key_content, student_submission_text), 4)
+        print(f"🎯 Final grade: {final_grade}/100")
+        print(f"📝 Method: Gemini only")
+        print("=" * 60)
+    
+    # --- END CONDITIONAL GRADING ---
+    
+    # import datetime # This was here, moved to top
+    graded_item = {
+        "course_id": course_id,
+        "course_name": course_name,
+        "assignment_id": assignment_id,
+        "assignment_title": assignment_title,
+        "submission_id": submission_id,
+        "student_name": student_name,
+        "assignedGrade": final_grade,
+        "confidence": confidence_level,
+        "grading_method": grading_method,
+        "feedback": feedback_str,
+        "grade_justification": grade_justification,
+        "remarks": remarks,
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+    
+    # Save to MongoDB (with fallback to in-memory)
+    if grades_collection is not None:
+        try:
+            result = grades_collection.insert_one(graded_item.copy())
+            print(f"✅ Grade saved to MongoDB with ID: {result.inserted_id}")
             
-            # If low/medium confidence, flag for detailed review
-            if confidence_level in ['low', 'medium'] and grade_analysis.get('difference', 0) > 15:
-                response_data["needs_review"] = True
-                response_data["review_reason"] = f"MiniLM and Gemini disagree by {grade_analysis['difference']} points"
+            # Update student's record
+            students_collection.update_one(
+                {"student_name": student_name, "course_id": course_id},
+                {
+                    "$set": {
+                        "student_name": student_name,
+                        "course_id": course_id,
+                        "course_name": course_name,
+                        "last_updated": datetime.datetime.now().isoformat()
+                    },
+                    "$inc": {"total_assignments": 1},
+                    "$push": {
+                        "grades_history": {
+                            "assignment_id": assignment_id,
+                            "assignment_title": assignment_title,
+                            "grade": final_grade,
+                            "timestamp": graded_item["timestamp"]
+                        }
+                    }
+                },
+                upsert=True
+            )
+            print(f"✅ Student profile updated for {student_name}")
+        except Exception as mongo_error:
+            print(f"⚠️ MongoDB save error: {mongo_error}")
+            print("⚠️ Falling back to in-memory storage")
+            graded_assignments_history.append(graded_item)
+    else:
+        # Fallback to in-memory if MongoDB not connected
+        graded_assignments_history.append(graded_item)
+        print("⚠️ Using in-memory storage (MongoDB not connected)")
+
+    print(f"Gemini Grade: {final_grade}/100. Providing review for dashboard display only (no Classroom update).")
+    
+    # Build response with grading information
+    response_data = {
+        "message": f"{'Hybrid' if use_hybrid else 'Gemini-only'} grading complete. Review provided for dashboard display only.",
+        "assignedGrade": final_grade,
+        "confidence": confidence_level,
+        "grading_method": grading_method,
+        "feedback": feedback_str,
+        "grade_justification": grade_justification,
+        "remarks": remarks,
+        "status": "review_only", 
+        "from_cache": from_cache,
+        "graded_history": graded_assignments_history
+    }
+    
+    # Add separate grades when hybrid grading is enabled and available
+    if use_hybrid and minilm_grade is not None and grade_analysis is not None:
+        response_data["minilm_grade"] = minilm_grade
+        response_data["gemini_grade"] = ai_grade
+        response_data["grade_difference"] = grade_analysis.get('difference')
+        response_data["minilm_similarity"] = round(minilm_similarity, 4)
+        if question_scores is not None:
+            response_data["question_breakdown"] = question_scores["questions"]
         
-        # CHANGED: 'jsonify' is replaced with returning a dictionary
-        return response_data
+        # If low/medium confidence, flag for detailed review
+        if confidence_level in ['low', 'medium'] and grade_analysis.get('difference', 0) > 15:
+            response_data["needs_review"] = True
+            response_data["review_reason"] = f"MiniLM and Gemini disagree by {grade_analysis['difference']} points"
+    
+    return response_data
 
 
+GRADE_PARSE_ERROR_MESSAGE = "Failed to parse grade, justification, or feedback from AI response, even after a repair attempt. Please try grading again."
+
+
+# CHANGED: Converted Flask route to FastAPI POST endpoint
+# ADDED: 'request: Request' parameter
+@app.post('/api/grade')
+async def grade_submission(request: Request):
+    # CHANGED: 'request.json' is now 'await request.json()'
+    data = await request.json()
+    grading_inputs = await load_grading_inputs(request, data)
+    if isinstance(grading_inputs, JSONResponse):
+        return grading_inputs
+
+    try:
+        print("Calling Gemini AI...")
+        # CHANGED: Switched to the async version of the call
+        parsed_grade, grade_text_output, from_cache = await request_gemini_grade(
+            grading_inputs["prompt"],
+            cache_tags=grading_inputs_cache_tags(grading_inputs),
+            use_cache=not grading_inputs["force_regrade"]
+        )
+        print("Gemini response received. Parsing...")
+
+        if parsed_grade is None:
+            print(f"Gemini response was not in the expected format. Raw response:\n{grade_text_output}")
+            # CHANGED: 'jsonify' is replaced with 'JSONResponse'
+            return JSONResponse(
+                content={"error": GRADE_PARSE_ERROR_MESSAGE},
+                status_code=500
+            )
+
+        # CHANGED: 'jsonify' is replaced with returning a dictionary
+        return await run_blocking(complete_grading, grading_inputs, parsed_grade, from_cache)
+
     except HttpError as error:
         error_details = error.content.decode('utf-8')
         print(f"Google API Error in grading: {error.resp.status} - {error_details}")
@@ -1087,8 +3202,88 @@ async def grade_submission(request: Request):
             status_code=500
         )
 
+
+@app.post('/api/grade/stream')
+async def grade_submission_stream(request: Request):
+    """
+    Streaming variant of /api/grade. Gemini output is forwarded as `token` events while it
+    is generated; the parsed, hybrid-verified grade is sent as the closing `grade` event
+    (same body as /api/grade). Request validation and document errors are still returned
+    as regular JSON error responses before the stream starts.
+    """
+    data = await request.json()
+    grading_inputs = await load_grading_inputs(request, data)
+    if isinstance(grading_inputs, JSONResponse):
+        return grading_inputs
+
+    async def event_stream():
+        try:
+            cache_key = grading_cache_key(GEMINI_GRADING_MODEL, grading_inputs["prompt"])
+            cached = None
+            if not grading_inputs["force_regrade"]:
+                cached = await run_blocking(grading_response_cache.get, cache_key)
+
+            if cached is not None:
+                print("⚡ Using cached Gemini grading result")
+                yield sse_event("token", {"text": cached["text"]})
+                parsed_grade, from_cache = parse_gemini_grading_response(cached["text"]), True
+            else:
+                model = genai.GenerativeModel(model_name=GEMINI_GRADING_MODEL, generation_config=GRADING_GENERATION_CONFIG)
+                chunks = []
+                async for text in stream_gemini_content(model, grading_inputs["prompt"]):
+                    chunks.append(text)
+                    yield sse_event("token", {"text": text})
+                parsed_grade, _ = await finish_gemini_grade(
+                    model, cache_key, "".join(chunks), grading_inputs_cache_tags(grading_inputs)
+                )
+                from_cache = False
+
+            if parsed_grade is None:
+                yield sse_event("error", {"error": GRADE_PARSE_ERROR_MESSAGE, "status_code": 500})
+                return
+
+            response_data = await run_blocking(complete_grading, grading_inputs, parsed_grade, from_cache)
+            yield sse_event("grade", response_data)
+        except Exception as e:
+            print(f"An unexpected error occurred during streamed grading: {e}")
+            yield sse_event("error", {"error": f"An unexpected error occurred: {str(e)}", "status_code": 500})
+
+    return sse_response(event_stream())
+
+
 # --- New route to fetch the entire grading history ---
 
+def load_graded_history(course_id=None, assignment_id=None):
+    """Blocking. Saved grades (most recent first), optionally filtered by course and/or assignment."""
+    # Build query filter
+    query = {}
+    if course_id:
+        query['course_id'] = course_id
+    if assignment_id:
+        query['assignment_id'] = assignment_id
+    
+    # Fetch from MongoDB if available
+    if grades_collection is not None:
+        grades = list(grades_collection.find(
+            query,
+            {'_id': 0}  # Exclude MongoDB's _id field
+        ).sort('timestamp', -1))  # Most recent first
+        print(f"📊 Fetched {len(grades)} grades from MongoDB")
+        return grades
+    else:
+        # Fallback to in-memory storage
+        print("⚠️ Using in-memory storage (MongoDB not connected)")
+        if course_id or assignment_id:
+            # Apply filters manually for in-memory
+            filtered = [
+                g for g in graded_assignments_history
+                if (not course_id or g.get('course_id') == course_id) and
+                   (not assignment_id or g.get('assignment_id') == assignment_id)
+            ]
+            return filtered
+        return graded_assignments_history
+
+
 # CHANGED: Converted Flask route to FastAPI GET endpoint
 @app.get('/api/graded_history')
 async def get_graded_history(course_id: str = None, assignment_id: str = None):
@@ -1097,33 +3292,7 @@ async def get_graded_history(course_id: str = None, assignment_id: str = None):
     Can filter by course_id and/or assignment_id.
     """
     try:
-        # Build query filter
-        query = {}
-        if course_id:
-            query['course_id'] = course_id
-        if assignment_id:
-            query['assignment_id'] = assignment_id
-        
-        # Fetch from MongoDB if available
-        if grades_collection is not None:
-            grades = list(grades_collection.find(
-                query,
-                {'_id': 0}  # Exclude MongoDB's _id field
-            ).sort('timestamp', -1))  # Most recent first
-            print(f"📊 Fetched {len(grades)} grades from MongoDB")
-            return grades
-        else:
-            # Fallback to in-memory storage
-            print("⚠️ Using in-memory storage (MongoDB not connected)")
-            if course_id or assignment_id:
-                # Apply filters manually for in-memory
-                filtered = [
-                    g for g in graded_assignments_history
-                    if (not course_id or g.get('course_id') == course_id) and
-                       (not assignment_id or g.get('assignment_id') == assignment_id)
-                ]
-                return filtered
-            return graded_assignments_history
+        return load_graded_history(course_id, assignment_id)
     except Exception as e:
         print(f"❌ Error fetching graded history: {e}")
         return JSONResponse(
@@ -1132,6 +3301,51 @@ async def get_graded_history(course_id: str = None, assignment_id: str = None):
         )
 
 
+@app.post('/api/grading-cache/invalidate')
+async def invalidate_grading_cache(request: Request):
+    """
+    Drops cached Gemini grading results so the next grade call pays for a fresh response.
+    Requires course_id, optionally narrowed by assignment_id or submission_id (most specific
+    wins). Only a signed-in teacher who can access the course may invalidate its results.
+    """
+    data = await request.json()
+
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
+    if not classroom_service:
+        return JSONResponse(
+            content={"error": "User not authenticated. Please re-login."},
+            status_code=401
+        )
+
+    course_id = data.get('course_id')
+    if not course_id:
+        return JSONResponse(
+            content={"error": "Provide course_id (optionally with assignment_id or submission_id) to invalidate."},
+            status_code=400
+        )
+
+    try:
+        await run_google_request(classroom_service.courses().get(id=course_id), 'classroom')
+    except HttpError as error:
+        print(f"Refusing grading cache invalidation for course {course_id}: {error.resp.status}")
+        return JSONResponse(
+            content={"error": f"You do not have access to course {course_id}."},
+            status_code=403
+        )
+
+    tags = {"course_id": course_id}
+    field = 'course_id'
+    for narrower_field in ('submission_id', 'assignment_id'):
+        if data.get(narrower_field):
+            field = narrower_field
+            tags[field] = data[field]
+            break
+
+    removed = await run_blocking(grading_response_cache.delete_matching, tags)
+    print(f"🧹 Invalidated {removed} cached grading result(s) for {field}={tags[field]}")
+    return {"invalidated": removed, "field": field, "status": "success"}
+
+
 # --- 7. GRADING HUB ENDPOINTS (New Feature) ---
 
 @app.post('/api/grade-with-model')
@@ -1167,8 +3381,8 @@ async def grade_with_model(request: Request):
             status_code=400
         )
 
-    drive_service = get_google_service('drive', 'v3', request)
-    classroom_service = get_google_service('classroom', 'v1', request)
+    drive_service = await run_blocking(get_google_service, 'drive', 'v3', request)
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
 
     if not drive_service or not classroom_service:
         return JSONResponse(
@@ -1186,8 +3400,8 @@ async def grade_with_model(request: Request):
             )
 
         # Get student submission file ID
-        submission_details = classroom_service.courses().courseWork().studentSubmissions().get(
-            courseId=course_id, courseWorkId=assignment_id, id=submission_id).execute()
+        submission_details = await run_google_request(classroom_service.courses().courseWork().studentSubmissions().get(
+            courseId=course_id, courseWorkId=assignment_id, id=submission_id), 'classroom')
         
         attachments = submission_details.get('assignmentSubmission', {}).get('attachments', [])
         if not attachments:
@@ -1200,8 +3414,8 @@ async def grade_with_model(request: Request):
 
         # Download both files with OCR support
         print("Downloading answer key and student submission...")
-        answer_key_text = download_drive_file_content(drive_service, answer_key_file_id, "Answer Key")
-        student_submission_text = download_drive_file_content(drive_service, student_submission_file_id, "Student Submission")
+        answer_key_text = await run_throttled(download_drive_file_content, drive_service, answer_key_file_id, "Answer Key")
+        student_submission_text = await run_throttled(download_drive_file_content, drive_service, student_submission_file_id, "Student Submission")
 
         if not answer_key_text or not student_submission_text:
             return JSONResponse(
@@ -1238,13 +3452,50 @@ async def grade_with_model(request: Request):
         )
 
 
-@app.post('/api/generate-initial-key')
-async def generate_initial_key(request: Request):
+def build_initial_key_prompt(questionnaire_text):
+    """Prompt asking Gemini to draft an answer key for the assignment's questions."""
+    return f"""You are an expert teacher. Generate a high-quality, detailed answer key for the following questions.
+
+--- QUESTIONS ---
+{questionnaire_text}
+
+--- INSTRUCTIONS ---
+1. Provide clear, comprehensive answers to each question
+2. Include key concepts and terminology that should be present in student responses
+3. Structure your answers in a way that makes it easy to grade against
+4. Be thorough but concise
+5. Format the answer key in a structured way (e.g., "Question 1: [answer]", "Question 2: [answer]", etc.)
+
+Please provide the answer key in a clear, organized format."""
+
+
+def build_refine_key_prompt(current_key, feedback):
+    """Prompt asking Gemini to revise an answer key according to teacher feedback."""
+    return f"""You are an AI assistant helping a teacher refine an answer key for their assignment.
+
+--- CURRENT ANSWER KEY ---
+{current_key}
+
+--- TEACHER'S FEEDBACK FOR IMPROVEMENT ---
+{feedback}
+
+--- INSTRUCTIONS ---
+1. Carefully read the teacher's feedback and understand their concerns or suggestions
+2. Generate an improved version of the answer key that addresses all feedback points
+3. Maintain the overall structure and format of the original answer key
+4. Make the refinements clear and well-integrated
+5. Ensure the refined answer key is comprehensive and ready for grading
+
+Please provide the complete refined answer key below:"""
+
+
+async def load_initial_key_prompt(request, data):
     """
-    Path 2 - Step 1: Generate initial answer key using Gemini
-    Extracts questionnaire from assignment materials automatically
+    Validates an answer key generation request and downloads the assignment's questionnaire.
+
+    Returns:
+        str: the Gemini prompt, or a JSONResponse describing the error
     """
-    data = await request.json()
     course_id = data.get('course_id')
     assignment_id = data.get('assignment_id')
 
@@ -1254,8 +3505,8 @@ async def generate_initial_key(request: Request):
             status_code=400
         )
 
-    classroom_service = get_google_service('classroom', 'v1', request)
-    drive_service = get_google_service('drive', 'v3', request)
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
+    drive_service = await run_blocking(get_google_service, 'drive', 'v3', request)
 
     if not classroom_service or not drive_service:
         return JSONResponse(
@@ -1266,8 +3517,8 @@ async def generate_initial_key(request: Request):
     try:
         # Get assignment details to find questionnaire (same as in /api/grade)
         print(f"Fetching assignment details for course {course_id}, assignment {assignment_id}...")
-        assignment_details = classroom_service.courses().courseWork().get(
-            courseId=course_id, id=assignment_id).execute()
+        assignment_details = await run_google_request(classroom_service.courses().courseWork().get(
+            courseId=course_id, id=assignment_id), 'classroom')
         
         materials = assignment_details.get('materials', [])
         questionnaire_file_id = None
@@ -1286,7 +3537,7 @@ async def generate_initial_key(request: Request):
 
         # Download questionnaire with OCR support
         print("Downloading questionnaire with OCR support...")
-        questionnaire_text = download_drive_file_content(drive_service, questionnaire_file_id, "Questionnaire")
+        questionnaire_text = await run_throttled(download_drive_file_content, drive_service, questionnaire_file_id, "Questionnaire")
 
         if not questionnaire_text:
             return JSONResponse(
@@ -1295,33 +3546,7 @@ async def generate_initial_key(request: Request):
             )
 
         print(f"Questionnaire extracted successfully. Text length: {len(questionnaire_text)} characters")
-
-        # Generate answer key using Gemini
-        print("Generating initial answer key with Gemini AI...")
-        model = genai.GenerativeModel(model_name="gemini-2.5-flash")
-        
-        prompt = f"""You are an expert teacher. Generate a high-quality, detailed answer key for the following questions.
-
---- QUESTIONS ---
-{questionnaire_text}
-
---- INSTRUCTIONS ---
-1. Provide clear, comprehensive answers to each question
-2. Include key concepts and terminology that should be present in student responses
-3. Structure your answers in a way that makes it easy to grade against
-4. Be thorough but concise
-5. Format the answer key in a structured way (e.g., "Question 1: [answer]", "Question 2: [answer]", etc.)
-
-Please provide the answer key in a clear, organized format."""
-
-        response = await model.generate_content_async(prompt)
-        answer_key = response.text
-
-        print("Answer key generated successfully!")
-        return {
-            "answer_key": answer_key,
-            "status": "success"
-        }
+        return build_initial_key_prompt(questionnaire_text)
 
     except HttpError as error:
         error_details = error.content.decode('utf-8')
@@ -1338,12 +3563,13 @@ Please provide the answer key in a clear, organized format."""
         )
 
 
-@app.post('/api/refine-key')
-async def refine_key(request: Request):
+def load_refine_key_prompt(data):
     """
-    Path 2 - Step 2: Refine the answer key based on teacher feedback
+    Validates an answer key refinement request.
+
+    Returns:
+        str: the Gemini prompt, or a JSONResponse describing the error
     """
-    data = await request.json()
     course_id = data.get('course_id')
     assignment_id = data.get('assignment_id')
     current_key = data.get('current_key')
@@ -1354,344 +3580,122 @@ async def refine_key(request: Request):
             content={"error": "Missing required data: course_id, assignment_id, current_key, or feedback."},
             status_code=400
         )
-
-    try:
-        print("Refining answer key with Gemini based on teacher feedback...")
-        model = genai.GenerativeModel(model_name="gemini-2.5-flash")
-        
-        prompt = f"""You are an AI assistant helping a teacher refine an answer key for their assignment.
-
---- CURRENT ANSWER KEY ---
-{current_key}
-
---- TEACHER'S FEEDBACK FOR IMPROVEMENT ---
-{feedback}
-
---- INSTRUCTIONS ---
-1. Carefully read the teacher's feedback and understand their concerns or suggestions
-2. Generate an improved version of the answer key that addresses all feedback points
-3. Maintain the overall structure and format of the original answer key
-4. Make the refinements clear and well-integrated
-5. Ensure the refined answer key is comprehensive and ready for grading
-
-Please provide the complete refined answer key below:"""
-
-        response = await model.generate_content_async(prompt)
-        refined_key = response.text
-
-        print("Answer key refined successfully!")
-        return {
-            "refined_key": refined_key,
-            "status": "success"
-        }
-
-    except Exception as e:
-        print(f"Unexpected error in refine_key: {e}")
-        return JSONResponse(
-            content={"error": f"An unexpected error occurred: {str(e)}"},
-            status_code=500
-        )
+    return build_refine_key_prompt(current_key, feedback)
 
 
-@app.post('/api/grade-with-gemini')
-async def grade_with_gemini(request: Request):
+def stream_answer_key(prompt, result_field, log_label):
     """
-    Path 2 - Step 3: Grade ALL student submissions using Gemini with the approved answer key
+    SSE response streaming an answer key from Gemini as `token` events, closed by a
+    `done` event carrying the complete text under result_field.
     """
-    global graded_assignments_history
-
-    data = await request.json()
-    course_id = data.get('course_id')
-    assignment_id = data.get('assignment_id')
-    approved_key = data.get('approved_key')
-
-    if not all([course_id, assignment_id, approved_key]):
-        return JSONResponse(
-            content={"error": "Missing required data: course_id, assignment_id, or approved_key."},
-            status_code=400
-        )
-
-    classroom_service = get_google_service('classroom', 'v1', request)
-    drive_service = get_google_service('drive', 'v3', request)
+    async def event_stream():
+        try:
+            model = genai.GenerativeModel(model_name="gemini-2.5-flash")
+            chunks = []
+            async for text in stream_gemini_content(model, prompt):
+                chunks.append(text)
+                yield sse_event("token", {"text": text})
+            print(f"Answer key {log_label} successfully (streamed)!")
+            yield sse_event("done", {result_field: "".join(chunks), "status": "success"})
+        except Exception as e:
+            print(f"Unexpected error while streaming answer key: {e}")
+            yield sse_event("error", {"error": f"An unexpected error occurred: {str(e)}", "status_code": 500})
+
+    return sse_response(event_stream())
 
-    if not classroom_service or not drive_service:
-        return JSONResponse(
-            content={"error": "User not authenticated. Please re-login."},
-            status_code=401
-        )
-
-    try:
-        # Get assignment details for questionnaire and metadata
-        print(f"Fetching assignment details for course {course_id}, assignment {assignment_id}...")
-        assignment_details = classroom_service.courses().courseWork().get(
-            courseId=course_id, id=assignment_id).execute()
-        
-        assignment_title = assignment_details.get('title', 'Unknown Assignment')
-        
-        # Get course details for course name
-        course_details = classroom_service.courses().get(id=course_id).execute()
-        course_name = course_details.get('name', 'Unknown Course')
-        
-        # Find questionnaire in assignment materials
-        materials = assignment_details.get('materials', [])
-        questionnaire_file_id = None
-        
-        for material in materials:
-            if 'driveFile' in material and 'driveFile' in material['driveFile']:
-                questionnaire_file_id = material['driveFile']['driveFile']['id']
-                print(f"Found questionnaire file ID: {questionnaire_file_id}")
-                break
-        
-        if not questionnaire_file_id:
-            return JSONResponse(
-                content={"error": "No questionnaire document found attached to this assignment."},
-                status_code=404
-            )
-
-        # Download questionnaire once (will be used for all students)
-        print("Downloading questionnaire...")
-        questionnaire_text = download_drive_file_content(drive_service, questionnaire_file_id, "Questionnaire")
-
-        if not questionnaire_text:
-            return JSONResponse(
-                content={"error": "Failed to download questionnaire document."},
-                status_code=500
-            )
-
-        # Get ALL student submissions
-        print("Fetching all student submissions...")
-        submissions_response = classroom_service.courses().courseWork().studentSubmissions().list(
-            courseId=course_id,
-            courseWorkId=assignment_id,
-            states=['TURNED_IN']
-        ).execute()
-        
-        submissions = submissions_response.get('studentSubmissions', [])
-        
-        if not submissions:
-            return JSONResponse(
-                content={"error": "No student submissions found for this assignment."},
-                status_code=404
-            )
-
-        print(f"Found {len(submissions)} submissions to grade.")
-        
-        # Grade each submission
-        graded_submissions = []
-        graded_count = 0
-        
-        for submission in submissions:
-            try:
-                submission_id = submission['id']
-                user_id = submission['userId']
-                
-                # Get student name
-                student_name = f"Unknown Student ({user_id})"
-                try:
-                    student_profile = classroom_service.userProfiles().get(userId=user_id).execute()
-                    student_name = student_profile.get('name', {}).get('fullName', student_name)
-                except Exception as e:
-                    print(f"Could not fetch name for user {user_id}: {e}")
-                
-                # Check if submission has attachments
-                attachments = submission.get('assignmentSubmission', {}).get('attachments', [])
-                if not attachments:
-                    print(f"Skipping submission {submission_id} - no attachments")
-                    graded_submissions.append({
-                        "submission_id": submission_id,
-                        "student_name": student_name,
-                        "status": "skipped",
-                        "error": "No file attached"
-                    })
-                    continue
-                
-                student_submission_file_id = attachments[0]['driveFile']['id']
-                
-                # Download student submission
-                print(f"Downloading submission for {student_name}...")
-                student_submission_text = download_drive_file_content(
-                    drive_service, 
-                    student_submission_file_id, 
-                    f"Submission - {student_name}"
-                )
-
-                if not student_submission_text:
-                    print(f"Failed to download submission for {student_name}")
-                    graded_submissions.append({
-                        "submission_id": submission_id,
-                        "student_name": student_name,
-                        "status": "error",
-                        "error": "Failed to download submission"
-                    })
-                    continue
-
-                # Grade using ONLY Gemini (NO MiniLM/hybrid for this route)
-                print(f"Grading submission for {student_name} with Gemini only...")
-                model = genai.GenerativeModel(model_name="gemini-2.5-flash")
-                
-                prompt = f"""
-        You are an expert AI teaching assistant for a Google Classroom assignment titled "{assignment_title}". Your task is to rigorously grade the student's submission, providing a score out of 100, and comprehensive feedback.
-
-        --- QUESTIONNAIRE (The questions/tasks presented to the student) ---
-        {questionnaire_text}
 
-        --- OFFICIAL ANSWER KEY (The expected correct responses/solutions) ---
-        {approved_key}
+@app.post('/api/generate-initial-key')
+async def generate_initial_key(request: Request):
+    """
+    Path 2 - Step 1: Generate initial answer key using Gemini
+    Extracts questionnaire from assignment materials automatically
+    """
+    data = await request.json()
+    prompt = await load_initial_key_prompt(request, data)
+    if isinstance(prompt, JSONResponse):
+        return prompt
 
-        --- STUDENT'S SUBMISSION (The student's actual answers/work) ---
-        {student_submission_text}
+    try:
+        # Generate answer key using Gemini
+        print("Generating initial answer key with Gemini AI...")
+        model = genai.GenerativeModel(model_name="gemini-2.5-flash")
+        response = await generate_gemini_content(model, prompt)
+        answer_key = response.text
 
-        --- GRADING INSTRUCTIONS ---
-        1.  **Understanding the Task:** Carefully read the QUESTIONNAIRE to grasp the specific requirements and learning objectives.
+        print("Answer key generated successfully!")
+        return {
+            "answer_key": answer_key,
+            "status": "success"
+        }
 
-        2.  **Content Accuracy & Completeness:** Compare the STUDENT'S SUBMISSION against the OFFICIAL ANSWER KEY.
-            * How accurately does the student address each question/task?
-            * Is the information presented correct?
-            * Are all parts of the question/task attempted and completed?
-            * **Award points for partially correct or reasonable attempts. Avoid giving a 0 unless the submission is entirely blank, off-topic, or completely nonsensical.** Even minimal effort to address the prompt should receive some credit.
+    except Exception as e:
+        print(f"Unexpected error in generate_initial_key: {e}")
+        return JSONResponse(
+            content={"error": f"An unexpected error occurred: {str(e)}"},
+            status_code=500
+        )
 
-        3.  **Structure & Clarity:** Evaluate the organization, clarity, and readability of the student's response.
 
-        4.  **Meaning & Comprehension:** Assess the student's understanding of the concepts. Does their submission demonstrate comprehension, or is it just rote memorization/copying?
+@app.post('/api/generate-initial-key/stream')
+async def generate_initial_key_stream(request: Request):
+    """
+    Streaming variant of /api/generate-initial-key: the answer key is sent as `token`
+    events while Gemini writes it, then a closing `done` event with the full answer_key.
+    """
+    data = await request.json()
+    prompt = await load_initial_key_prompt(request, data)
+    if isinstance(prompt, JSONResponse):
+        return prompt
 
-        5.  **Assign a Numerical Grade (0-100):** Based on the above criteria, assign a numerical grade, using the following guidelines to achieve scores between 70-80 for conceptually correct but less precise answers:
-            * **90-100 (Excellent):** Answers are accurate, complete, well-structured, and demonstrate deep comprehension. Critically, they are also *precise* and leverage key terminology from the answer key where appropriate.
-            * **75-89 (Good/Strong):** Answers are *conceptually correct* and show good understanding, but might lack the highest level of precision or miss some specific key terminology from the answer key. They are clear, mostly complete, but could be more refined.
-            * **50-74 (Fair/Developing):** Answers are partially correct, contain some inaccuracies, or are vague. They may demonstrate some understanding but require significant improvement in content, clarity, or completeness.
-            * **< 50 (Limited/Poor):** Answers are largely incorrect, off-topic, or show minimal understanding. This category should only be used if attempts are very weak or absent.
+    print("Streaming initial answer key from Gemini AI...")
+    return stream_answer_key(prompt, "answer_key", "generated")
 
-        6.  **Provide Comprehensive Feedback:**
-            * Start with positive aspects or areas where the student demonstrated understanding.
-            * Clearly explain where points were lost, referencing specific parts of the questionnaire or answer key.
-            * For "Good/Strong" answers, specifically suggest how they could make their explanation more precise or complete by integrating relevant key terms or more detailed examples.
-            * Suggest concrete steps for improvement.
 
-        7.  **Justify the Grade (Briefly):** Include a short sentence explaining the overall reasoning for the assigned score, linking it to the guidelines above (e.g., "Conceptually solid but lacked some precision and specific terminology for full marks.")
+@app.post('/api/refine-key')
+async def refine_key(request: Request):
+    """
+    Path 2 - Step 2: Refine the answer key based on teacher feedback
+    """
+    data = await request.json()
+    prompt = load_refine_key_prompt(data)
+    if isinstance(prompt, JSONResponse):
+        return prompt
 
-        8.  **Format your response STRICTLY as follows, with no extra text before or after, ensuring clear separation for parsing:
-        GRADE: [SCORE]/100
-        GRADE_JUSTIFICATION: [A brief, one-sentence reason for the score]
-        FEEDBACK: [Your detailed feedback paragraph here, covering all points from instruction 6]
-        """
-                
-                response = await model.generate_content_async(prompt)
-                grade_text_output = response.text
-                
-                # Parse the response
-                grade_match = re.search(r'GRADE:\s*(\d+)/100', grade_text_output, re.IGNORECASE)
-                justification_match = re.search(r'GRADE_JUSTIFICATION:\s*(.*)', grade_text_output, re.IGNORECASE)
-                feedback_match = re.search(r'FEEDBACK:\s*(.*)', grade_text_output, re.IGNORECASE | re.DOTALL)
-
-                if not grade_match or not feedback_match or not justification_match:
-                    print(f"Failed to parse Gemini response for {student_name}")
-                    graded_submissions.append({
-                        "submission_id": submission_id,
-                        "student_name": student_name,
-                        "status": "error",
-                        "error": "Failed to parse AI response"
-                    })
-                    continue
-                    
-                final_grade = int(grade_match.group(1))
-                grade_justification = justification_match.group(1).strip()
-                feedback_str = feedback_match.group(1).strip()
-                
-                # Store graded item
-                graded_item = {
-                    "course_id": course_id,
-                    "course_name": course_name,
-                    "assignment_id": assignment_id,
-                    "assignment_title": assignment_title,
-                    "submission_id": submission_id,
-                    "student_name": student_name,
-                    "assignedGrade": final_grade,
-                    "confidence": "high",
-                    "grading_method": "gemini_only",
-                    "feedback": feedback_str,
-                    "grade_justification": grade_justification,
-                    "remarks": "Graded using Gemini AI only (no hybrid model)",
-                    "timestamp": datetime.datetime.now().isoformat()
-                }
-                
-                # Save to MongoDB (with fallback to in-memory)
-                if grades_collection is not None:
-                    try:
-                        result = grades_collection.insert_one(graded_item.copy())
-                        print(f"✅ Grade saved to MongoDB for {student_name}")
-                        
-                        # Update student's record
-                        students_collection.update_one(
-                            {"student_name": student_name, "course_id": course_id},
-                            {
-                                "$set": {
-                                    "student_name": student_name,
-                                    "course_id": course_id,
-                                    "course_name": course_name,
-                                    "last_updated": datetime.datetime.now().isoformat()
-                                },
-                                "$inc": {"total_assignments": 1},
-                                "$push": {
-                                    "grades_history": {
-                                        "assignment_id": assignment_id,
-                                        "assignment_title": assignment_title,
-                                        "grade": final_grade,
-                                        "timestamp": graded_item["timestamp"]
-                                    }
-                                }
-                            },
-                            upsert=True
-                        )
-                    except Exception as mongo_error:
-                        print(f"⚠️ MongoDB save error for {student_name}: {mongo_error}")
-                        graded_assignments_history.append(graded_item)
-                else:
-                    graded_assignments_history.append(graded_item)
-                
-                graded_submissions.append({
-                    "submission_id": submission_id,
-                    "student_name": student_name,
-                    "assignedGrade": final_grade,
-                    "feedback": feedback_str,
-                    "grade_justification": grade_justification,
-                    "status": "success"
-                })
-                
-                graded_count += 1
-                print(f"Successfully graded {student_name}: {final_grade}/100")
-                
-            except Exception as e:
-                print(f"Error grading submission {submission.get('id', 'unknown')}: {e}")
-                graded_submissions.append({
-                    "submission_id": submission.get('id', 'unknown'),
-                    "student_name": student_name if 'student_name' in locals() else "Unknown",
-                    "status": "error",
-                    "error": str(e)
-                })
+    try:
+        print("Refining answer key with Gemini based on teacher feedback...")
+        model = genai.GenerativeModel(model_name="gemini-2.5-flash")
+        response = await generate_gemini_content(model, prompt)
+        refined_key = response.text
 
-        print(f"Grading complete! Successfully graded {graded_count} out of {len(submissions)} submissions.")
-        
+        print("Answer key refined successfully!")
         return {
-            "graded_count": graded_count,
-            "total_submissions": len(submissions),
-            "submissions": graded_submissions,
-            "status": "complete"
+            "refined_key": refined_key,
+            "status": "success"
         }
 
-    except HttpError as error:
-        error_details = error.content.decode('utf-8')
-        print(f"Google API Error: {error.resp.status} - {error_details}")
-        return JSONResponse(
-            content={"error": f"Google API Error: {error_details}"},
-            status_code=error.resp.status
-        )
     except Exception as e:
-        print(f"Unexpected error in grade_with_gemini: {e}")
+        print(f"Unexpected error in refine_key: {e}")
         return JSONResponse(
             content={"error": f"An unexpected error occurred: {str(e)}"},
             status_code=500
         )
 
 
+@app.post('/api/refine-key/stream')
+async def refine_key_stream(request: Request):
+    """
+    Streaming variant of /api/refine-key: the refined key is sent as `token` events,
+    then a closing `done` event with the full refined_key.
+    """
+    data = await request.json()
+    prompt = load_refine_key_prompt(data)
+    if isinstance(prompt, JSONResponse):
+        return prompt
+
+    print("Streaming refined answer key from Gemini based on teacher feedback...")
+    return stream_answer_key(prompt, "refined_key", "refined")
+
+
 @app.post('/api/export-grades-to-sheet')
 async def export_grades_to_sheet(request: Request):
     """
@@ -1722,8 +3726,8 @@ async def export_grades_to_sheet(request: Request):
             status_code=400
         )
 
-    sheets_service = get_google_service('sheets', 'v4', request)
-    drive_service = get_google_service('drive', 'v3', request)
+    sheets_service = await run_blocking(get_google_service, 'sheets', 'v4', request)
+    drive_service = await run_blocking(get_google_service, 'drive', 'v3', request)
 
     if not sheets_service or not drive_service:
         return JSONResponse(
@@ -1750,10 +3754,10 @@ async def export_grades_to_sheet(request: Request):
             }]
         }
         
-        spreadsheet = sheets_service.spreadsheets().create(
+        spreadsheet = await run_google_request(sheets_service.spreadsheets().create(
             body=spreadsheet_body,
             fields='spreadsheetId,spreadsheetUrl,sheets'
-        ).execute()
+        ), 'sheets')
         
         spreadsheet_id = spreadsheet.get('spreadsheetId')
         spreadsheet_url = spreadsheet.get('spreadsheetUrl')
@@ -1791,12 +3795,12 @@ async def export_grades_to_sheet(request: Request):
             'values': values
         }
         
-        sheets_service.spreadsheets().values().update(
+        await run_google_request(sheets_service.spreadsheets().values().update(
             spreadsheetId=spreadsheet_id,
             range=range_name,
             valueInputOption=value_input_option,
             body=body
-        ).execute()
+        ), 'sheets')
         
         # Format the sheet (bold headers, borders, auto-resize columns)
         print("Applying formatting to sheet...")
@@ -1875,10 +3879,10 @@ async def export_grades_to_sheet(request: Request):
             }
         ]
         
-        sheets_service.spreadsheets().batchUpdate(
+        await run_google_request(sheets_service.spreadsheets().batchUpdate(
             spreadsheetId=spreadsheet_id,
             body={'requests': requests}
-        ).execute()
+        ), 'sheets')
         
         print(f"Sheet formatted successfully! URL: {spreadsheet_url}")
         
@@ -1905,6 +3909,614 @@ async def export_grades_to_sheet(request: Request):
         )
 
 
+# --- 8. BACKGROUND GRADING JOBS ---
+# Whole-class grading runs as a background job: the POST returns a job ID right away,
+# a bounded pool of workers grades submissions concurrently, and the status endpoint
+# reports per-student progress and partial results while the job is still running.
+# Clients can also subscribe to /api/grading-jobs/{job_id}/events (Server-Sent Events)
+# to receive one event per student as soon as it is graded, skipped or fails.
+
+GRADING_JOB_CONCURRENCY = int(os.getenv("GRADING_JOB_CONCURRENCY", "4"))
+# Upper bound on the concurrency a client may request for one job
+GRADING_JOB_MAX_CONCURRENCY = max(1, int(os.getenv("GRADING_JOB_MAX_CONCURRENCY", "8")))
+# Finished jobs are dropped from the registry this long after they end
+GRADING_JOB_TTL_MINUTES = int(os.getenv("GRADING_JOB_TTL_MINUTES", "60"))
+
+# In-memory job registry: job_id -> job state dict
+grading_jobs = {}
+# job_id -> credential identity of the teacher who started it (kept out of the job state,
+# which is sent to clients); only that teacher can read the job's progress
+grading_job_owners = {}
+# Strong references to running job tasks so they are not garbage collected mid-run
+grading_job_tasks = set()
+# Live progress subscribers: job_id -> set of asyncio.Queue (one per open event stream)
+grading_job_subscribers = {}
+GRADING_JOB_EVENT_KEEPALIVE_SECONDS = 15
+FINISHED_JOB_STATUSES = ("complete", "failed")
+FINISHED_ENTRY_STATUSES = ("success", "skipped", "error")
+
+
+def prune_finished_grading_jobs():
+    """Drops jobs that finished more than GRADING_JOB_TTL_MINUTES ago from the registry."""
+    cutoff = datetime.datetime.now() - datetime.timedelta(minutes=GRADING_JOB_TTL_MINUTES)
+    expired_job_ids = [
+        job_id for job_id, job in grading_jobs.items()
+        if job["status"] in FINISHED_JOB_STATUSES and datetime.datetime.fromisoformat(job["updated_at"]) < cutoff
+    ]
+    for job_id in expired_job_ids:
+        grading_jobs.pop(job_id, None)
+        grading_job_owners.pop(job_id, None)
+
+
+def get_owned_grading_job(job_id, request):
+    """
+    Returns the job if it was started with the session's credentials, otherwise an error
+    response. Other teachers' jobs are reported as not found, so job IDs cannot be probed.
+    """
+    prune_finished_grading_jobs()
+    creds_data = request.session.get('credentials')
+    if not creds_data:
+        return JSONResponse(
+            content={"error": "User not authenticated. Please re-login."},
+            status_code=401
+        )
+    job = grading_jobs.get(job_id)
+    if job is None or grading_job_owners.get(job_id) != credential_identity(creds_data):
+        return JSONResponse(
+            content={"error": f"Grading job {job_id} not found."},
+            status_code=404
+        )
+    return job
+
+
+def save_graded_item(graded_item):
+    """
+    Saves a graded item to MongoDB and updates the student's record,
+    falling back to in-memory storage if MongoDB is unavailable.
+    """
+    student_name = graded_item["student_name"]
+
+    if grades_collection is not None:
+        try:
+            grades_collection.insert_one(graded_item.copy())
+            print(f"✅ Grade saved to MongoDB for {student_name}")
+
+            # Update student's record
+            students_collection.update_one(
+                {"student_name": student_name, "course_id": graded_item["course_id"]},
+                {
+                    "$set": {
+                        "student_name": student_name,
+                        "course_id": graded_item["course_id"],
+                        "course_name": graded_item["course_name"],
+                        "last_updated": datetime.datetime.now().isoformat()
+                    },
+                    "$inc": {"total_assignments": 1},
+                    "$push": {
+                        "grades_history": {
+                            "assignment_id": graded_item["assignment_id"],
+                            "assignment_title": graded_item["assignment_title"],
+                            "grade": graded_item["assignedGrade"],
+                            "timestamp": graded_item["timestamp"]
+                        }
+                    }
+                },
+                upsert=True
+            )
+        except Exception as mongo_error:
+            print(f"⚠️ MongoDB save error for {student_name}: {mongo_error}")
+            graded_assignments_history.append(graded_item)
+    else:
+        graded_assignments_history.append(graded_item)
+
+
+def load_grading_job_context(classroom_service, drive_service, course_id, assignment_id):
+    """
+    Blocking setup step of a grading job: fetches assignment/course metadata and
+    downloads the questionnaire once.
+
+    Returns:
+        dict: assignment_title, course_name and questionnaire_text
+
+    Raises:
+        ValueError: If the questionnaire is missing or cannot be downloaded
+    """
+    print(f"Fetching assignment details for course {course_id}, assignment {assignment_id}...")
+    assignment_details = execute_google_request(classroom_service.courses().courseWork().get(
+        courseId=course_id, id=assignment_id), 'classroom')
+    course_details = execute_google_request(classroom_service.courses().get(id=course_id), 'classroom')
+
+    questionnaire_file_id = None
+    for material in assignment_details.get('materials', []):
+        if 'driveFile' in material and 'driveFile' in material['driveFile']:
+            questionnaire_file_id = material['driveFile']['driveFile']['id']
+            print(f"Found questionnaire file ID: {questionnaire_file_id}")
+            break
+
+    if not questionnaire_file_id:
+        raise ValueError("No questionnaire document found attached to this assignment.")
+
+    # Download questionnaire once (will be used for all students)
+    print("Downloading questionnaire...")
+    questionnaire_text = download_drive_file_content(drive_service, questionnaire_file_id, "Questionnaire")
+    if not questionnaire_text:
+        raise ValueError("Failed to download questionnaire document.")
+
+    return {
+        "assignment_title": assignment_details.get('title', 'Unknown Assignment'),
+        "course_name": course_details.get('name', 'Unknown Course'),
+        "questionnaire_text": questionnaire_text
+    }
+
+
+def load_submission_for_grading(drive_service, submission, student_name):
+    """
+    Blocking per-student step of a grading job: downloads the attached submission file.
+    Runs on the Google I/O thread pool, where each worker thread uses its own HTTP transport.
+
+    Returns:
+        tuple: (submission_text or None, skip_reason or None)
+    """
+    attachments = submission.get('assignmentSubmission', {}).get('attachments', [])
+    if not attachments:
+        return None, "No file attached"
+
+    student_submission_file_id = attachments[0]['driveFile']['id']
+    print(f"Downloading submission for {student_name}...")
+    student_submission_text = download_drive_file_content(
+        drive_service,
+        student_submission_file_id,
+        f"Submission - {student_name}"
+    )
+    return student_submission_text, None
+
+
+def update_grading_job_counts(job):
+    """Recomputes the running counters of a job from its per-student entries."""
+    statuses = [entry["status"] for entry in job["submissions"]]
+    job["graded_count"] = statuses.count("success")
+    job["skipped_count"] = statuses.count("skipped")
+    job["error_count"] = statuses.count("error")
+    job["completed_count"] = job["graded_count"] + job["skipped_count"] + job["error_count"]
+    job["updated_at"] = datetime.datetime.now().isoformat()
+
+
+def grading_job_counts(job):
+    """Running counters and status of a job, sent with every progress event."""
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "total_submissions": job["total_submissions"],
+        "completed_count": job["completed_count"],
+        "graded_count": job["graded_count"],
+        "skipped_count": job["skipped_count"],
+        "error_count": job["error_count"]
+    }
+
+
+def publish_grading_job_event(job, event, data):
+    """Pushes an event to every open progress stream of a job."""
+    for queue in grading_job_subscribers.get(job["job_id"], ()):
+        queue.put_nowait((event, data))
+
+
+def finish_grading_job_entry(job, entry):
+    """Updates a job's counters and, once the entry is final, publishes a per-student event."""
+    update_grading_job_counts(job)
+    if entry["status"] in FINISHED_ENTRY_STATUSES:
+        publish_grading_job_event(job, "student", {"submission": entry, "counts": grading_job_counts(job)})
+
+
+def end_grading_job(job, status, error=None):
+    """Marks a job complete/failed and sends the closing event to its progress streams."""
+    job["status"] = status
+    job["updated_at"] = datetime.datetime.now().isoformat()
+    if error is not None:
+        job["error"] = error
+    publish_grading_job_event(job, status, {"counts": grading_job_counts(job), "error": job["error"]})
+
+
+async def prepare_job_submission(job, entry, submission, services):
+    """
+    Downloads the submission for a job entry.
+
+    Returns:
+        str or None: The submission text, or None if the entry was skipped or failed
+    """
+    entry["status"] = "grading"
+    job["updated_at"] = datetime.datetime.now().isoformat()
+
+    student_submission_text, skip_reason = await run_throttled(
+        load_submission_for_grading, services["drive"], submission, entry["student_name"]
+    )
+
+    if skip_reason:
+        print(f"Skipping submission {entry['submission_id']} - {skip_reason.lower()}")
+        entry.update({"status": "skipped", "error": skip_reason})
+        return None
+
+    if not student_submission_text:
+        print(f"Failed to download submission for {entry['student_name']}")
+        entry.update({"status": "error", "error": "Failed to download submission"})
+        return None
+
+    return student_submission_text
+
+
+async def record_job_grade(job, entry, context, parsed_grade, from_cache):
+    """Saves a successful grade for a job entry and updates its progress record."""
+    final_grade, grade_justification, feedback_str = parsed_grade
+    student_name = entry["student_name"]
+
+    graded_item = {
+        "course_id": job["course_id"],
+        "course_name": context["course_name"],
+        "assignment_id": job["assignment_id"],
+        "assignment_title": context["assignment_title"],
+        "submission_id": entry["submission_id"],
+        "student_name": student_name,
+        "assignedGrade": final_grade,
+        "confidence": "high",
+        "grading_method": "gemini_only",
+        "feedback": feedback_str,
+        "grade_justification": grade_justification,
+        "remarks": "Graded using Gemini AI only (no hybrid model)",
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+    await run_blocking(save_graded_item, graded_item)
+
+    entry.update({
+        "assignedGrade": final_grade,
+        "feedback": feedback_str,
+        "grade_justification": grade_justification,
+        "from_cache": from_cache,
+        "status": "success"
+    })
+    print(f"Successfully graded {student_name}: {final_grade}/100")
+
+
+def job_cache_tags(job, entry):
+    """Tags stored with a cached grading result so it can be invalidated later."""
+    return {
+        "course_id": job["course_id"],
+        "assignment_id": job["assignment_id"],
+        "submission_id": entry["submission_id"]
+    }
+
+
+async def grade_job_entry_individually(job, entry, context, approved_key, student_submission_text):
+    """Grades one prepared submission with its own Gemini call (cached per prompt)."""
+    # Grade using ONLY Gemini (NO MiniLM/hybrid for this route)
+    print(f"Grading submission for {entry['student_name']} with Gemini only...")
+    prompt = build_gemini_grading_prompt(
+        context["assignment_title"],
+        context["questionnaire_text"],
+        approved_key,
+        student_submission_text
+    )
+    parsed_grade, _, from_cache = await request_gemini_grade(
+        prompt,
+        cache_tags=job_cache_tags(job, entry),
+        use_cache=not job["force_regrade"]
+    )
+    if parsed_grade is None:
+        print(f"Failed to parse Gemini response for {entry['student_name']}")
+        entry.update({"status": "error", "error": "Failed to parse AI response"})
+        return
+
+    await record_job_grade(job, entry, context, parsed_grade, from_cache)
+
+
+async def grade_job_submission(job, entry, submission, services, context, approved_key, semaphore):
+    """Grades one student's submission inside a job, bounded by the job's semaphore."""
+    async with semaphore:
+        try:
+            student_submission_text = await prepare_job_submission(job, entry, submission, services)
+            if student_submission_text is not None:
+                await grade_job_entry_individually(job, entry, context, approved_key, student_submission_text)
+        except Exception as e:
+            print(f"Error grading submission {entry['submission_id']}: {e}")
+            entry.update({"status": "error", "error": str(e)})
+        finally:
+            finish_grading_job_entry(job, entry)
+
+
+async def grade_job_batch(job, batch, context, approved_key, semaphore):
+    """
+    Grades one packed batch of prepared submissions with a single Gemini call.
+    Students missing from (or invalid in) the batched response are graded individually.
+    """
+    async with semaphore:
+        print(f"Grading batch of {len(batch)} submissions with one Gemini call...")
+        try:
+            batch_grades = await request_gemini_batch_grade(
+                context["assignment_title"],
+                context["questionnaire_text"],
+                approved_key,
+                [{"submission_id": item["entry"]["submission_id"], "text": item["text"]} for item in batch]
+            )
+        except Exception as e:
+            print(f"⚠️ Batched grading call failed: {e}. Grading batch individually.")
+            batch_grades = {}
+
+        for item in batch:
+            entry = item["entry"]
+            try:
+                parsed_grade = batch_grades.get(entry["submission_id"])
+                if parsed_grade is not None:
+                    # Cache under the single-student prompt so later regrades hit in either mode
+                    await run_blocking(grading_response_cache.set, item["cache_key"], {
+                        "text": json.dumps({
+                            "grade": parsed_grade[0],
+                            "grade_justification": parsed_grade[1],
+                            "feedback": parsed_grade[2]
+                        }),
+                        "model": GEMINI_GRADING_MODEL,
+                        "prompt_version": GRADING_PROMPT_VERSION,
+                        **job_cache_tags(job, entry)
+                    })
+                    await record_job_grade(job, entry, context, parsed_grade, False)
+                else:
+                    await grade_job_entry_individually(job, entry, context, approved_key, item["text"])
+            except Exception as e:
+                print(f"Error grading submission {entry['submission_id']}: {e}")
+                entry.update({"status": "error", "error": str(e)})
+            finally:
+                finish_grading_job_entry(job, entry)
+
+
+async def grade_job_in_batches(job, submissions, services, context, approved_key, semaphore):
+    """
+    Batched grading path: downloads every submission, serves cached grades, then packs
+    the remaining submissions into token-budgeted batches graded concurrently.
+    """
+    async def prepare(entry, submission):
+        async with semaphore:
+            try:
+                return await prepare_job_submission(job, entry, submission, services)
+            except Exception as e:
+                print(f"Error preparing submission {entry['submission_id']}: {e}")
+                entry.update({"status": "error", "error": str(e)})
+                return None
+            finally:
+                finish_grading_job_entry(job, entry)
+
+    texts = await asyncio.gather(*[
+        prepare(entry, submission) for entry, submission in zip(job["submissions"], submissions)
+    ])
+
+    pending = []
+    for entry, student_submission_text in zip(job["submissions"], texts):
+        if student_submission_text is None:
+            continue
+        prompt = build_gemini_grading_prompt(
+            context["assignment_title"], context["questionnaire_text"], approved_key, student_submission_text
+        )
+        cache_key = grading_cache_key(GEMINI_GRADING_MODEL, prompt)
+        cached = None if job["force_regrade"] else await run_blocking(grading_response_cache.get, cache_key)
+        parsed_grade = parse_gemini_grading_response(cached["text"]) if cached is not None else None
+        if parsed_grade is not None:
+            await record_job_grade(job, entry, context, parsed_grade, True)
+            finish_grading_job_entry(job, entry)
+        else:
+            pending.append({"entry": entry, "text": student_submission_text, "cache_key": cache_key})
+
+    base_tokens = estimate_tokens(context["questionnaire_text"]) + estimate_tokens(approved_key) + estimate_tokens(GRADING_CRITERIA)
+    batches = pack_grading_batches(pending, base_tokens)
+    print(f"Packed {len(pending)} submissions into {len(batches)} Gemini batch request(s).")
+
+    await asyncio.gather(*[
+        grade_job_batch(job, batch, context, approved_key, semaphore) for batch in batches
+    ])
+
+
+async def run_grading_job(job_id, creds_data, approved_key):
+    """Background task that drives a whole-class grading job to completion."""
+    job = grading_jobs[job_id]
+    job["status"] = "running"
+    job["updated_at"] = datetime.datetime.now().isoformat()
+    publish_grading_job_event(job, "status", grading_job_counts(job))
+
+    try:
+        services = {
+            "classroom": await run_blocking(build_google_service_from_credentials, creds_data, 'classroom', 'v1'),
+            "drive": await run_blocking(build_google_service_from_credentials, creds_data, 'drive', 'v3')
+        }
+        # Metadata/questionnaire and every page of TURNED_IN submissions are fetched concurrently
+        print("Fetching assignment context and all student submissions...")
+        context, submissions = await asyncio.gather(
+            run_throttled(
+                load_grading_job_context, services["classroom"], services["drive"], job["course_id"], job["assignment_id"]
+            ),
+            list_google_items(
+                services["classroom"].courses().courseWork().studentSubmissions().list,
+                'studentSubmissions',
+                'classroom',
+                "id,userId,assignmentSubmission",
+                courseId=job["course_id"],
+                courseWorkId=job["assignment_id"],
+                states=['TURNED_IN']
+            )
+        )
+    except HttpError as error:
+        error_details = error.content.decode('utf-8')
+        print(f"Google API Error in grading job {job_id}: {error.resp.status} - {error_details}")
+        end_grading_job(job, "failed", f"Google API Error: {error_details}")
+        return
+    except Exception as e:
+        print(f"Grading job {job_id} failed during setup: {e}")
+        end_grading_job(job, "failed", str(e))
+        return
+
+    job["assignment_title"] = context["assignment_title"]
+    job["course_name"] = context["course_name"]
+    job["total_submissions"] = len(submissions)
+
+    if not submissions:
+        end_grading_job(job, "failed", "No student submissions found for this assignment.")
+        return
+
+    print(f"Found {len(submissions)} submissions to grade (concurrency: {job['concurrency']}, batched: {job['batch_grading']}).")
+
+    # Resolve every student's name up front with batched profile lookups
+    student_names = await run_throttled(
+        resolve_student_names, services["classroom"], job["course_id"], [submission['userId'] for submission in submissions]
+    )
+    job["submissions"] = [
+        {
+            "submission_id": submission.get('id', 'unknown'),
+            "student_name": student_names.get(submission.get('userId'), f"Unknown Student ({submission.get('userId')})"),
+            "status": "pending"
+        }
+        for submission in submissions
+    ]
+    update_grading_job_counts(job)
+    publish_grading_job_event(job, "status", grading_job_counts(job))
+
+    semaphore = asyncio.Semaphore(job["concurrency"])
+    if job["batch_grading"]:
+        await grade_job_in_batches(job, submissions, services, context, approved_key, semaphore)
+    else:
+        await asyncio.gather(*[
+            grade_job_submission(job, entry, submission, services, context, approved_key, semaphore)
+            for entry, submission in zip(job["submissions"], submissions)
+        ])
+
+    end_grading_job(job, "complete")
+    print(f"Grading job {job_id} complete! Successfully graded {job['graded_count']} out of {len(submissions)} submissions.")
+
+
+@app.post('/api/grade-with-gemini')
+async def grade_with_gemini(request: Request):
+    """
+    Path 2 - Step 3: Grade ALL student submissions using Gemini with the approved answer key.
+    Starts a background grading job and returns its job ID immediately; poll
+    /api/grading-jobs/{job_id} or subscribe to /api/grading-jobs/{job_id}/events
+    for per-student progress and results.
+    """
+    data = await request.json()
+    course_id = data.get('course_id')
+    assignment_id = data.get('assignment_id')
+    approved_key = data.get('approved_key')
+    concurrency = data.get('concurrency', GRADING_JOB_CONCURRENCY)
+    force_regrade = data.get('force_regrade', False)
+    batch_grading = data.get('batch_grading', GRADING_BATCH_MODE)
+
+    if not all([course_id, assignment_id, approved_key]):
+        return JSONResponse(
+            content={"error": "Missing required data: course_id, assignment_id, or approved_key."},
+            status_code=400
+        )
+
+    # Validates (and refreshes if needed) the session credentials before the job captures them
+    classroom_service = await run_blocking(get_google_service, 'classroom', 'v1', request)
+
+    if not classroom_service:
+        return JSONResponse(
+            content={"error": "User not authenticated. Please re-login."},
+            status_code=401
+        )
+
+    try:
+        concurrency = min(max(1, int(concurrency)), GRADING_JOB_MAX_CONCURRENCY)
+    except (TypeError, ValueError):
+        concurrency = min(GRADING_JOB_CONCURRENCY, GRADING_JOB_MAX_CONCURRENCY)
+
+    prune_finished_grading_jobs()
+    job_id = uuid.uuid4().hex
+    now = datetime.datetime.now().isoformat()
+    grading_jobs[job_id] = {
+        "job_id": job_id,
+        "status": "queued",
+        "course_id": course_id,
+        "assignment_id": assignment_id,
+        "course_name": None,
+        "assignment_title": None,
+        "concurrency": concurrency,
+        "force_regrade": bool(force_regrade),
+        "batch_grading": bool(batch_grading),
+        "total_submissions": 0,
+        "completed_count": 0,
+        "graded_count": 0,
+        "skipped_count": 0,
+        "error_count": 0,
+        "submissions": [],
+        "error": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    grading_job_owners[job_id] = credential_identity(request.session['credentials'])
+
+    task = asyncio.create_task(run_grading_job(job_id, dict(request.session['credentials']), approved_key))
+    grading_job_tasks.add(task)
+    task.add_done_callback(grading_job_tasks.discard)
+
+    print(f"📋 Started grading job {job_id} for course {course_id}, assignment {assignment_id}")
+    return JSONResponse(
+        content={
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/api/grading-jobs/{job_id}",
+            "events_url": f"/api/grading-jobs/{job_id}/events"
+        },
+        status_code=202
+    )
+
+
+@app.get('/api/grading-jobs/{job_id}')
+async def get_grading_job(job_id: str, request: Request):
+    """
+    Returns the progress of a whole-class grading job, including per-student
+    statuses and the results graded so far. Only the teacher who started the job can read it.
+    """
+    return get_owned_grading_job(job_id, request)
+
+
+@app.get('/api/grading-jobs/{job_id}/events')
+async def stream_grading_job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events stream of a grading job's progress. Starts with a `snapshot` event
+    (the full job state, so late subscribers catch up), then sends a `student` event per
+    graded/skipped/failed student with running counts, `status` events, and closes with
+    a `complete` or `failed` event. Only the teacher who started the job can subscribe.
+    """
+    job = get_owned_grading_job(job_id, request)
+    if isinstance(job, Response):
+        return job
+
+    async def event_stream():
+        # Registered here, inside the try/finally that removes it, so a client that
+        # disconnects before the stream starts never leaves a queue behind
+        queue = asyncio.Queue()
+        grading_job_subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            yield sse_event("snapshot", job)
+            if job["status"] in FINISHED_JOB_STATUSES:
+                yield sse_event(job["status"], {"counts": grading_job_counts(job), "error": job["error"]})
+                return
+
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=GRADING_JOB_EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield sse_event(event, data)
+                if event in FINISHED_JOB_STATUSES:
+                    return
+        finally:
+            subscribers = grading_job_subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    grading_job_subscribers.pop(job_id, None)
+
+    return sse_response(event_stream())
+
+
 # --- 9. ANALYTICS ENDPOINTS ---
 
 @app.get('/api/analytics/distribution')
@@ -2468,10 +5080,45 @@ async def get_db_status():
         "mongodb_connected": grades_collection is not None,
         "storage_type": "MongoDB" if grades_collection is not None else "In-Memory",
         "total_grades": len(graded_assignments_history) if grades_collection is None else "Check MongoDB",
-        "database_name": db.name if db is not None else None
+        "database_name": db.name if db is not None else None,
+        "caches": {
+            "extracted_text": extracted_text_cache.stats(),
+            "ocr_results": ocr_result_store.stats(),
+            "grading_responses": grading_response_cache.stats(),
+            "embeddings": minilm_embedding_store.stats()
+        }
     }
 
 
+@app.get('/api/ready')
+async def get_readiness():
+    """
+    Readiness probe. Returns 503 while the MiniLM model is still loading/warming up, and
+    200 once it is ready (or has definitively failed to load, in which case grading falls
+    back to Gemini only). Always ready when MINILM_PRELOAD is disabled.
+    """
+    ready = not MINILM_PRELOAD or MINILM_STATUS in ("ready", "unavailable")
+    return JSONResponse(
+        content={
+            "ready": ready,
+            "minilm_status": MINILM_STATUS,
+            "minilm_backend": minilm_active_backend or MINILM_BACKEND,
+            "minilm_inference_processes": MINILM_INFERENCE_PROCESSES,
+            "minilm_device": MINILM_DEVICE,
+            "embedding_batcher": minilm_encoder.stats()
+        },
+        status_code=200 if ready else 503
+    )
+
+
+@app.get('/api/rate-limits')
+async def get_rate_limits():
+    """
+    Returns per-API rate limiter state: queue depth, throttle and retry counts.
+    """
+    return {api_name: limiter.stats() for api_name, limiter in api_rate_limiters.items()}
+
+
 # --- 6. MAIN APPLICATION RUNNER ---
 
 # CHANGED: Replaced Flask's 'app.run' with 'uvicorn.run'
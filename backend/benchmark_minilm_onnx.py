@@ -0,0 +1,92 @@
+"""
+Benchmark the ONNX Runtime MiniLM backend against the PyTorch sentence-transformers model.
+Reports per-pair scoring latency and how far the ONNX similarity scores drift from torch.
+
+Usage:
+    python benchmark_minilm_onnx.py [model_dir] [repeats]
+"""
+
+import sys
+import time
+import statistics
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from minilm_onnx import OnnxSentenceEncoder
+
+MODEL_DIR = sys.argv[1] if len(sys.argv) > 1 else "./minilm-finetuned-grading"
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+# (answer key, student answer) pairs of different lengths and similarity levels
+SAMPLE_PAIRS = [
+    ("Supervised learning trains models on labeled input–output pairs so they learn explicit mappings useful for prediction, classification, or regression. Unsupervised learning works with unlabeled data and aims to discover hidden structure.",
+     "Supervised learning relies on labeled datasets, allowing a model to learn the exact relationship between input and output. Unsupervised learning focuses on discovering natural structures without labels."),
+    ("Overfitting occurs when a model memorizes training examples instead of identifying general patterns.",
+     "Overfitting = memorizing."),
+    ("A loss function quantifies how far a model's predictions deviate from true targets; it provides the numerical signal used by optimizers to update model parameters.",
+     "Gradient descent is an optimization algorithm."),
+    ("Photosynthesis converts light energy into chemical energy stored in glucose, using carbon dioxide and water and releasing oxygen as a by-product.",
+     "Plants use sunlight, water and CO2 to make glucose and give off oxygen."),
+    ("Question 1: The mitochondria is the powerhouse of the cell. " * 20,
+     "Question 1: Mitochondria produce ATP through cellular respiration. " * 20),
+]
+
+
+def cosine_similarity(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def benchmark(name, model):
+    """Scores every sample pair REPEATS times; returns (similarities, per-pair latencies in ms)."""
+    # Warm-up run (first-call overhead is measured separately by app startup)
+    for teacher, student in SAMPLE_PAIRS:
+        model.encode(teacher, convert_to_numpy=True)
+        model.encode(student, convert_to_numpy=True)
+
+    latencies = []
+    similarities = []
+    for _ in range(REPEATS):
+        similarities = []
+        for teacher, student in SAMPLE_PAIRS:
+            started = time.perf_counter()
+            teacher_emb = model.encode(teacher, convert_to_numpy=True)
+            student_emb = model.encode(student, convert_to_numpy=True)
+            latencies.append((time.perf_counter() - started) * 1000)
+            similarities.append(cosine_similarity(teacher_emb, student_emb))
+
+    latencies.sort()
+    print(f"{name:<12} p50 {statistics.median(latencies):7.2f} ms   "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.2f} ms   "
+          f"mean {statistics.mean(latencies):7.2f} ms")
+    return similarities, latencies
+
+
+print("=" * 70)
+print("MINILM BACKEND BENCHMARK: PyTorch vs ONNX Runtime")
+print("=" * 70)
+print(f"Model: {MODEL_DIR}   pairs: {len(SAMPLE_PAIRS)}   repeats: {REPEATS}\n")
+
+backends = {"torch": SentenceTransformer(MODEL_DIR, device="cpu")}
+for label, onnx_file in [("onnx-fp32", "onnx/model.onnx"), ("onnx-int8", "onnx/model_int8.onnx")]:
+    try:
+        backends[label] = OnnxSentenceEncoder(MODEL_DIR, onnx_file=onnx_file)
+    except FileNotFoundError as e:
+        print(f"⚠️ Skipping {label}: {e}")
+
+results = {name: benchmark(name, model) for name, model in backends.items()}
+
+torch_similarities, torch_latencies = results["torch"]
+print("\nSimilarity drift vs torch:")
+for name, (similarities, latencies) in results.items():
+    if name == "torch":
+        continue
+    drift = [abs(a - b) for a, b in zip(similarities, torch_similarities)]
+    speedup = statistics.median(torch_latencies) / statistics.median(latencies)
+    print(f"{name:<12} max |Δ| {max(drift):.4f}   mean |Δ| {statistics.mean(drift):.4f}   speedup x{speedup:.2f}")
+
+print("\nPer-pair similarities:")
+for index in range(len(SAMPLE_PAIRS)):
+    row = "   ".join(f"{name} {results[name][0][index]:.4f}" for name in results)
+    print(f"  pair {index + 1}: {row}")
+print("=" * 70)
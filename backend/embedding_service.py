@@ -0,0 +1,223 @@
+"""
+Dynamic micro-batching for sentence embeddings.
+
+Encode requests from any thread are queued. A dedicated inference
+thread merges the requests that arrive within a few milliseconds of each other into a
+single padded batch, runs one forward pass, and hands each caller back its own rows.
+Under concurrent grading, throughput then scales with batch size instead of request count.
+When `encode_batch` hands batches to a worker process pool, several dispatch threads keep
+one batch in flight per worker.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatchingEncoder:
+    """
+    Merges concurrent encode calls into batched calls of `encode_batch`.
+
+    Args:
+        encode_batch: function(list[str]) -> 2-D numpy array (one row per text)
+        max_batch_size (int): Maximum number of texts per merged batch
+        max_wait_ms (float): How long the first request of a batch waits for others to join
+        dispatch_threads (int): Batches run concurrently (one per inference worker process)
+    """
+
+    def __init__(self, encode_batch, max_batch_size=32, max_wait_ms=5, dispatch_threads=1):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self.dispatch_threads = max(1, dispatch_threads)
+        self._requests = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.request_count = 0
+        self.text_count = 0
+        self.batch_count = 0
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if not self._threads:
+                for index in range(self.dispatch_threads):
+                    thread = threading.Thread(target=self._run, name=f"minilm-inference-{index}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def submit(self, texts):
+        """Queues texts for encoding; returns a Future resolving to their 2-D embedding array."""
+        future = Future()
+        if not texts:
+            future.set_result(np.zeros((0, 0), dtype=np.float32))
+            return future
+        self._ensure_started()
+        self._requests.put((list(texts), future))
+        return future
+
+    def encode(self, texts):
+        """Blocking encode of a list of texts through the shared batch queue."""
+        return self.submit(texts).result()
+
+    def _collect_batch(self):
+        """Blocks for the first request, then gathers more until the wait window or batch size runs out."""
+        batch = [self._requests.get()]
+        text_total = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait_seconds
+        while text_total < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            text_total += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            # One thread fills a batch at a time so concurrent dispatchers don't split the window
+            with self._collect_lock:
+                batch = self._collect_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            with self._stats_lock:
+                self.request_count += len(batch)
+                self.text_count += len(texts)
+                self.batch_count += 1
+            try:
+                embeddings = self.encode_batch(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for request_texts, future in batch:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+    def stats(self):
+        return {
+            "requests": self.request_count,
+            "texts": self.text_count,
+            "batches": self.batch_count,
+            "avg_texts_per_batch": round(self.text_count / self.batch_count, 2) if self.batch_count else 0,
+            "queue_depth": self._requests.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_seconds * 1000,
+            "dispatch_threads": self.dispatch_threads
+        }
+
+
+def load_window_tokenizer(tokenizer_path):
+    """
+    Loads a `tokenizers.Tokenizer` for split_into_windows. A sentence-transformers tokenizer.json
+    usually enables truncation at the model's max sequence length (and padding); both are
+    turned off so the offsets cover the whole text, not just its first window.
+    """
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(tokenizer_path)
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+def split_into_windows(text, window_tokens=200, overlap_tokens=50, tokenizer=None):
+    """
+    Splits text into overlapping windows of at most `window_tokens` tokens, so long documents
+    are embedded in full instead of being truncated at the model's max sequence length.
+
+    Args:
+        tokenizer: optional `tokenizers.Tokenizer`; windows then follow the model's own tokens
+            (mapped back to character offsets). Without one, whitespace words are used.
+
+    Returns:
+        list[str]: the windows (a single window for short texts, none for blank text)
+    """
+    stride = max(1, window_tokens - overlap_tokens)
+
+    if tokenizer is not None:
+        offsets = [span for span in tokenizer.encode(text, add_special_tokens=False).offsets if span[1] > span[0]]
+        if len(offsets) <= window_tokens:
+            return [text] if offsets else []
+        windows = []
+        for start in range(0, len(offsets), stride):
+            window = offsets[start:start + window_tokens]
+            windows.append(text[window[0][0]:window[-1][1]])
+            if start + window_tokens >= len(offsets):
+                break
+        return windows
+
+    words = text.split()
+    if len(words) <= window_tokens:
+        return [text] if words else []
+    windows = []
+    for start in range(0, len(words), stride):
+        windows.append(" ".join(words[start:start + window_tokens]))
+        if start + window_tokens >= len(words):
+            break
+    return windows
+
+
+def normalize_rows(embeddings):
+    """L2-normalizes each row of a 2-D embedding array."""
+    return embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+
+def chunked_similarity(reference_chunks, candidate_chunks, pooling="maxsim"):
+    """
+    Cosine similarity between two chunked documents.
+
+    pooling:
+        "maxsim": each reference chunk is aligned with its most similar candidate chunk and
+            the best matches are averaged (how much of the reference the candidate covers)
+        "mean": cosine similarity of the mean-pooled chunk embeddings
+    """
+    reference = normalize_rows(np.asarray(reference_chunks, dtype=np.float32))
+    candidate = normalize_rows(np.asarray(candidate_chunks, dtype=np.float32))
+
+    if pooling == "mean":
+        reference_mean = reference.mean(axis=0)
+        candidate_mean = candidate.mean(axis=0)
+        return float(np.dot(reference_mean, candidate_mean) /
+                     (np.linalg.norm(reference_mean) * np.linalg.norm(candidate_mean)))
+
+    return float((reference @ candidate.T).max(axis=1).mean())
+
+
+def segment_similarities(reference_embeddings, reference_spans, candidate_embeddings, candidate_spans, pooling="maxsim"):
+    """
+    Vectorized similarity of aligned document segments (e.g. question N of the answer key vs.
+    question N of a submission), each segment being a contiguous range of chunk embeddings.
+
+    Args:
+        reference_spans / candidate_spans: lists of (start, end) row ranges, aligned by index
+        pooling: "maxsim" or "mean" (see chunked_similarity)
+
+    Returns:
+        numpy array with one similarity per segment pair
+    """
+    reference = normalize_rows(np.asarray(reference_embeddings, dtype=np.float32))
+    candidate = normalize_rows(np.asarray(candidate_embeddings, dtype=np.float32))
+
+    if pooling == "mean":
+        reference_means = normalize_rows(np.stack([reference[start:end].mean(axis=0) for start, end in reference_spans]))
+        candidate_means = normalize_rows(np.stack([candidate[start:end].mean(axis=0) for start, end in candidate_spans]))
+        return (reference_means * candidate_means).sum(axis=1)
+
+    # One matrix product over every chunk pair; each segment pair reads its own block
+    similarity = reference @ candidate.T
+    return np.array([
+        similarity[reference_start:reference_end, candidate_start:candidate_end].max(axis=1).mean()
+        for (reference_start, reference_end), (candidate_start, candidate_end) in zip(reference_spans, candidate_spans)
+    ])
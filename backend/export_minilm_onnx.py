@@ -0,0 +1,81 @@
+"""
+Export the fine-tuned MiniLM model to ONNX and quantize it to int8.
+The quantized model is used by app.py when MINILM_BACKEND=onnx (see minilm_onnx.py).
+
+Usage:
+    python export_minilm_onnx.py [model_dir]
+"""
+
+import os
+import sys
+
+import torch
+from transformers import AutoModel, AutoTokenizer
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+MODEL_DIR = sys.argv[1] if len(sys.argv) > 1 else "./minilm-finetuned-grading"
+ONNX_DIR = os.path.join(MODEL_DIR, "onnx")
+FP32_PATH = os.path.join(ONNX_DIR, "model.onnx")
+INT8_PATH = os.path.join(ONNX_DIR, "model_int8.onnx")
+
+
+class TokenEmbeddingModel(torch.nn.Module):
+    """Wraps the transformer so the exported graph returns only the token embeddings."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids
+        )[0]
+
+
+print("=" * 70)
+print("EXPORTING MINILM MODEL TO QUANTIZED ONNX")
+print("=" * 70)
+
+if not os.path.exists(MODEL_DIR):
+    print(f"❌ Model directory not found: {MODEL_DIR}")
+    print("   Run 'python finetune_minilm.py' first")
+    sys.exit(1)
+
+os.makedirs(ONNX_DIR, exist_ok=True)
+
+print(f"\n📥 Loading transformer from {MODEL_DIR}...")
+tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
+model = TokenEmbeddingModel(AutoModel.from_pretrained(MODEL_DIR)).eval()
+
+sample = tokenizer(["Sample answer used to trace the export graph."], return_tensors="pt")
+
+print("🔧 Exporting FP32 ONNX graph...")
+with torch.no_grad():
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+        FP32_PATH,
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["token_embeddings"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "token_type_ids": {0: "batch", 1: "sequence"},
+            "token_embeddings": {0: "batch", 1: "sequence"}
+        },
+        opset_version=14
+    )
+print(f"✅ FP32 model saved to: {FP32_PATH} ({os.path.getsize(FP32_PATH) / 1e6:.1f} MB)")
+
+print("🔧 Quantizing weights to int8 (dynamic quantization)...")
+quantize_dynamic(FP32_PATH, INT8_PATH, weight_type=QuantType.QInt8)
+print(f"✅ INT8 model saved to: {INT8_PATH} ({os.path.getsize(INT8_PATH) / 1e6:.1f} MB)")
+
+print("\n" + "=" * 70)
+print("NEXT STEPS:")
+print("1. Run 'python benchmark_minilm_onnx.py' to compare latency and similarity drift")
+print("2. Set MINILM_BACKEND=onnx in .env to serve the quantized model")
+print("3. Restart your backend server")
+print("=" * 70)
@@ -0,0 +1,97 @@
+"""
+ONNX Runtime inference backend for the (fine-tuned) MiniLM sentence-transformer.
+
+Runs the int8-quantized model produced by export_minilm_onnx.py with only
+onnxruntime, tokenizers and numpy, so workers using it never import torch.
+`OnnxSentenceEncoder.encode` mirrors the subset of SentenceTransformer.encode
+that app.py uses, so it can stand in for the torch model.
+"""
+
+import os
+import json
+
+import numpy as np
+
+DEFAULT_ONNX_FILE = os.path.join("onnx", "model_int8.onnx")
+
+
+class OnnxSentenceEncoder:
+    """
+    Sentence encoder backed by an ONNX export of a sentence-transformers model directory.
+    Tokenization, pooling and normalization follow the directory's sentence-transformers config.
+    """
+
+    def __init__(self, model_dir, onnx_file=DEFAULT_ONNX_FILE, intra_op_threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        onnx_path = os.path.join(model_dir, onnx_file)
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"ONNX model not found at {onnx_path}. Run 'python export_minilm_onnx.py' first.")
+
+        self.max_seq_length = self._read_json(model_dir, "sentence_bert_config.json").get("max_seq_length", 256)
+        pooling_config = self._read_json(model_dir, os.path.join("1_Pooling", "config.json"))
+        if pooling_config.get("pooling_mode_cls_token"):
+            self.pooling_mode = "cls"
+        elif pooling_config.get("pooling_mode_max_tokens"):
+            self.pooling_mode = "max"
+        else:
+            self.pooling_mode = "mean"
+        modules = self._read_json(model_dir, "modules.json") or []
+        self.normalize = any(module.get("type", "").endswith("Normalize") for module in modules)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        pad_token = "[PAD]"
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token)
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            session_options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=session_options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.onnx_path = onnx_path
+
+    @staticmethod
+    def _read_json(model_dir, file_name):
+        path = os.path.join(model_dir, file_name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _pool(self, token_embeddings, attention_mask):
+        if self.pooling_mode == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[..., None].astype(token_embeddings.dtype)
+        if self.pooling_mode == "max":
+            return np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        """
+        Encodes one sentence (returns a 1-D array) or a list of sentences (returns a 2-D array).
+        Extra SentenceTransformer.encode keyword arguments are accepted and ignored.
+        """
+        single_sentence = isinstance(sentences, str)
+        if single_sentence:
+            sentences = [sentences]
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(sentences[start:start + batch_size])
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": attention_mask,
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            }
+            feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            batches.append(self._pool(token_embeddings, attention_mask))
+
+        embeddings = np.concatenate(batches, axis=0) if batches else np.zeros((0, 0), dtype=np.float32)
+        if self.normalize and len(embeddings):
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single_sentence else embeddings
@@ -0,0 +1,58 @@
+"""
+MiniLM inference worker for the embedding process pool.
+
+Kept separate from app.py so spawned worker processes only import the model stack
+(torch/sentence-transformers or onnxruntime), not the web application.
+Each worker loads the model once in its initializer and caps its own thread count,
+so N workers x T threads never oversubscribe the host's cores.
+"""
+
+import os
+
+_model = None
+_backend = None
+_load_error = None
+
+
+def init_minilm_worker(backend, model_name, onnx_model_dir, onnx_file, num_threads):
+    """Process-pool initializer: loads the model for this worker process."""
+    global _model, _backend, _load_error
+
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(num_threads)
+
+    try:
+        if backend == "onnx":
+            try:
+                from minilm_onnx import OnnxSentenceEncoder
+                _model = OnnxSentenceEncoder(onnx_model_dir, onnx_file, intra_op_threads=num_threads)
+                _backend = "onnx"
+                return
+            except Exception as e:
+                print(f"⚠️ [minilm worker {os.getpid()}] ONNX model unavailable ({e}), using PyTorch")
+
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(1)
+        _model = SentenceTransformer(model_name, device="cpu")
+        _backend = "torch"
+    except Exception as e:
+        # Raising here would break the whole pool; report the error on each encode instead
+        _load_error = str(e)
+        print(f"❌ [minilm worker {os.getpid()}] Failed to load MiniLM model: {e}")
+
+
+def encode_texts(texts):
+    """Encodes a batch of texts in this worker; returns a 2-D numpy array."""
+    if _model is None:
+        raise RuntimeError(f"MiniLM model not available in worker: {_load_error}")
+    return _model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+
+def loaded_backend():
+    """The backend this worker actually loaded ("onnx" or "torch"), after any ONNX fallback."""
+    if _model is None:
+        raise RuntimeError(f"MiniLM model not available in worker: {_load_error}")
+    return _backend
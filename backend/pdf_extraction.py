@@ -0,0 +1,39 @@
+"""
+Local PDF text-layer extraction for GradePilot.
+
+Kept separate from app.py so that process-pool workers can import it without
+loading the web app, the MongoDB connection or the MiniLM model.
+"""
+
+import pymupdf
+
+
+def count_pdf_pages(pdf_bytes):
+    """Returns the number of pages in a PDF."""
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return doc.page_count
+
+
+def extract_pdf_page_range(pdf_bytes, start_page, end_page, min_page_chars=25, render_dpi=200):
+    """
+    Extracts the embedded text layer of pages [start_page, end_page).
+
+    Pages whose text layer has fewer than min_page_chars characters (scanned or
+    handwritten pages) are rendered to PNG instead, so the caller can OCR them.
+
+    Returns:
+        list: One dict per page: {"page": 1-based page number, "text": str or None,
+              "image": PNG bytes or None}
+    """
+    pages = []
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for page_index in range(start_page, min(end_page, doc.page_count)):
+            page = doc[page_index]
+            text = page.get_text("text").strip()
+
+            if len(text) >= min_page_chars:
+                pages.append({"page": page_index + 1, "text": text, "image": None})
+            else:
+                pixmap = page.get_pixmap(dpi=render_dpi)
+                pages.append({"page": page_index + 1, "text": None, "image": pixmap.tobytes("png")})
+    return pages
@@ -0,0 +1,56 @@
+"""
+Local Tesseract OCR worker for GradePilot.
+
+Runs inside a process pool started by app.py, so it is kept separate from the
+web app and only imports what OCR needs. Requires the `tesseract` binary.
+"""
+
+import io
+
+import pytesseract
+from PIL import Image
+
+
+def tesseract_ocr(image_bytes, lang="eng", config=""):
+    """
+    Runs Tesseract on one page image and returns the same shape as the Cloud Vision
+    engine: {"text": str, "pages": [{"width", "height", "confidence", "blocks": [...]}]}.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        width, height = image.size
+        data = pytesseract.image_to_data(image, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+
+    # Group recognised words into blocks and lines, preserving reading order
+    blocks = {}
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        block = blocks.setdefault(data["block_num"][i], {"lines": {}, "confidences": [], "boxes": []})
+        line_key = (data["par_num"][i], data["line_num"][i])
+        block["lines"].setdefault(line_key, []).append(word)
+        block["confidences"].append(float(data["conf"][i]))
+        block["boxes"].append((data["left"][i], data["top"][i], data["left"][i] + data["width"][i], data["top"][i] + data["height"][i]))
+
+    page_blocks = []
+    for block in blocks.values():
+        left = min(box[0] for box in block["boxes"])
+        top = min(box[1] for box in block["boxes"])
+        right = max(box[2] for box in block["boxes"])
+        bottom = max(box[3] for box in block["boxes"])
+        page_blocks.append({
+            "block_type": "TEXT",
+            "confidence": sum(block["confidences"]) / len(block["confidences"]) / 100,
+            "bounding_box": [[left, top], [right, top], [right, bottom], [left, bottom]],
+            "text": '\n'.join(' '.join(words) for words in block["lines"].values())
+        })
+
+    confidences = [block["confidence"] for block in page_blocks]
+    return {
+        "text": '\n\n'.join(block["text"] for block in page_blocks),
+        "pages": [{
+            "width": width,
+            "height": height,
+            "confidence": sum(confidences) / len(confidences) if confidences else 0.0,
+            "blocks": page_blocks
+        }]
+    }
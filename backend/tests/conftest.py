@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# app.py imports its sibling modules (embedding_service, minilm_worker, ...) by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_disk_cache(tmp_path, monkeypatch):
+    """Factory for app.PersistentLRUCache instances persisted under a temporary directory."""
+    app = pytest.importorskip("app")
+    monkeypatch.setattr(app, "CACHE_BACKEND", "disk")
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path))
+
+    def make(name="test", max_entries=100, ttl_seconds=None, memory_max_bytes=1024 * 1024):
+        return app.PersistentLRUCache(name, memory_max_bytes, max_entries, ttl_seconds)
+
+    return make
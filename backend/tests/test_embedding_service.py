@@ -0,0 +1,124 @@
+import os
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from embedding_service import (
+    MicroBatchingEncoder, chunked_similarity, load_window_tokenizer, segment_similarities, split_into_windows
+)
+
+TOKENIZER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "minilm-finetuned-grading", "tokenizer.json")
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    pytest.importorskip("tokenizers")
+    if not os.path.exists(TOKENIZER_PATH):
+        pytest.skip("fine-tuned MiniLM tokenizer not available")
+    return load_window_tokenizer(TOKENIZER_PATH)
+
+
+def test_windows_cover_text_beyond_model_max_length(tokenizer):
+    text = " ".join(f"answer{index} explains photosynthesis step {index}." for index in range(400))
+    token_count = len(tokenizer.encode(text, add_special_tokens=False).ids)
+    assert token_count > 256
+
+    windows = split_into_windows(text, window_tokens=200, overlap_tokens=50, tokenizer=tokenizer)
+
+    assert len(windows) >= token_count // 150
+    assert windows[0].startswith("answer0 ")
+    assert windows[-1].endswith("step 399.")
+
+
+def test_word_windows_overlap_and_reach_the_end():
+    words = [f"w{index}" for index in range(500)]
+
+    windows = split_into_windows(" ".join(words), window_tokens=200, overlap_tokens=50)
+
+    assert [window.split()[0] for window in windows] == ["w0", "w150", "w300"]
+    assert windows[0].split()[-50:] == windows[1].split()[:50]
+    assert windows[-1].split()[-1] == "w499"
+
+
+def test_short_and_blank_texts():
+    assert split_into_windows("a short answer", window_tokens=200) == ["a short answer"]
+    assert split_into_windows("   ", window_tokens=200) == []
+
+
+class RecordingBatchEncoder:
+    """encode_batch stand-in: one row [text length, batch number] per text; records batch sizes."""
+
+    def __init__(self, release=None):
+        self.batch_sizes = []
+        self.release = release
+
+    def __call__(self, texts):
+        if self.release is not None:
+            self.release.wait(5)
+        self.batch_sizes.append(len(texts))
+        return np.array([[len(text), len(self.batch_sizes)] for text in texts], dtype=np.float32)
+
+
+def test_concurrent_requests_are_merged_into_one_batch():
+    encode_batch = RecordingBatchEncoder()
+    encoder = MicroBatchingEncoder(encode_batch, max_batch_size=32, max_wait_ms=200)
+
+    futures = [encoder.submit(["a"]), encoder.submit(["bb", "ccc"]), encoder.submit(["dddd"])]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert encode_batch.batch_sizes == [4]
+    assert [result[:, 0].tolist() for result in results] == [[1], [2, 3], [4]]
+    assert encoder.stats()["avg_texts_per_batch"] == 4
+
+
+def test_batches_are_capped_at_max_batch_size():
+    release = threading.Event()
+    encode_batch = RecordingBatchEncoder(release)
+    encoder = MicroBatchingEncoder(encode_batch, max_batch_size=2, max_wait_ms=200)
+
+    futures = [encoder.submit([f"text {index}"]) for index in range(5)]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+
+    assert max(encode_batch.batch_sizes) <= 2
+    assert sum(encode_batch.batch_sizes) == 5
+
+
+def test_encoding_errors_reach_every_caller_of_the_batch():
+    def failing_encode_batch(texts):
+        raise RuntimeError("model not loaded")
+
+    encoder = MicroBatchingEncoder(failing_encode_batch, max_wait_ms=200)
+    futures = [encoder.submit(["a"]), encoder.submit(["b"])]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model not loaded"):
+            future.result(timeout=5)
+
+
+def test_maxsim_scores_how_much_of_the_reference_is_covered():
+    reference = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float32)
+
+    assert chunked_similarity(reference, reference) == pytest.approx(1.0)
+    # The candidate covers the first reference chunk only
+    assert chunked_similarity(reference, np.array([[1, 0, 0]], dtype=np.float32)) == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize("pooling", ["maxsim", "mean"])
+def test_segment_similarities_match_per_segment_scoring(pooling):
+    rng = np.random.default_rng(0)
+    reference = rng.normal(size=(5, 8)).astype(np.float32)
+    candidate = rng.normal(size=(4, 8)).astype(np.float32)
+    reference_spans = [(0, 2), (2, 3), (3, 5)]
+    candidate_spans = [(0, 1), (1, 3), (3, 4)]
+
+    similarities = segment_similarities(reference, reference_spans, candidate, candidate_spans, pooling)
+
+    expected = [
+        chunked_similarity(reference[reference_start:reference_end], candidate[candidate_start:candidate_end], pooling)
+        for (reference_start, reference_end), (candidate_start, candidate_end) in zip(reference_spans, candidate_spans)
+    ]
+    assert similarities == pytest.approx(expected, abs=1e-5)
@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("googleapiclient")
+app = pytest.importorskip("app")
+
+
+def submission(submission_id, tokens):
+    # estimate_tokens counts ~4 characters per token
+    return {"submission_id": submission_id, "text": "x" * (tokens * 4)}
+
+
+@pytest.fixture(autouse=True)
+def batch_limits(monkeypatch):
+    monkeypatch.setattr(app, "GRADING_BATCH_TOKEN_BUDGET", 1000)
+    monkeypatch.setattr(app, "GRADING_BATCH_MAX_SUBMISSIONS", 3)
+
+
+def batch_ids(batches):
+    return [[item["submission_id"] for item in batch] for batch in batches]
+
+
+def test_batches_are_capped_by_submission_count():
+    items = [submission(f"s{index}", 100) for index in range(7)]
+
+    assert batch_ids(app.pack_grading_batches(items, base_tokens=0)) == [["s0", "s1", "s2"], ["s3", "s4", "s5"], ["s6"]]
+
+
+def test_batches_are_capped_by_token_budget_including_shared_prompt():
+    items = [submission(f"s{index}", 300) for index in range(4)]
+
+    # 390 shared tokens leave room for two ~300-token submissions per batch
+    assert batch_ids(app.pack_grading_batches(items, base_tokens=390)) == [["s0", "s1"], ["s2", "s3"]]
+
+
+def test_oversized_submission_gets_a_batch_of_its_own():
+    items = [submission("small-1", 100), submission("huge", 5000), submission("small-2", 100)]
+
+    assert batch_ids(app.pack_grading_batches(items, base_tokens=0)) == [["small-1"], ["huge"], ["small-2"]]
+
+
+def test_batch_prompt_labels_every_submission():
+    prompt = app.build_gemini_batch_grading_prompt(
+        "Essay", "Question 1: Explain photosynthesis.", "Question 1: Light to chemical energy.",
+        [{"submission_id": "s1", "text": "first answer"}, {"submission_id": "s2", "text": "second answer"}]
+    )
+
+    assert "(submission_id: s1) ---\nfirst answer" in prompt
+    assert "(submission_id: s2) ---\nsecond answer" in prompt
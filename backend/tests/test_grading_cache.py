@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("googleapiclient")
+app = pytest.importorskip("app")
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+CLASSROOM_SERVICE = SimpleNamespace(courses=lambda: SimpleNamespace(get=lambda **kwargs: kwargs))
+
+
+class JsonRequest:
+    """The parts of a FastAPI request the invalidation route reads."""
+
+    def __init__(self, body):
+        self.body = body
+        self.session = {}
+
+    async def json(self):
+        return self.body
+
+
+def test_cache_key_depends_on_model_and_prompt():
+    key = app.grading_cache_key("gemini-2.5-flash", "grade this")
+
+    assert key == app.grading_cache_key("gemini-2.5-flash", "grade this")
+    assert key != app.grading_cache_key("gemini-2.5-pro", "grade this")
+    assert key != app.grading_cache_key("gemini-2.5-flash", "grade that")
+
+
+@pytest.fixture
+def grading_cache(make_disk_cache, monkeypatch):
+    cache = make_disk_cache("grading_responses")
+    cache.set("a1-s1", {"course_id": "c1", "assignment_id": "a1", "submission_id": "s1"})
+    cache.set("a1-s2", {"course_id": "c1", "assignment_id": "a1", "submission_id": "s2"})
+    cache.set("a2-s3", {"course_id": "c1", "assignment_id": "a2", "submission_id": "s3"})
+    monkeypatch.setattr(app, "grading_response_cache", cache)
+    return cache
+
+
+def invalidate(body):
+    return asyncio.run(app.invalidate_grading_cache(JsonRequest(body)))
+
+
+def test_invalidation_requires_a_session(grading_cache, monkeypatch):
+    monkeypatch.setattr(app, "get_google_service", lambda service_name, version, request: None)
+
+    response = invalidate({"course_id": "c1"})
+
+    assert response.status_code == 401
+    assert grading_cache.get("a1-s1") is not None
+
+
+def test_invalidation_requires_course_access(grading_cache, monkeypatch):
+    async def run_google_request(http_request, api_name):
+        raise HttpError(httplib2.Response({"status": 403}), b"The caller does not have permission")
+
+    monkeypatch.setattr(app, "get_google_service", lambda service_name, version, request: CLASSROOM_SERVICE)
+    monkeypatch.setattr(app, "run_google_request", run_google_request)
+
+    response = invalidate({"course_id": "c1", "assignment_id": "a1"})
+
+    assert response.status_code == 403
+    assert grading_cache.get("a1-s1") is not None
+
+
+def test_invalidation_removes_only_the_selected_assignment(grading_cache, monkeypatch):
+    async def run_google_request(http_request, api_name):
+        return {"id": http_request["id"]}
+
+    monkeypatch.setattr(app, "get_google_service", lambda service_name, version, request: CLASSROOM_SERVICE)
+    monkeypatch.setattr(app, "run_google_request", run_google_request)
+
+    result = invalidate({"course_id": "c1", "assignment_id": "a1"})
+
+    assert result["invalidated"] == 2
+    assert grading_cache.get("a1-s1") is None
+    assert grading_cache.get("a1-s2") is None
+    assert grading_cache.get("a2-s3") is not None
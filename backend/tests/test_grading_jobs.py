@@ -0,0 +1,20 @@
+import asyncio
+
+import pytest
+
+# app.py needs the full server stack (FastAPI, Google API client, MongoDB driver, ...) at import time
+pytest.importorskip("fastapi")
+pytest.importorskip("googleapiclient")
+app = pytest.importorskip("app")
+
+
+def test_failed_download_marks_entry_as_error(monkeypatch):
+    monkeypatch.setattr(app, "load_submission_for_grading", lambda drive_service, submission, student_name: (None, None))
+    job = {"updated_at": None}
+    entry = {"submission_id": "sub-1", "student_name": "Ada Lovelace", "status": "pending"}
+
+    result = asyncio.run(app.prepare_job_submission(job, entry, {"id": "sub-1"}, {"drive": None}))
+
+    assert result is None
+    assert entry["status"] == "error"
+    assert entry["error"] == "Failed to download submission"
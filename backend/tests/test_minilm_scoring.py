@@ -0,0 +1,82 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("googleapiclient")
+app = pytest.importorskip("app")
+
+import numpy as np
+
+
+def test_split_into_questions_follows_answer_key_numbering():
+    text = """Answer key for the photosynthesis quiz
+
+**Question 1:** Light energy becomes chemical energy.
+Q2) In the chloroplasts.
+Question 3. Carbon dioxide and water.
+question 2: Mostly in the leaves."""
+
+    assert app.split_into_questions(text) == {
+        1: "Light energy becomes chemical energy.",
+        2: "In the chloroplasts.\nMostly in the leaves.",
+        3: "Carbon dioxide and water.",
+    }
+
+
+def test_text_without_numbered_questions_has_no_segments():
+    assert app.split_into_questions("Photosynthesis turns light into chemical energy.") == {}
+    assert app.split_into_questions(None) == {}
+
+
+class RecordingEncoder:
+    """minilm_encoder stand-in: embeds a text as [length, word count]; records what it encodes."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), len(text.split())] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def encoder(make_disk_cache, monkeypatch):
+    encoder = RecordingEncoder()
+    monkeypatch.setattr(app, "minilm_encoder", encoder)
+    monkeypatch.setattr(app, "minilm_embedding_store", make_disk_cache("embeddings"))
+    monkeypatch.setattr(app, "get_minilm_model_id", lambda: "onnx:minilm-finetuned-grading@test")
+    return encoder
+
+
+def test_stored_embeddings_are_not_encoded_again(encoder):
+    first = app.encode_minilm_texts(["answer key", "student one"])
+    second = app.encode_minilm_texts(["answer key", "student  two"])
+
+    assert encoder.encoded == ["answer key", "student one", "student  two"]
+    assert first.tolist() == [[10, 2], [11, 2]]
+    assert second.tolist() == [[10, 2], [12, 2]]
+
+
+def test_whitespace_variants_share_a_stored_embedding(encoder):
+    app.encode_minilm_texts(["answer  key\n"])
+    app.encode_minilm_texts(["answer key"])
+
+    assert encoder.encoded == ["answer  key\n"]
+
+
+def test_another_model_gets_its_own_embeddings(encoder, monkeypatch):
+    app.encode_minilm_texts(["answer key"])
+    monkeypatch.setattr(app, "get_minilm_model_id", lambda: "torch:minilm-finetuned-grading@test")
+    app.encode_minilm_texts(["answer key"])
+
+    assert encoder.encoded == ["answer key", "answer key"]
+
+
+def test_model_id_follows_the_backend_that_loaded(monkeypatch):
+    model_ids = {}
+    for backend in ("onnx", "torch"):
+        monkeypatch.setattr(app, "minilm_model_id", None)
+        monkeypatch.setattr(app, "minilm_active_backend", backend)
+        model_ids[backend] = app.get_minilm_model_id()
+
+    assert model_ids["onnx"].startswith("onnx:")
+    assert model_ids["torch"].startswith("torch:")
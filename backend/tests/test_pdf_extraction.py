@@ -0,0 +1,32 @@
+import pytest
+
+pymupdf = pytest.importorskip("pymupdf")
+
+from pdf_extraction import count_pdf_pages, extract_pdf_page_range
+
+
+@pytest.fixture
+def pdf_bytes():
+    """Two pages: one with a text layer, one blank (like a scanned or handwritten page)."""
+    doc = pymupdf.open()
+    doc.new_page().insert_text((72, 72), "Question 1: photosynthesis turns light into chemical energy.")
+    doc.new_page()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_pages_without_a_text_layer_are_rendered_for_ocr(pdf_bytes):
+    pages = extract_pdf_page_range(pdf_bytes, 0, count_pdf_pages(pdf_bytes), min_page_chars=25, render_dpi=50)
+
+    assert [page["page"] for page in pages] == [1, 2]
+    assert pages[0]["text"].startswith("Question 1: photosynthesis")
+    assert pages[0]["image"] is None
+    assert pages[1]["text"] is None
+    assert pages[1]["image"].startswith(b"\x89PNG")
+
+
+def test_page_range_is_clamped_to_the_document(pdf_bytes):
+    pages = extract_pdf_page_range(pdf_bytes, 1, 10, render_dpi=50)
+
+    assert [page["page"] for page in pages] == [2]
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("googleapiclient")
+pytest.importorskip("app")
+
+
+def test_entries_are_read_back_from_the_persistent_layer(make_disk_cache):
+    cache = make_disk_cache()
+    cache.set("a", {"text": "alpha"})
+    cache.set_many({"b": {"text": "beta"}, "c": {"text": "gamma"}})
+
+    reopened = make_disk_cache()
+
+    assert reopened.get("a") == {"text": "alpha"}
+    assert reopened.get_many(["b", "c", "missing"]) == {"b": {"text": "beta"}, "c": {"text": "gamma"}}
+    assert reopened.misses == 1
+
+
+def test_persistent_layer_is_bounded_by_max_entries(make_disk_cache):
+    cache = make_disk_cache(max_entries=10)
+    for index in range(25):
+        cache.set(f"key{index}", {"index": index})
+    cache.set_many({f"batch{index}": {"index": index} for index in range(25)})
+
+    stored = [name for name in os.listdir(cache.directory) if name.endswith(".json")]
+    assert len(stored) <= 10
+
+
+def test_delete_matching_removes_only_tagged_entries(make_disk_cache):
+    cache = make_disk_cache()
+    cache.set("a", {"course_id": "c1", "assignment_id": "a1"})
+    cache.set("b", {"course_id": "c1", "assignment_id": "a2"})
+    cache.set("c", {"course_id": "c2", "assignment_id": "a1"})
+
+    assert cache.delete_matching({"course_id": "c1", "assignment_id": "a1"}) == 1
+
+    reopened = make_disk_cache()
+    assert reopened.get("a") is None
+    assert reopened.get("b") is not None
+    assert reopened.get("c") is not None
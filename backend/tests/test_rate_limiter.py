@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("googleapiclient")
+app = pytest.importorskip("app")
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"error")
+
+
+@pytest.fixture
+def limiters(monkeypatch):
+    """Fresh, fast buckets for the Google services; retry backoff is skipped."""
+    buckets = {name: app.TokenBucket(name, rate_per_minute=6000) for name in ("classroom", "drive")}
+    for name, bucket in buckets.items():
+        monkeypatch.setitem(app.api_rate_limiters, name, bucket)
+    monkeypatch.setattr(app, "backoff_delay", lambda attempt: 0)
+    return buckets
+
+
+def test_bucket_allows_a_burst_then_throttles():
+    bucket = app.TokenBucket("test", rate_per_minute=60, burst=2)
+
+    bucket.acquire()
+    bucket.acquire()
+
+    assert bucket.stats()["calls"] == 2
+    assert bucket._take_or_wait_time() == pytest.approx(1.0, abs=0.05)
+
+
+def test_acquire_takes_one_token_per_api_call():
+    bucket = app.TokenBucket("test", rate_per_minute=60, burst=5)
+
+    bucket.acquire(3)
+
+    assert bucket.stats()["calls"] == 3
+    assert bucket.stats()["available_tokens"] == pytest.approx(2, abs=0.05)
+
+
+def test_async_acquire_waits_for_a_refill():
+    bucket = app.TokenBucket("test", rate_per_minute=600, burst=1)
+
+    async def acquire_twice():
+        await bucket.acquire_async()
+        await bucket.acquire_async()
+
+    started = time.monotonic()
+    asyncio.run(acquire_twice())
+
+    assert time.monotonic() - started >= 0.08
+    assert bucket.stats()["throttled"] == 1
+
+
+def test_retryable_errors_are_retried(limiters):
+    attempts = []
+
+    def flaky_call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise http_error(429)
+        return "ok"
+
+    assert app.call_with_rate_limit("classroom", flaky_call) == "ok"
+    assert limiters["classroom"].stats()["retries"] == 2
+
+
+def test_non_retryable_errors_are_raised_at_once(limiters):
+    attempts = []
+
+    def missing_call():
+        attempts.append(1)
+        raise http_error(404)
+
+    with pytest.raises(HttpError):
+        app.call_with_rate_limit("classroom", missing_call)
+    assert len(attempts) == 1
+
+
+def test_google_requests_use_the_named_service_bucket(limiters, monkeypatch):
+    monkeypatch.setattr(app, "send_google_request", lambda http_request: "response")
+
+    assert asyncio.run(app.run_google_request(object(), "drive")) == "response"
+    assert limiters["drive"].stats()["calls"] == 1
+    assert limiters["classroom"].stats()["calls"] == 0
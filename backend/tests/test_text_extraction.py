@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("googleapiclient")
+app = pytest.importorskip("app")
+
+DRIVE_SERVICE = SimpleNamespace(files=lambda: SimpleNamespace(get=lambda **kwargs: kwargs))
+
+
+@pytest.fixture
+def drive_file(make_disk_cache, monkeypatch):
+    """A Drive file whose metadata the test can change; records every text extraction."""
+    monkeypatch.setattr(app, "extracted_text_cache", make_disk_cache("extracted_text"))
+    metadata = {"mimeType": "application/pdf", "name": "essay.pdf", "md5Checksum": "v1"}
+    extractions = []
+    state = SimpleNamespace(metadata=metadata, extractions=extractions, failing=False)
+
+    def extract_drive_file_text(drive_service, file_id, mime_type, actual_file_name):
+        extractions.append(metadata["md5Checksum"])
+        return None if state.failing else f"essay text {metadata['md5Checksum']}"
+
+    monkeypatch.setattr(app, "execute_google_request", lambda http_request, api_name: dict(metadata))
+    monkeypatch.setattr(app, "extract_drive_file_text", extract_drive_file_text)
+    return state
+
+
+def test_unchanged_drive_file_is_extracted_once(drive_file):
+    assert app.download_drive_file_content(DRIVE_SERVICE, "file-1") == "essay text v1"
+    assert app.download_drive_file_content(DRIVE_SERVICE, "file-1") == "essay text v1"
+    assert drive_file.extractions == ["v1"]
+
+
+def test_new_file_version_is_extracted_again(drive_file):
+    app.download_drive_file_content(DRIVE_SERVICE, "file-1")
+    drive_file.metadata["md5Checksum"] = "v2"
+
+    assert app.download_drive_file_content(DRIVE_SERVICE, "file-1") == "essay text v2"
+    assert drive_file.extractions == ["v1", "v2"]
+
+
+def test_failed_extraction_is_not_cached(drive_file):
+    drive_file.failing = True
+    assert app.download_drive_file_content(DRIVE_SERVICE, "file-1") is None
+
+    drive_file.failing = False
+    assert app.download_drive_file_content(DRIVE_SERVICE, "file-1") == "essay text v1"
+    assert drive_file.extractions == ["v1", "v1"]
+
+
+@pytest.fixture
+def pdf_pages(monkeypatch):
+    """Three PDF pages, the second one without a text layer; records the images sent to OCR."""
+    pages = [
+        {"page": 1, "text": "Typed answer one", "image": None},
+        {"page": 2, "text": None, "image": b"png-page-2"},
+        {"page": 3, "text": "Typed answer three", "image": None},
+    ]
+    ocr_inputs = []
+
+    def run_ocr(content_bytes, file_name="unknown"):
+        ocr_inputs.append(content_bytes)
+        return {"text": "Handwritten answer two", "pages": []}
+
+    monkeypatch.setattr(app, "extract_pdf_pages", lambda pdf_bytes: [dict(page) for page in pages])
+    monkeypatch.setattr(app, "run_ocr", run_ocr)
+    return ocr_inputs
+
+
+def test_pdf_text_layer_is_used_and_only_scanned_pages_are_ocrd(pdf_pages):
+    text = app.extract_pdf_text(b"%PDF", "essay.pdf")
+
+    assert text == "Typed answer one\n\nHandwritten answer two\n\nTyped answer three"
+    assert pdf_pages == [b"png-page-2"]
+
+
+def test_pdf_with_a_failed_ocr_page_yields_no_text(pdf_pages, monkeypatch):
+    monkeypatch.setattr(app, "run_ocr", lambda content_bytes, file_name="unknown": None)
+
+    assert app.extract_pdf_text(b"%PDF", "essay.pdf") is None
+
+
+def test_unparseable_pdf_falls_back_to_whole_file_ocr(monkeypatch):
+    def extract_pdf_pages(pdf_bytes):
+        raise RuntimeError("broken xref table")
+
+    monkeypatch.setattr(app, "extract_pdf_pages", extract_pdf_pages)
+    monkeypatch.setattr(app, "run_ocr", lambda content_bytes, file_name="unknown": {"text": f"ocr of {content_bytes!r}", "pages": []})
+
+    assert app.extract_pdf_text(b"%PDF", "essay.pdf") == "ocr of b'%PDF'"
@@ -17,6 +17,31 @@ const API = axios.create({
   withCredentials: true, // Crucial for sending/receiving session cookies
 });
 
+// Per-section endpoints, used to retry a section that failed inside the dashboard bootstrap
+const bootstrapSectionFetchers = {
+  courses: () => API.get('/api/courses'),
+  assignments: (courseId) => API.get(`/api/courses/${courseId}/assignments`),
+  submissions: (courseId, assignmentId) =>
+    API.get(`/api/courses/${courseId}/assignments/${assignmentId}/submissions`),
+  grades: (courseId, assignmentId) =>
+    API.get('/api/graded_history', { params: { course_id: courseId, assignment_id: assignmentId } })
+};
+
+// Courses, assignments of courseId, and submissions (with student names) and saved grades
+// of assignmentId in one round trip. Sections the backend failed to load are refetched
+// individually, so one flaky section does not cost a reload of the whole payload.
+const fetchBootstrap = async (courseId, assignmentId) => {
+  const response = await API.get('/api/dashboard/bootstrap', {
+    params: { course_id: courseId, assignment_id: assignmentId }
+  });
+  const { errors = {}, ...data } = response.data;
+  await Promise.all(Object.keys(errors).map(async section => {
+    const retry = await bootstrapSectionFetchers[section](courseId, assignmentId);
+    data[section] = retry.data;
+  }));
+  return data;
+};
+
 function App() {
   return (
     <Router>
@@ -37,4 +62,4 @@ function App() {
 }
 
 export default App;
-export { API }; // Export the configured Axios instance
\ No newline at end of file
+export { API, fetchBootstrap }; // Export the configured Axios instance and the bootstrap loader
\ No newline at end of file
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
-import { API } from '../App';
+import { API, fetchBootstrap } from '../App';
 
-function SubmissionDetail({ courseId, courseName, assignmentId, assignmentTitle, generatedAnswerKey, providedAnswerKeyUrl, useHybrid = true }) {
+function SubmissionDetail({ courseId, courseName, assignmentId, assignmentTitle, generatedAnswerKey, providedAnswerKeyUrl, useHybrid = true, initialSubmissions, initialGradedHistory }) {
   const [submissions, setSubmissions] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -19,17 +19,15 @@ function SubmissionDetail({ courseId, courseName, assignmentId, assignmentTitle,
       try {
         setLoading(true);
         
-        // Fetch submissions from Google Classroom
-        const response = await API.get(
-          `/api/courses/${courseId}/assignments/${assignmentId}/submissions`
-        );
-        setSubmissions(response.data);
-        
-        // Fetch graded history from MongoDB for this specific assignment
-        const historyResponse = await API.get(
-          `/api/graded_history?course_id=${courseId}&assignment_id=${assignmentId}`
-        );
-        const gradedHistory = historyResponse.data;
+        let submissionList = initialSubmissions;
+        let gradedHistory = initialGradedHistory;
+        if (!submissionList || !gradedHistory) {
+          // Submissions from Google Classroom and graded history from MongoDB in one round trip
+          const bootstrap = await fetchBootstrap(courseId, assignmentId);
+          submissionList = bootstrap.submissions;
+          gradedHistory = bootstrap.grades;
+        }
+        setSubmissions(submissionList);
         
         // Map graded history to submissions by submission_id
         const submissionsWithGrades = {};
@@ -60,7 +58,7 @@ function SubmissionDetail({ courseId, courseName, assignmentId, assignmentTitle,
     };
 
     fetchSubmissions();
-  }, [courseId, assignmentId]);
+  }, [courseId, assignmentId, initialSubmissions, initialGradedHistory]);
   
   // Update answer key text when generatedAnswerKey prop changes
   useEffect(() => {
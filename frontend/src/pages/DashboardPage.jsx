@@ -1,7 +1,7 @@
 // frontend/src/pages/DashboardPage.jsx
 import React, { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { API } from '../App'; // Import the configured Axios instance
+import { API, fetchBootstrap } from '../App'; // Import the configured Axios instance and bootstrap loader
 import CourseList from '../components/CourseList';
 import AssignmentList from '../components/AssignmentList';
 import SubmissionDetail from '../components/SubmissionDetail'; // Make sure this path is correct
@@ -24,8 +24,8 @@ function DashboardPage() {
       setLoading(true);
       setError(null);
       try {
-        const response = await API.get('/api/courses');
-        setCourses(response.data);
+        const bootstrap = await fetchBootstrap();
+        setCourses(bootstrap.courses);
       } catch (err) {
         if (err.response && err.response.status === 401) {
           alert("Session expired or not authenticated. Please log in again.");
@@ -61,8 +61,8 @@ function DashboardPage() {
 
       const fetchAssignments = async () => {
         try {
-          const response = await API.get(`/api/courses/${selectedCourse.id}/assignments`);
-          setAssignments(response.data);
+          const bootstrap = await fetchBootstrap(selectedCourse.id);
+          setAssignments(bootstrap.assignments);
         } catch (err) {
           setError(`Failed to fetch assignments: ${err.response?.data?.error || err.message}`);
         } finally {
@@ -83,8 +83,18 @@ function DashboardPage() {
 
       const fetchSubmissions = async () => {
         try {
-          const response = await API.get(`/api/courses/${selectedCourse.id}/assignments/${selectedAssignment.id}/submissions`);
-          setSubmissions(response.data);
+          const bootstrap = await fetchBootstrap(selectedCourse.id, selectedAssignment.id);
+          // Show grades saved by Grade Pilot for submissions not yet graded in Classroom
+          const savedGrades = {};
+          bootstrap.grades.forEach(grade => {
+            if (!(grade.submission_id in savedGrades)) {
+              savedGrades[grade.submission_id] = grade.assignedGrade; // Most recent first
+            }
+          });
+          setSubmissions(bootstrap.submissions.map(sub => ({
+            ...sub,
+            assignedGrade: sub.assignedGrade ?? savedGrades[sub.id]
+          })));
           // Important: If you want to auto-select the first submission, do it here
           // if (response.data.length > 0) {
           //   setSelectedSubmission(response.data[0]); 
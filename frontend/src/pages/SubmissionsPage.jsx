@@ -1,13 +1,14 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, useLocation } from 'react-router-dom';
 import SubmissionDetail from '../components/SubmissionDetail';
-import { API } from '../App';
+import { fetchBootstrap } from '../App';
 
 const SubmissionsPage = () => {
   const { courseId, assignmentId } = useParams();
   const location = useLocation();
   const [courseDetails, setCourseDetails] = useState(null);
   const [assignmentDetails, setAssignmentDetails] = useState(null);
+  const [bootstrap, setBootstrap] = useState(null);
   const [loading, setLoading] = useState(true);
   
   // Get the generated answer key from navigation state (if coming from Grade Without Key workflow)
@@ -20,16 +21,14 @@ const SubmissionsPage = () => {
   useEffect(() => {
     const fetchDetails = async () => {
       try {
-        // Fetch course details
-        const courseResponse = await API.get(`/api/courses`);
-        const course = courseResponse.data.find(c => c.id === courseId);
-        
-        // Fetch assignment details
-        const assignmentResponse = await API.get(`/api/courses/${courseId}/assignments`);
-        const assignment = assignmentResponse.data.find(a => a.id === assignmentId);
+        // Courses, assignments, submissions and saved grades in one round trip
+        const bootstrap = await fetchBootstrap(courseId, assignmentId);
+        const course = bootstrap.courses.find(c => c.id === courseId);
+        const assignment = bootstrap.assignments.find(a => a.id === assignmentId);
         
         setCourseDetails(course);
         setAssignmentDetails(assignment);
+        setBootstrap(bootstrap);
       } catch (error) {
         console.error('Error fetching details:', error);
       } finally {
@@ -101,6 +100,8 @@ const SubmissionsPage = () => {
         generatedAnswerKey={generatedAnswerKey}
         providedAnswerKeyUrl={answerKeyUrl}
         useHybrid={useHybrid}
+        initialSubmissions={bootstrap?.submissions}
+        initialGradedHistory={bootstrap?.grades}
       />
     </div>
   );